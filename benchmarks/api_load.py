@@ -0,0 +1,156 @@
+"""API latency under load, before and while a report is generated.
+
+Opens `--connections` keep-alive connections that call
+`GET /get_report/<unknown id>` (a report lookup answered with a 404) as fast
+as the server answers. After a `--duration` second baseline it triggers a
+report and keeps going until the report leaves `pending`/`running` (or
+`--timeout`), then prints latency percentiles for both phases, or JSON with
+`--json`.
+
+    uvicorn monitor:app --workers 1 &
+    python -m monitor.worker &            # unless REPORT_QUEUE=background
+    python -m benchmarks.api_load --url http://127.0.0.1:8000 --connections 50
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+PROBE_PATH = "/get_report/load-test-probe"
+
+
+class Connection:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            "Content-Length: 0\r\n\r\n".encode()
+        )
+        await self.writer.drain()
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status = int(head.split(b" ", 2)[1])
+        length = 0
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value)
+        body = await self.reader.readexactly(length)
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {"requests": 0}
+    latencies = sorted(latencies)
+
+    def at(fraction):
+        return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(at(0.50) * 1000, 2),
+        "p95_ms": round(at(0.95) * 1000, 2),
+        "p99_ms": round(at(0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+async def poll(connection, path, phase, latencies, errors):
+    while phase[0] is not None:
+        started = time.perf_counter()
+        try:
+            status, _ = await connection.request("GET", path)
+        except (OSError, asyncio.IncompleteReadError):
+            connection.close()
+            connection.writer = None
+            errors[phase[0]] = errors.get(phase[0], 0) + 1
+            await asyncio.sleep(0.1)
+            continue
+        if status >= 500:
+            errors[phase[0]] = errors.get(phase[0], 0) + 1
+        latencies.setdefault(phase[0], []).append(time.perf_counter() - started)
+
+
+async def run(url, connections, duration, timeout):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    control = Connection(host, port)
+    phase, latencies, errors = ["baseline"], {}, {}
+    pool = [Connection(host, port) for _ in range(connections)]
+    tasks = [
+        asyncio.create_task(poll(connection, PROBE_PATH, phase, latencies, errors))
+        for connection in pool
+    ]
+    await asyncio.sleep(duration)
+    phase[0] = "during_report"
+    started = time.perf_counter()
+    _, body = await control.request("POST", "/trigger_report")
+    status = await wait_for_report(control, json.loads(body)["report_id"], timeout)
+    report_seconds = time.perf_counter() - started
+    phase[0] = None
+    await asyncio.gather(*tasks)
+    for connection in [control, *pool]:
+        connection.close()
+    return {
+        "connections": connections,
+        "report_status": status,
+        "report_seconds": round(report_seconds, 2),
+        **{
+            name: {**percentiles(values), "errors": errors.get(name, 0)}
+            for name, values in latencies.items()
+        },
+    }
+
+
+async def wait_for_report(connection, report_id, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        _, body = await connection.request("GET", f"/get_report/{report_id}")
+        try:
+            status = json.loads(body)["status"]
+        except (ValueError, KeyError, TypeError):
+            return "finished"  # the CSV itself came back
+        if status not in ("pending", "running"):
+            return status
+        await asyncio.sleep(0.5)
+    return "timeout"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10, help="baseline seconds")
+    parser.add_argument("--timeout", type=float, default=600, help="report seconds")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    result = asyncio.run(run(args.url, args.connections, args.duration, args.timeout))
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"report {result['report_status']} in {result['report_seconds']}s")
+    for name in ("baseline", "during_report"):
+        stats = result.get(name, {})
+        print(
+            f"{name:<14} {stats.get('requests', 0):>7} req  "
+            f"p50 {stats.get('p50_ms', '-')}ms  p95 {stats.get('p95_ms', '-')}ms  "
+            f"p99 {stats.get('p99_ms', '-')}ms  max {stats.get('max_ms', '-')}ms  "
+            f"errors {stats.get('errors', 0)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Synthetic store fleets for benchmarks.
+
+Fills store_timezones, store_timings and store_pings of the configured
+database (`DATABASE_URL`, SQLite or MySQL) with `--stores` stores:
+- timezones drawn from a weighted mix (`--zones Asia/Kolkata=1,...`),
+- business hours with a share of overnight shifts (close before open), of
+  single missing days and of stores without any rows (open all day),
+- a week and a day of pings, `--pings-per-hour` per store with jitter, whose
+  status flips between active and inactive in streaks.
+
+Existing rows are only replaced with `--reset`. Redis caches are invalidated
+afterwards, so reports see the new fleet.
+
+    DATABASE_URL=sqlite:////tmp/fleet.db python -m benchmarks.fleet --stores 10000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from monitor.model import Base, Status, StorePings, StoreTimezones, StoreTimings
+from monitor.session import engine
+
+NOW = datetime(2023, 1, 25, 18, 13, 22)  # end of the sample data, report as_of
+ZONES = {
+    "America/Chicago": 4,
+    "America/New_York": 3,
+    "America/Denver": 1,
+    "America/Los_Angeles": 2,
+    "America/Boise": 0.5,
+    "Asia/Kolkata": 0.5,
+}
+BATCH = 20000
+
+
+def parse_zones(value):
+    zones = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        zones[name.strip()] = float(weight or 1)
+    return zones
+
+
+def store_hours(rnd, overnight, missing_day):
+    hours = {}
+    for day in range(7):
+        if rnd.random() < missing_day:
+            continue  # open all day
+        if rnd.random() < overnight:
+            hours[day] = (
+                datetime.min.replace(hour=rnd.randint(17, 21)).time(),
+                datetime.min.replace(hour=rnd.randint(1, 4)).time(),
+            )
+        else:
+            hours[day] = (
+                datetime.min.replace(hour=rnd.randint(5, 11), minute=30).time(),
+                datetime.min.replace(hour=rnd.randint(17, 23), minute=59).time(),
+            )
+    return hours
+
+
+def store_pings(rnd, store_id, pings_per_hour, now, days, active, streak):
+    interval = 3600 / pings_per_hour
+    moment = now - timedelta(days=days, seconds=rnd.uniform(0, interval))
+    status = Status.active
+    while moment < now:
+        if rnd.random() > streak:
+            status = Status.active if rnd.random() < active else Status.inactive
+        yield {"store_id": store_id, "status": status, "timestamp_utc": moment}
+        moment += timedelta(seconds=interval * rnd.uniform(0.5, 1.5))
+
+
+def fleet_rows(args):
+    """Yield (table, row) for the whole fleet, stores in id order."""
+    rnd = random.Random(args.seed)
+    names, weights = zip(*args.zones.items())
+    timing_id = 0
+    for store_id in range(1, args.stores + 1):
+        yield StoreTimezones, {
+            "store_id": store_id,
+            "timezone_str": rnd.choices(names, weights)[0],
+        }
+        if rnd.random() >= args.no_hours:
+            hours = store_hours(rnd, args.overnight, args.missing_day)
+            for day, (start, end) in hours.items():
+                timing_id += 1
+                yield StoreTimings, {
+                    "id": timing_id,
+                    "store_id": store_id,
+                    "day": day,
+                    "start_time_local": start,
+                    "end_time_local": end,
+                }
+        for ping in store_pings(
+            rnd,
+            store_id,
+            args.pings_per_hour,
+            args.now,
+            args.days,
+            args.active,
+            args.streak,
+        ):
+            yield StorePings, ping
+
+
+def write_fleet(args):
+    tables = [StoreTimezones, StoreTimings, StorePings]
+    Base.metadata.create_all(engine, tables=[table.__table__ for table in tables])
+    with engine.begin() as connection:
+        existing = sum(
+            connection.scalar(select(func.count()).select_from(table))
+            for table in tables
+        )
+        if existing and not args.reset:
+            raise SystemExit(f"{existing} rows already there, pass --reset")
+        for table in tables:
+            connection.execute(delete(table))
+    batches = {table: [] for table in tables}
+    counts = {table: 0 for table in tables}
+    ping_id = 0
+    with engine.begin() as connection:
+        for table, row in fleet_rows(args):
+            if table is StorePings:
+                ping_id += 1
+                row["id"] = ping_id
+            batches[table].append(row)
+            if len(batches[table]) >= BATCH:
+                connection.execute(insert(table), batches[table])
+                counts[table] += len(batches[table])
+                batches[table] = []
+        for table, rows in batches.items():
+            if rows:
+                connection.execute(insert(table), rows)
+                counts[table] += len(rows)
+    return {table.__tablename__: count for table, count in counts.items()}
+
+
+def invalidate_caches():
+    # imported late, both need Redis
+    from monitor.queries import invalidate_timezones
+    from monitor.schedule import invalidate_schedules
+
+    invalidate_timezones()
+    invalidate_schedules()
+
+
+def fleet_parser(parser=None):
+    parser = parser or argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pings-per-hour", type=float, default=1.0)
+    parser.add_argument("--days", type=float, default=8, help="days of pings")
+    parser.add_argument("--now", type=datetime.fromisoformat, default=NOW)
+    parser.add_argument("--zones", type=parse_zones, default=ZONES)
+    parser.add_argument("--overnight", type=float, default=0.1, help="share of days")
+    parser.add_argument(
+        "--missing-day", type=float, default=0.1, help="share of days without hours"
+    )
+    parser.add_argument(
+        "--no-hours", type=float, default=0.1, help="share of stores without hours"
+    )
+    parser.add_argument("--active", type=float, default=0.9, help="share of active")
+    parser.add_argument(
+        "--streak", type=float, default=0.8, help="chance a status carries on"
+    )
+    parser.add_argument("--reset", action="store_true", help="replace existing rows")
+    return parser
+
+
+def main():
+    parser = fleet_parser()
+    parser.add_argument("--stores", type=int, default=1000)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    counts = write_fleet(args)
+    invalidate_caches()
+    print(f"{counts} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
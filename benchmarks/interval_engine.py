@@ -0,0 +1,175 @@
+"""Interval mode against the ping count estimates of python mode, as JSON.
+
+Both modes report every chunk of `--chunk-size` stores of a synthetic fleet
+(`benchmarks.fleet`, or the rows already in `DATABASE_URL` with
+`--existing`) as of `--now`, `--repeats` times. The output has their chunk
+timings and, per report column, how far interval mode's durations are from
+python mode's estimates:
+- `mean_abs`, `p50_abs`, `p95_abs`, `max_abs` and `mean` (interval minus
+  python) over stores both report, in the column's unit,
+- `over_1` the share of stores apart by more than one unit,
+- `covered` the mean share of the window's business hours either mode
+  accounts for as up or down, which the count estimates miss or exceed,
+- `week_hours`, stores whose `working_hours_week` differs from the open
+  hours of their compiled schedule, and by how much on average,
+- `stores`, the `--top` stores furthest apart on the week, with both rows.
+
+    DATABASE_URL=sqlite:////tmp/fleet.db \\
+        python -m benchmarks.interval_engine --stores 10000 --reset
+"""
+import argparse
+import json
+import statistics
+from datetime import timedelta
+
+from benchmarks.fleet import fleet_parser, invalidate_caches, write_fleet
+from benchmarks.report_pipeline import summary, timed
+from monitor.env import REPORT_CHUNK_SIZE
+from monitor.intervals import bulk_interval_report
+from monitor.main import bulk_store_report
+from monitor.queries import chunk_timezones, get_timezones
+from monitor.report import machine_user_text, working_hours_week
+from monitor.schedule import load_store_schedules, load_store_timings
+from monitor.windows import DEFAULT_WINDOWS
+from monitor.zones import local_time
+
+COLUMNS = list(machine_user_text.values())
+
+
+def run_modes(now, chunk_size, repeats):
+    rows = {"python": {}, "interval": {}}
+    seconds = {"python": [], "interval": []}
+    for _ in range(repeats):
+        for timezones in chunk_timezones(get_timezones(), chunk_size=chunk_size):
+            for mode, bulk_report in (
+                ("python", bulk_store_report),
+                ("interval", bulk_interval_report),
+            ):
+                chunk_rows, chunk_seconds = timed(
+                    bulk_report, timezones, current_time=now
+                )
+                seconds[mode].append(chunk_seconds)
+                rows[mode].update((row[0], row[1:]) for row in chunk_rows)
+    return rows, {mode: summary(values) for mode, values in seconds.items()}
+
+
+def open_hours(store_ids, now):
+    """Business hours of each default window, per store, in the column unit."""
+    timezones = get_timezones()
+    schedules = load_store_schedules(store_ids)
+    hours = {}
+    for store_id in store_ids:
+        end = local_time(now, timezones[store_id])
+        hours[store_id] = [
+            schedules[store_id].open_seconds(
+                end - timedelta(seconds=window.seconds), end
+            )
+            / window.unit_seconds
+            for window in DEFAULT_WINDOWS
+        ]
+    return hours
+
+
+def column_differences(rows, hours):
+    store_ids = sorted(rows["python"].keys() & rows["interval"].keys())
+    columns = {}
+    for column, name in enumerate(COLUMNS):
+        diffs = sorted(
+            rows["interval"][store_id][column] - rows["python"][store_id][column]
+            for store_id in store_ids
+        )
+        absolute = sorted(abs(diff) for diff in diffs)
+        columns[name] = {
+            "mean_abs": round(statistics.fmean(absolute), 3),
+            "p50_abs": round(absolute[len(absolute) // 2], 3),
+            "p95_abs": round(
+                absolute[min(int(len(absolute) * 0.95), len(absolute) - 1)], 3
+            ),
+            "max_abs": round(absolute[-1], 3),
+            "mean": round(statistics.fmean(diffs), 3),
+            "over_1": round(sum(diff > 1 for diff in absolute) / len(absolute), 4),
+        }
+    for window, name in enumerate(COLUMNS[::2]):
+        covered = {}
+        for mode in rows:
+            shares = [
+                (
+                    rows[mode][store_id][2 * window]
+                    + rows[mode][store_id][2 * window + 1]
+                )
+                / hours[store_id][window]
+                for store_id in store_ids
+                if hours[store_id][window]
+            ]
+            covered[mode] = round(statistics.fmean(shares), 4) if shares else None
+        columns[name]["covered"] = covered
+    return store_ids, columns
+
+
+def week_hours(store_ids):
+    timings = load_store_timings(store_ids)
+    schedules = load_store_schedules(store_ids)
+    missing = [
+        schedules[store_id].weekly_seconds / 3600
+        - working_hours_week(timings.get(store_id, {}))
+        for store_id in store_ids
+    ]
+    differing = [hours for hours in missing if abs(hours) > 1e-6]
+    return {
+        "stores": len(differing),
+        "mean_hours": round(statistics.fmean(differing), 3) if differing else 0,
+    }
+
+
+def furthest_stores(rows, store_ids, top):
+    week = COLUMNS.index(machine_user_text["active_week"])
+    ranked = sorted(
+        store_ids,
+        key=lambda store_id: abs(
+            rows["interval"][store_id][week] - rows["python"][store_id][week]
+        ),
+        reverse=True,
+    )
+    return [
+        {
+            "store_id": store_id,
+            "python": rows["python"][store_id],
+            "interval": rows["interval"][store_id],
+        }
+        for store_id in ranked[:top]
+    ]
+
+
+def main():
+    parser = fleet_parser(argparse.ArgumentParser(description=__doc__.splitlines()[0]))
+    parser.add_argument("--stores", type=int, default=10000)
+    parser.add_argument(
+        "--existing", action="store_true", help="report the rows already there"
+    )
+    parser.add_argument("--chunk-size", type=int, default=REPORT_CHUNK_SIZE)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="stores listed")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    result = {"now": args.now.isoformat(), "chunk_size": args.chunk_size}
+    if not args.existing:
+        result["rows"] = write_fleet(args)
+        invalidate_caches()
+    # warm the timezone and schedule caches like a running service would
+    load_store_schedules(list(get_timezones()))
+    rows, result["chunks"] = run_modes(args.now, args.chunk_size, args.repeats)
+    store_ids, result["columns"] = column_differences(
+        rows, open_hours(list(rows["interval"]), args.now)
+    )
+    result["week_hours"] = week_hours(store_ids)
+    result["stores"] = furthest_stores(rows, store_ids, args.top)
+    encoded = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(encoded + "\n")
+    else:
+        print(encoded)
+
+
+if __name__ == "__main__":
+    main()
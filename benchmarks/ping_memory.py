@@ -0,0 +1,113 @@
+"""Memory and speed of per-store pings as Row + LocalPing lists vs PingArray.
+
+Rows come from an in-memory SQLite table shaped like store_pings, so they are
+the same Row objects the report query hands out.
+
+    python -m benchmarks.ping_memory --pings 1000000
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from monitor.model import Base, Status, StorePings
+from monitor.pingstore import PingArray, array_store_report
+from monitor.report import LocalPing, store_report
+from monitor.zones import localize
+
+TIMEZONE = "America/Chicago"
+TIMINGS = {
+    day: (datetime(2023, 1, 1, 9).time(), datetime(2023, 1, 1, 22).time())
+    for day in range(5)
+}
+
+
+def fetch_rows(count, current_time):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[StorePings.__table__])
+    with engine.begin() as connection:
+        connection.execute(
+            insert(StorePings),
+            [
+                {
+                    "id": index + 1,
+                    "store_id": 1,
+                    "status": random.choice([Status.active] * 9 + [Status.inactive]),
+                    "timestamp_utc": current_time - timedelta(seconds=index * 7),
+                }
+                for index in range(count)
+            ],
+        )
+    with Session(engine) as session:
+        return session.execute(
+            select(
+                StorePings.status, StorePings.timestamp_utc, StorePings.store_id
+            ).order_by(StorePings.timestamp_utc.desc())
+        ).all()
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def local_pings(rows):
+    return [
+        LocalPing(status=row.status, local_time=moment)
+        for row, moment in zip(
+            rows, localize([row.timestamp_utc for row in rows], TIMEZONE)
+        )
+    ]
+
+
+def build_array(rows):
+    pings = PingArray(TIMEZONE)
+    pings.extend(rows)
+    return pings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pings", type=int, default=1_000_000)
+    args = parser.parse_args()
+    current_time = datetime(2023, 1, 25, 18, 13, 22)
+
+    rows, rows_size = measure(lambda: fetch_rows(args.pings, current_time))
+    _, local_size = measure(lambda: local_pings(rows))
+    started = time.perf_counter()
+    reference = store_report(
+        rows, timings=TIMINGS, timezone=TIMEZONE, current_time=current_time
+    )
+    reference_time = time.perf_counter() - started
+
+    _, array_size = measure(lambda: build_array(rows))
+    started = time.perf_counter()
+    pings = build_array(rows)
+    build_time = time.perf_counter() - started
+    started = time.perf_counter()
+    compact = array_store_report(pings, timings=TIMINGS, current_time=current_time)
+    compact_time = time.perf_counter() - started
+
+    print(f"pings        {args.pings}")
+    print(
+        f"Row + LocalPing  {(rows_size + local_size) / args.pings:6.1f} B/ping  "
+        f"report {reference_time:.2f}s"
+    )
+    print(
+        f"PingArray        {array_size / args.pings:6.1f} B/ping  "
+        f"report {compact_time:.2f}s (build {build_time:.2f}s)"
+    )
+    print(f"same result      {reference == compact}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Report pipeline timings on synthetic fleets, as JSON.
+
+For each `--stores` size a fleet is generated with `benchmarks.fleet` (into
+`DATABASE_URL`, which should be a scratch SQLite file or MySQL schema; Redis
+is needed for the caches) and timed:
+- `generate_report` end to end,
+- `bulk_store_report` over every chunk of `REPORT_CHUNK_SIZE` stores, with
+  the stage profile of that pass,
+- `store_report`, `last_hour_status` and `cumulative_status` per store, on the
+  already fetched pings of `--sample` stores, repeated `--repeats` times.
+
+    DATABASE_URL=sqlite:////tmp/bench.db \\
+        python -m benchmarks.report_pipeline --stores 1000 10000 100000 \\
+        --output bench.json
+
+Keep the JSON of each commit and compare them to see what a change did.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+
+from benchmarks.fleet import fleet_parser, invalidate_caches, write_fleet
+from monitor.env import REPORT_CHUNK_SIZE
+from monitor.main import bulk_store_report, generate_report
+from monitor.profiling import profiled
+from monitor.queries import chunk_timezones, get_timezones, stream_store_pings
+from monitor.report import (
+    LocalPing,
+    cumulative_status,
+    last_hour_status,
+    store_report,
+)
+from monitor.schedule import load_store_timings
+from monitor.session import engine
+from monitor.zones import local_time, localize
+
+
+def summary(seconds):
+    seconds = sorted(seconds)
+    return {
+        "calls": len(seconds),
+        "total_s": round(sum(seconds), 6),
+        "mean_us": round(statistics.fmean(seconds) * 1e6, 2),
+        "p50_us": round(seconds[len(seconds) // 2] * 1e6, 2),
+        "p95_us": round(
+            seconds[min(int(len(seconds) * 0.95), len(seconds) - 1)] * 1e6, 2
+        ),
+    }
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def time_generate_report(stores, now, mode):
+    _, seconds = timed(
+        generate_report, f"bench-{stores}", update_db=False, mode=mode, as_of=now
+    )
+    return {"seconds": round(seconds, 3)}
+
+
+def time_bulk_store_report(now, chunk_size):
+    chunk_seconds = []
+    rows = 0
+    with profiled() as profile:
+        for timezones in chunk_timezones(get_timezones(), chunk_size=chunk_size):
+            chunk_rows, seconds = timed(bulk_store_report, timezones, current_time=now)
+            chunk_seconds.append(seconds)
+            rows += len(chunk_rows)
+    stages = profile.as_dict()
+    return {
+        "rows": rows,
+        "chunk_size": chunk_size,
+        **summary(chunk_seconds),
+        "stages": stages["stages"],
+        "db": stages["db"],
+        "peak_rss_bytes": stages["peak_rss_bytes"],
+    }
+
+
+def sample_stores(now, sample):
+    timezones = get_timezones()
+    store_ids = sorted(timezones)[:sample]
+    timings = load_store_timings(store_ids)
+    return [
+        (pings, timings.get(store_id, {}), timezones[store_id])
+        for store_id, pings in stream_store_pings(
+            store_ids, since=now - timedelta(days=7), until=now
+        )
+    ]
+
+
+def time_store_functions(stores, now, repeats):
+    """Per-store call timings of the report functions on prefetched pings."""
+    seconds = {"store_report": [], "last_hour_status": [], "cumulative_status": []}
+    for pings, timings, timezone in stores:
+        local_pings = [
+            LocalPing(status=ping.status, local_time=moment)
+            for ping, moment in zip(
+                pings, localize([ping.timestamp_utc for ping in pings], timezone)
+            )
+        ]
+        local_now = local_time(now, timezone)
+        for _ in range(repeats):
+            seconds["store_report"].append(
+                timed(store_report, pings, timings, timezone, now)[1]
+            )
+            seconds["last_hour_status"].append(
+                timed(last_hour_status, local_pings, local_now, timings)[1]
+            )
+            seconds["cumulative_status"].append(
+                timed(cumulative_status, local_pings, timings, local_now)[1]
+            )
+    return {name: summary(values) for name, values in seconds.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(args, stores):
+    fleet_args = argparse.Namespace(**{**vars(args), "stores": stores})
+    counts, fleet_seconds = timed(write_fleet, fleet_args)
+    args.reset = True  # the next size replaces this fleet
+    invalidate_caches()
+    # warm the timezone and schedule caches like a running service would
+    load_store_timings(list(get_timezones()))
+    sample = sample_stores(args.now, args.sample)
+    return {
+        "stores": stores,
+        "rows": counts,
+        "fleet_seconds": round(fleet_seconds, 1),
+        "generate_report": time_generate_report(stores, args.now, args.mode),
+        "bulk_store_report": time_bulk_store_report(args.now, args.chunk_size),
+        **time_store_functions(sample, args.now, args.repeats),
+    }
+
+
+def main():
+    parser = fleet_parser(argparse.ArgumentParser(description=__doc__.splitlines()[0]))
+    parser.add_argument("--stores", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--mode", default="python", help="REPORT_MODE of the run")
+    parser.add_argument("--chunk-size", type=int, default=REPORT_CHUNK_SIZE)
+    parser.add_argument("--sample", type=int, default=200, help="stores per function")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    result = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "args": {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ("output", "now", "zones", "reset")
+        },
+        "now": args.now.isoformat(),
+        "zones": args.zones,
+    }
+    result["sizes"] = [run_size(args, stores) for stores in args.stores]
+    encoded = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(encoded + "\n")
+    else:
+        print(encoded)
+
+
+if __name__ == "__main__":
+    main()
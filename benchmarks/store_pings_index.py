@@ -0,0 +1,171 @@
+"""Compare the report ping query on the old and the covering store_pings index.
+
+Builds two synthetic copies of store_pings in the configured MySQL database,
+one with the original single column indexes and one with the composite
+(store_id, timestamp_utc, status) index, then prints EXPLAIN output and query
+latency for chunks of store ids.
+
+    python -m benchmarks.store_pings_index --rows 50000000 --stores 20000
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+
+from monitor.session import engine
+
+TABLES = {
+    "bench_pings_single": [
+        "CREATE INDEX ix_bench_single_store_id ON bench_pings_single (store_id)",
+        "CREATE INDEX ix_bench_single_status ON bench_pings_single (status)",
+    ],
+    "bench_pings_covering": [
+        "CREATE INDEX ix_bench_covering ON bench_pings_covering "
+        "(store_id, timestamp_utc, status)",
+    ],
+}
+SEED_TABLE = "bench_pings_seed"
+REPORT_QUERY = (
+    "SELECT status, timestamp_utc, store_id FROM {table} "
+    "WHERE store_id IN :store_ids AND timestamp_utc > :since "
+    "ORDER BY store_id, timestamp_utc DESC"
+)
+
+
+def create_table(connection, table):
+    connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    connection.execute(
+        text(
+            f"CREATE TABLE {table} ("
+            "id BIGINT AUTO_INCREMENT PRIMARY KEY, "
+            "store_id BIGINT NOT NULL, "
+            "status ENUM('active', 'inactive') NOT NULL, "
+            "timestamp_utc TIMESTAMP NOT NULL)"
+        )
+    )
+
+
+def fill_seed(connection, rows, stores, days, now):
+    create_table(connection, SEED_TABLE)
+    batch = [
+        {
+            "store_id": random.randint(1, stores),
+            "status": "active" if random.random() < 0.9 else "inactive",
+            "timestamp_utc": now - timedelta(seconds=random.randint(0, days * 86400)),
+        }
+        for _ in range(min(rows, 10000))
+    ]
+    connection.execute(
+        text(
+            f"INSERT INTO {SEED_TABLE} (store_id, status, timestamp_utc) "
+            "VALUES (:store_id, :status, :timestamp_utc)"
+        ),
+        batch,
+    )
+    total = len(batch)
+    while total < rows:
+        # double the table with fresh random values until it is large enough
+        connection.execute(
+            text(
+                f"INSERT INTO {SEED_TABLE} (store_id, status, timestamp_utc) "
+                f"SELECT FLOOR(1 + RAND() * :stores), "
+                "IF(RAND() < 0.9, 'active', 'inactive'), "
+                "TIMESTAMPADD(SECOND, -FLOOR(RAND() * :window), :now) "
+                f"FROM {SEED_TABLE} LIMIT :limit"
+            ),
+            {
+                "stores": stores,
+                "window": days * 86400,
+                "now": now,
+                "limit": rows - total,
+            },
+        )
+        total = min(rows, total * 2)
+        connection.commit()
+        print(f"seeded {total} rows")
+
+
+def build_tables(rows, stores, days, now):
+    with engine.connect() as connection:
+        fill_seed(connection, rows, stores, days, now)
+        for table, indexes in TABLES.items():
+            create_table(connection, table)
+            connection.execute(text(f"INSERT INTO {table} SELECT * FROM {SEED_TABLE}"))
+            for index in indexes:
+                connection.execute(text(index))
+            connection.execute(text(f"ANALYZE TABLE {table}"))
+            connection.commit()
+            print(f"built {table}")
+        connection.execute(text(f"DROP TABLE {SEED_TABLE}"))
+        connection.commit()
+
+
+def report_query(table, explain=False):
+    query = ("EXPLAIN " if explain else "") + REPORT_QUERY.format(table=table)
+    return text(query).bindparams(bindparam("store_ids", expanding=True))
+
+
+def run_query(connection, table, store_ids, since):
+    started = time.perf_counter()
+    rows = connection.execute(
+        report_query(table), {"store_ids": store_ids, "since": since}
+    ).fetchall()
+    return time.perf_counter() - started, len(rows)
+
+
+def explain(connection, table, store_ids, since):
+    result = connection.execute(
+        report_query(table, explain=True), {"store_ids": store_ids, "since": since}
+    )
+    return [dict(row._mapping) for row in result]
+
+
+def benchmark(stores, chunk_size, repeats, now):
+    since = now - timedelta(days=7)
+    chunks = [
+        random.sample(range(1, stores + 1), min(chunk_size, stores))
+        for _ in range(repeats)
+    ]
+    with engine.connect() as connection:
+        for table in TABLES:
+            plan = explain(connection, table, chunks[0], since)
+            print(f"\n{table}")
+            for row in plan:
+                print(
+                    f"  type={row['type']} key={row['key']} rows={row['rows']} "
+                    f"extra={row['Extra']}"
+                )
+            timings = []
+            for store_ids in chunks:
+                elapsed, count = run_query(connection, table, store_ids, since)
+                timings.append(elapsed)
+            print(
+                f"  median={statistics.median(timings) * 1000:.1f}ms "
+                f"max={max(timings) * 1000:.1f}ms rows/query={count}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50_000_000)
+    parser.add_argument("--stores", type=int, default=20_000)
+    parser.add_argument(
+        "--days", type=int, default=60, help="history to spread pings over"
+    )
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument(
+        "--skip-build", action="store_true", help="reuse existing tables"
+    )
+    args = parser.parse_args()
+    now = datetime.utcnow().replace(microsecond=0)
+    if not args.skip_build:
+        build_tables(args.rows, args.stores, args.days, now)
+    benchmark(args.stores, args.chunk_size, args.repeats, now)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""UTC to local conversion of ping timestamps: per-ping astimezone vs offset tables.
+
+Timestamps are a week of naive UTC datetimes per store, spread over a few
+real zones with and without DST, converted the way `store_report` used to
+(`astimezone(ZoneInfo(...))` per ping), through the cached offset tables of
+`monitor.zones.localize` and through the NumPy offsets of vector mode.
+
+    python -m benchmarks.timezones --stores 1000 --pings 700
+"""
+import argparse
+import random
+import time
+import zoneinfo
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from monitor.vectorized import epoch_us, local_offsets
+from monitor.zones import localize, zone_table
+
+ZONES = [
+    "America/Chicago",
+    "America/New_York",
+    "America/Denver",
+    "America/Los_Angeles",
+    "America/Boise",
+    "Asia/Kolkata",
+    "Europe/London",
+]
+
+
+def store_timestamps(stores, pings, current_time):
+    fleet = []
+    for store_id in range(stores):
+        timestamps = sorted(
+            (
+                current_time - timedelta(seconds=random.randrange(7 * 86400))
+                for _ in range(pings)
+            ),
+            reverse=True,
+        )
+        fleet.append((random.choice(ZONES), timestamps))
+    return fleet
+
+
+def per_ping(fleet):
+    return [
+        [timestamp.astimezone(zoneinfo.ZoneInfo(timezone)) for timestamp in stamps]
+        for timezone, stamps in fleet
+    ]
+
+
+def tables(fleet):
+    return [localize(stamps, timezone) for timezone, stamps in fleet]
+
+
+def vector(fleet):
+    zone_index = {timezone: index for index, timezone in enumerate(ZONES)}
+    timestamps = np.fromiter(
+        (epoch_us(timestamp) for _, stamps in fleet for timestamp in stamps),
+        dtype=np.int64,
+    )
+    ping_zones = np.repeat(
+        np.array([zone_index[timezone] for timezone, _ in fleet], dtype=np.int64),
+        [len(stamps) for _, stamps in fleet],
+    )
+    return timestamps + local_offsets(timestamps, ping_zones, ZONES)
+
+
+def wall_clock(stores):
+    return [[moment.replace(tzinfo=None) for moment in local] for local in stores]
+
+
+def timed(label, convert, fleet, count):
+    started = time.perf_counter()
+    result = convert(fleet)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<22} {elapsed:7.3f}s  {count / elapsed:12,.0f} pings/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stores", type=int, default=1000)
+    parser.add_argument("--pings", type=int, default=700, help="pings per store")
+    parser.add_argument(
+        "--current-time",
+        type=datetime.fromisoformat,
+        default=datetime(2023, 3, 15, 12),
+        help="end of the week, the default window spans the US DST change",
+    )
+    args = parser.parse_args()
+    random.seed(0)
+    fleet = store_timestamps(args.stores, args.pings, args.current_time)
+    count = args.stores * args.pings
+    print(f"pings        {count} over {len(ZONES)} zones")
+
+    reference = timed("astimezone per ping", per_ping, fleet, count)
+    zone_table.cache_clear()
+    timed("offset tables (cold)", tables, fleet, count)
+    local = timed("offset tables", tables, fleet, count)
+    timed("numpy offsets", vector, fleet, count)
+    print(f"same result  {wall_clock(reference) == wall_clock(local)}")
+
+
+if __name__ == "__main__":
+    main()
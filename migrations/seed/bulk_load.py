@@ -0,0 +1,265 @@
+"""Fast loader for the seed CSV files.
+
+    python -m migrations.seed.bulk_load store_pings --file store_status.csv --parallel 4
+
+Uses LOAD DATA LOCAL INFILE when both the server and the driver allow it and
+falls back to multi-row INSERT batches otherwise. Secondary indexes are
+dropped for the load and rebuilt once at the end. With --parallel the file is
+split into byte ranges on line boundaries which are loaded by a pool of
+worker processes, each on its own connection. Quoted values spanning lines
+are not supported, none of the seed files have them.
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, inspect, text
+
+from monitor.env import DATABASE_URL
+from monitor.queries import invalidate_timezones
+from monitor.schedule import invalidate_schedules
+
+TABLES = {
+    "store_pings": {
+        "file": "store_status.csv",
+        # "2023-01-22 12:09:39.388884 UTC" -> drop the " UTC" suffix
+        "python": {"timestamp_utc": lambda value: value[:-4]},
+        "sql": {"timestamp_utc": "LEFT({var}, CHAR_LENGTH({var}) - 4)"},
+    },
+    "store_timings": {"file": "menu_hours.csv", "python": {}, "sql": {}},
+    "store_timezones": {"file": "bq_results.csv", "python": {}, "sql": {}},
+}
+PIECES_PER_WORKER = 8  # smaller pieces give a smoother progress readout
+COPY_BLOCK = 1 << 20
+
+engine = create_engine(DATABASE_URL, connect_args={"local_infile": True})
+
+
+def init_worker():
+    engine.dispose(close=False)
+
+
+def read_header(filename):
+    with open(filename, "rb") as csvfile:
+        line = csvfile.readline()
+        data_start = csvfile.tell()
+    line_end = "\r\n" if line.endswith(b"\r\n") else "\n"
+    columns = next(csv.reader([line.decode().strip()]))
+    return columns, data_start, line_end
+
+
+def byte_ranges(filename, data_start, pieces):
+    size = os.path.getsize(filename)
+    bounds = [data_start]
+    with open(filename, "rb") as csvfile:
+        for piece in range(1, pieces):
+            csvfile.seek(data_start + (size - data_start) * piece // pieces)
+            csvfile.readline()
+            bounds.append(max(csvfile.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def read_range(filename, start, end):
+    with open(filename, "rb") as csvfile:
+        csvfile.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = csvfile.read(min(COPY_BLOCK, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def read_lines(filename, start, end):
+    """Decoded lines of a byte range starting and ending on line boundaries."""
+    with open(filename, "rb") as csvfile:
+        csvfile.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            line = csvfile.readline()
+            if not line:
+                break
+            remaining -= len(line)
+            yield line.decode()
+
+
+def local_infile_enabled():
+    try:
+        with engine.connect() as connection:
+            value = connection.execute(text("SELECT @@GLOBAL.local_infile")).scalar()
+    except Exception:
+        return False
+    return str(value) in ("1", "ON")
+
+
+def secondary_indexes(table):
+    return [
+        index for index in inspect(engine).get_indexes(table) if not index["unique"]
+    ]
+
+
+def drop_indexes(table, indexes):
+    with engine.begin() as connection:
+        for index in indexes:
+            connection.execute(text(f"DROP INDEX {index['name']} ON {table}"))
+
+
+def create_indexes(table, indexes):
+    with engine.begin() as connection:
+        for index in indexes:
+            columns = ", ".join(index["column_names"])
+            connection.execute(
+                text(f"CREATE INDEX {index['name']} ON {table} ({columns})")
+            )
+
+
+def prepare_connection(connection):
+    connection.exec_driver_sql("SET SESSION unique_checks = 0")
+    connection.exec_driver_sql("SET SESSION foreign_key_checks = 0")
+
+
+def load_data_range(table, filename, columns, line_end, start, end):
+    transforms = TABLES[table]["sql"]
+    variables = ", ".join(f"@{column}" for column in columns)
+    assignments = ", ".join(
+        f"{column} = " + transforms.get(column, "{var}").format(var=f"@{column}")
+        for column in columns
+    )
+    with tempfile.NamedTemporaryFile(suffix=".csv") as piece:
+        for block in read_range(filename, start, end):
+            piece.write(block)
+        piece.flush()
+        with engine.begin() as connection:
+            prepare_connection(connection)
+            result = connection.exec_driver_sql(
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} "
+                "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                f"LINES TERMINATED BY %s ({variables}) SET {assignments}",
+                (piece.name, line_end),
+            )
+            return result.rowcount
+
+
+def insert_range(table, filename, columns, line_end, start, end, batch_size):
+    transforms = TABLES[table]["python"]
+    converters = [transforms.get(column) for column in columns]
+    statement = (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))})"
+    )
+    rows = 0
+    with engine.begin() as connection:
+        prepare_connection(connection)
+        batch = []
+        for record in csv.reader(read_lines(filename, start, end)):
+            if not record:
+                continue
+            batch.append(
+                tuple(
+                    convert(value) if convert else value
+                    for convert, value in zip(converters, record)
+                )
+            )
+            if len(batch) >= batch_size:
+                # PyMySQL rewrites executemany of an INSERT into multi-row inserts
+                connection.exec_driver_sql(statement, batch)
+                rows += len(batch)
+                batch = []
+        if batch:
+            connection.exec_driver_sql(statement, batch)
+            rows += len(batch)
+    return rows
+
+
+def load_range(job):
+    method, table, filename, columns, line_end, start, end, batch_size = job
+    if method == "load-data":
+        rows = load_data_range(table, filename, columns, line_end, start, end)
+    else:
+        rows = insert_range(table, filename, columns, line_end, start, end, batch_size)
+    return end - start, rows
+
+
+def report_progress(done_bytes, total_bytes, rows, started):
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(
+        f"{done_bytes / total_bytes:6.1%}  {rows} rows  "
+        f"{rows / elapsed:,.0f} rows/s  {done_bytes / elapsed / 2**20:.1f} MiB/s",
+        flush=True,
+    )
+
+
+def bulk_load(
+    table, filename, method="auto", parallel=1, batch_size=50000, keep_indexes=False
+):
+    if method == "auto":
+        method = "load-data" if local_infile_enabled() else "insert"
+    columns, data_start, line_end = read_header(filename)
+    ranges = byte_ranges(filename, data_start, max(parallel, 1) * PIECES_PER_WORKER)
+    jobs = [
+        (method, table, filename, columns, line_end, start, end, batch_size)
+        for start, end in ranges
+    ]
+    total_bytes = sum(end - start for start, end in ranges) or 1
+    indexes = [] if keep_indexes else secondary_indexes(table)
+    print(f"loading {filename} into {table} with {method}, {parallel} worker(s)")
+    drop_indexes(table, indexes)
+    started = time.perf_counter()
+    done_bytes = rows = 0
+    try:
+        if parallel > 1:
+            with multiprocessing.Pool(parallel, initializer=init_worker) as pool:
+                for piece_bytes, piece_rows in pool.imap_unordered(load_range, jobs):
+                    done_bytes += piece_bytes
+                    rows += piece_rows
+                    report_progress(done_bytes, total_bytes, rows, started)
+        else:
+            for job in jobs:
+                piece_bytes, piece_rows = load_range(job)
+                done_bytes += piece_bytes
+                rows += piece_rows
+                report_progress(done_bytes, total_bytes, rows, started)
+    finally:
+        if indexes:
+            print(f"rebuilding {len(indexes)} index(es)")
+            create_indexes(table, indexes)
+    print(f"loaded {rows} rows in {time.perf_counter() - started:.1f}s")
+    if table == "store_timings":
+        invalidate_schedules()
+    elif table == "store_timezones":
+        invalidate_timezones()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load a seed CSV file.")
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("--file", help="CSV file, defaults to the usual seed file name")
+    parser.add_argument(
+        "--method", choices=["auto", "load-data", "insert"], default="auto"
+    )
+    parser.add_argument("--parallel", type=int, default=1, help="worker processes")
+    parser.add_argument(
+        "--batch-size", type=int, default=50000, help="rows per INSERT batch"
+    )
+    parser.add_argument(
+        "--keep-indexes", action="store_true", help="do not drop secondary indexes"
+    )
+    args = parser.parse_args()
+    bulk_load(
+        args.table,
+        args.file or TABLES[args.table]["file"],
+        method=args.method,
+        parallel=args.parallel,
+        batch_size=args.batch_size,
+        keep_indexes=args.keep_indexes,
+    )
+
+
+if __name__ == "__main__":
+    main()
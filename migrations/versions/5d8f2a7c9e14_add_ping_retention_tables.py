@@ -0,0 +1,43 @@
+"""add ping retention tables
+
+Revision ID: 5d8f2a7c9e14
+Revises: e1a9c3d5b7f2
+Create Date: 2023-12-14 09:21:05.104377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5d8f2a7c9e14"
+down_revision: Union[str, None] = "e1a9c3d5b7f2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "store_ping_summaries",
+        sa.Column("store_id", sa.BIGINT, primary_key=True),
+        sa.Column("hour_utc", sa.TIMESTAMP, primary_key=True, index=True),
+        sa.Column("active_count", sa.INT, nullable=False, default=0),
+        sa.Column("inactive_count", sa.INT, nullable=False, default=0),
+    )
+    op.create_table(
+        "ping_archives",
+        sa.Column("id", sa.BIGINT, primary_key=True, autoincrement=True),
+        sa.Column("day", sa.DATE, nullable=False, index=True),
+        sa.Column("location", sa.VARCHAR(255), nullable=False),
+        sa.Column("ping_count", sa.BIGINT, nullable=False),
+        sa.Column("first_id", sa.BIGINT, nullable=False),
+        sa.Column("last_id", sa.BIGINT, nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("ping_archives")
+    op.drop_table("store_ping_summaries")
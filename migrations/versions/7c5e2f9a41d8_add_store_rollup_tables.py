@@ -0,0 +1,46 @@
+"""add store rollup tables
+
+Revision ID: 7c5e2f9a41d8
+Revises: 3b1b1afdc3ae
+Create Date: 2023-12-02 11:04:37.512904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7c5e2f9a41d8"
+down_revision: Union[str, None] = "3b1b1afdc3ae"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "store_hourly_rollups",
+        sa.Column("store_id", sa.BIGINT, primary_key=True),
+        sa.Column("hour_utc", sa.TIMESTAMP, primary_key=True, index=True),
+        sa.Column("active_count", sa.INT, nullable=False, default=0),
+        sa.Column("inactive_count", sa.INT, nullable=False, default=0),
+    )
+    op.create_table(
+        "store_rollup_tails",
+        sa.Column("store_id", sa.BIGINT, primary_key=True),
+        sa.Column("last_ping_utc", sa.TIMESTAMP, nullable=True),
+    )
+    op.create_table(
+        "rollup_checkpoints",
+        sa.Column("name", sa.VARCHAR(64), primary_key=True),
+        sa.Column("last_ping_id", sa.BIGINT, nullable=False, default=0),
+        sa.Column("gaps", sa.TEXT, nullable=True),
+        sa.Column("updated_at", sa.TIMESTAMP, nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("rollup_checkpoints")
+    op.drop_table("store_rollup_tails")
+    op.drop_table("store_hourly_rollups")
@@ -0,0 +1,105 @@
+"""add store pings covering index
+
+Revision ID: b4d0e6c18f23
+Revises: 7c5e2f9a41d8
+Create Date: 2023-12-03 16:21:08.904117
+
+Replaces the single column indexes on store_pings with one composite index
+matching the report query (store_id IN (...), timestamp_utc range, ordered by
+store_id, timestamp_utc DESC), which also covers the status column.
+
+Day range partitioning is optional since it rewrites the whole table and
+widens the primary key: `alembic -x partition=true upgrade head`.
+"""
+from datetime import date, timedelta
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b4d0e6c18f23"
+down_revision: Union[str, None] = "7c5e2f9a41d8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COVERING_INDEX = "ix_store_pings_store_id_timestamp_utc_status"
+PARTITION_DAYS_AHEAD = 7
+
+
+def partition_requested() -> bool:
+    value = context.get_x_argument(as_dictionary=True).get("partition", "")
+    return value.lower() in ("1", "true", "yes")
+
+
+def day_partition(day: date) -> str:
+    upper = day + timedelta(days=1)
+    return (
+        f"PARTITION p{day:%Y%m%d} "
+        f"VALUES LESS THAN (UNIX_TIMESTAMP('{upper:%Y-%m-%d} 00:00:00'))"
+    )
+
+
+def partition_store_pings() -> None:
+    first_day, last_day = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT DATE(MIN(timestamp_utc)), DATE(MAX(timestamp_utc)) "
+                "FROM store_pings"
+            )
+        )
+        .one()
+    )
+    today = date.today()
+    first_day = first_day or today
+    last_day = max(last_day or today, today) + timedelta(days=PARTITION_DAYS_AHEAD)
+    partitions = []
+    day = first_day
+    while day <= last_day:
+        partitions.append(day_partition(day))
+        day += timedelta(days=1)
+    partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    # every unique key of a partitioned table must contain the partition column
+    op.execute(
+        "ALTER TABLE store_pings DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp_utc)"
+    )
+    op.execute(
+        "ALTER TABLE store_pings PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp_utc)) "
+        f"({', '.join(partitions)})"
+    )
+
+
+def is_partitioned() -> bool:
+    partitions = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT COUNT(*) FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'store_pings' "
+                "AND PARTITION_NAME IS NOT NULL"
+            )
+        )
+        .scalar()
+    )
+    return bool(partitions)
+
+
+def upgrade() -> None:
+    op.create_index(
+        COVERING_INDEX, "store_pings", ["store_id", "timestamp_utc", "status"]
+    )
+    op.drop_index("ix_store_pings_status", table_name="store_pings")
+    op.drop_index("ix_store_pings_store_id", table_name="store_pings")
+    if partition_requested():
+        partition_store_pings()
+
+
+def downgrade() -> None:
+    if is_partitioned():
+        op.execute("ALTER TABLE store_pings REMOVE PARTITIONING")
+        op.execute("ALTER TABLE store_pings DROP PRIMARY KEY, ADD PRIMARY KEY (id)")
+    op.create_index("ix_store_pings_store_id", "store_pings", ["store_id"])
+    op.create_index("ix_store_pings_status", "store_pings", ["status"])
+    op.drop_index(COVERING_INDEX, table_name="store_pings")
@@ -0,0 +1,26 @@
+"""add report profile
+
+Revision ID: e1a9c3d5b7f2
+Revises: b4d0e6c18f23
+Create Date: 2023-12-10 10:42:17.318520
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e1a9c3d5b7f2"
+down_revision: Union[str, None] = "b4d0e6c18f23"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("reports", sa.Column("profile", sa.TEXT, nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("reports", "profile")
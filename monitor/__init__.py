@@ -1,6 +1,10 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Depends
-from . import main
-from .session import db_session
+from . import main, ingest, status, profiling, backfill
+from .session import db_session, async_engine, async_redis
+from .env import STORE_SNAPSHOT
 from sqlalchemy.exc import SQLAlchemyError
 
 
@@ -13,5 +17,23 @@ async def close_session():
     db_session.close()
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if STORE_SNAPSHOT:
+        from .snapshot import snapshot_cache
+
+        # the first worker of the host builds it, the others map the same file
+        await asyncio.to_thread(snapshot_cache.ensure)
+    await ingest.ping_buffer.start()
+    yield
+    await ingest.ping_buffer.stop()
+    await async_redis.aclose()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(main.router, dependencies=[Depends(close_session)])
+app.include_router(ingest.router)
+app.include_router(status.router)
+app.include_router(profiling.router)
+app.include_router(backfill.router, dependencies=[Depends(close_session)])
@@ -0,0 +1,355 @@
+"""Downtime alerts evaluated on the pings as they are ingested.
+
+With `ALERTS=true` the API appends every batch of pings it writes to the
+Redis stream `monitoring:ping-stream`. One `python -m monitor.alerts` process
+reads it and keeps the state of every store in memory: last status and ping
+time, since when it has been inactive and which alert is open. A store
+- goes `down` once it has been inactive for `ALERT_DOWN_SECONDS` of its
+  business hours,
+- goes `silent` once it sent no ping for `ALERT_SILENCE_SECONDS` of its
+  business hours,
+- comes back `up` with its next active ping, or gets `silent_cleared` when
+  a silent store sends an inactive one.
+
+A ping only updates its store's fields. Each store has at most one entry in
+a heap of deadlines, the earliest time one of its alerts could fire; entries
+are checked when they come due and pushed again if pings moved the deadline,
+so nothing rescans the fleet. The events of each batch of pings and of each
+sweep are sent to `ALERT_SINK` together, pipelined with the writes to the
+open alerts hash: the Redis stream `monitoring:alerts`, a webhook or the log.
+
+    python -m monitor.alerts
+"""
+import heapq
+import json
+import logging
+import math
+import time
+import urllib.request
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func
+
+from .model import Status, StorePings
+from .session import db_session as session, redis_session, async_redis
+from .queries import REPORT_SPAN, get_timezones
+from .schedule import MONDAY, load_store_schedules, wall_seconds
+from .zones import local_time, utc_after
+from .utils import batched, get_many
+from .constants import (
+    REDIS_ALERT_STATE,
+    REDIS_ALERTS,
+    REDIS_PING_STREAM,
+    REDIS_TIMEZONES_VERSION,
+    REDIS_TIMINGS_VERSION,
+)
+from .env import (
+    ALERT_DOWN_SECONDS,
+    ALERT_SILENCE_SECONDS,
+    ALERT_SINK,
+    ALERT_STREAM_LENGTH,
+    ALERT_SWEEP_INTERVAL,
+    ALERT_WEBHOOK_URL,
+    SCHEDULE_CACHE_TTL,
+)
+
+logger = logging.getLogger(__name__)
+PING_STREAM_LENGTH = 10000  # batches kept for the evaluator
+CLOSING_EVENTS = ("up", "silent_cleared")
+
+
+async def publish_pings(pings):
+    """Append a written batch of pings to the ping stream, one entry per batch."""
+    encoded = json.dumps(
+        [
+            [ping["store_id"], ping["status"], ping["timestamp_utc"].isoformat()]
+            for ping in pings
+        ]
+    )
+    await async_redis.xadd(
+        REDIS_PING_STREAM,
+        {"pings": encoded},
+        maxlen=PING_STREAM_LENGTH,
+        approximate=True,
+    )
+
+
+class StreamSink:
+    def emit(self, event, batch):
+        batch.xadd(REDIS_ALERTS, event, maxlen=ALERT_STREAM_LENGTH, approximate=True)
+
+
+class WebhookSink:
+    def __init__(self, url=ALERT_WEBHOOK_URL):
+        if not url:
+            raise RuntimeError("ALERT_SINK=webhook needs ALERT_WEBHOOK_URL")
+        self.url = url
+
+    def emit(self, event, batch):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(event).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+        except OSError:
+            logger.exception("Failed to post alert %s", event)
+
+
+class LogSink:
+    def emit(self, event, batch):
+        logger.warning("Alert %s", event)
+
+
+ALERT_SINKS = {"redis": StreamSink, "webhook": WebhookSink, "log": LogSink}
+
+
+@dataclass(slots=True)
+class StoreState:
+    last_ping: datetime
+    status: Status = None
+    inactive_since: datetime = None
+    alert: str = None
+    deadline: datetime = None  # of this store's live entry in the heap
+
+
+class AlertEvaluator:
+    def __init__(
+        self,
+        sink,
+        down_seconds=ALERT_DOWN_SECONDS,
+        silence_seconds=ALERT_SILENCE_SECONDS,
+    ):
+        self.sink = sink
+        self.down_seconds = down_seconds
+        self.silence_seconds = silence_seconds
+        self.stores = {}
+        self.timers = []  # (deadline, store_id), stale when not the store's
+        self.timezones = {}
+        self.schedules = {}
+        self.versions = None
+        self.loaded_at = 0.0
+        self.events = []  # emitted since the last flush
+        self.stats = {"pings": 0, "late_pings": 0, "events": 0, "timers": 0}
+
+    def refresh(self):
+        """Reload timezones and schedules when they changed or got old."""
+        versions = get_many([REDIS_TIMEZONES_VERSION, REDIS_TIMINGS_VERSION])
+        expired = time.monotonic() - self.loaded_at > SCHEDULE_CACHE_TTL
+        if versions != self.versions or expired:
+            self.timezones = get_timezones()
+            self.schedules = load_store_schedules(list(self.timezones))
+            self.versions = versions
+            self.loaded_at = time.monotonic()
+
+    def seed(self, now):
+        """Start from each store's newest ping of the last week and open alerts."""
+        alerts = redis_session.hgetall(REDIS_ALERT_STATE)
+        latest = {
+            store_id: (status, timestamp)
+            for store_id, status, timestamp in latest_pings(now - REPORT_SPAN, now)
+        }
+        for store_id in self.timezones:
+            status, timestamp = latest.get(store_id, (None, now))
+            state = StoreState(
+                last_ping=timestamp,
+                status=status,
+                inactive_since=timestamp if status is Status.inactive else None,
+                alert=alerts.get(str(store_id)),
+            )
+            self.stores[store_id] = state
+            self.schedule(store_id, state)
+
+    def open_seconds(self, store_id, start, end):
+        timezone = self.timezones[store_id]
+        return self.schedules[store_id].open_seconds(
+            local_time(start, timezone), local_time(end, timezone)
+        )
+
+    def open_after(self, store_id, start, seconds, after=None):
+        """UTC time once `seconds` of business hours passed since `start`.
+
+        Business hours are counted on the wall clock like in `open_seconds`,
+        which runs an hour back when DST ends, so this is the first time from
+        `after` (default `start`) on that the wall clock reaches the end.
+        """
+        timezone = self.timezones[store_id]
+        offset = wall_seconds(local_time(start, timezone))
+        end = self.schedules[store_id].open_after(offset, seconds)
+        if end == math.inf:
+            return None
+        return utc_after(MONDAY + timedelta(seconds=end), timezone, after or start)
+
+    def next_deadline(self, state, store_id, after=None):
+        if state.alert is not None:
+            return None  # nothing fires until a ping closes it
+        deadlines = [
+            self.open_after(store_id, state.last_ping, self.silence_seconds, after)
+        ]
+        if state.inactive_since is not None:
+            deadlines.append(
+                self.open_after(
+                    store_id, state.inactive_since, self.down_seconds, after
+                )
+            )
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        return min(deadlines, default=None)
+
+    def schedule(self, store_id, state, now=None):
+        """Push the store's deadline unless an earlier entry is already due.
+
+        With `now`, after a check that did not fire, the deadline is looked for
+        from `now` on and always lies after it, so a sweep cannot loop on it.
+        """
+        deadline = self.next_deadline(state, store_id, after=now)
+        if deadline is not None and now is not None and deadline <= now:
+            deadline = now + timedelta(seconds=1)  # rounded just short of the end
+        if deadline is None:
+            state.deadline = None
+        elif state.deadline is None or deadline < state.deadline:
+            state.deadline = deadline
+            heapq.heappush(self.timers, (deadline, store_id))
+
+    def emit(self, store_id, state, event, at, since):
+        state.alert = None if event in CLOSING_EVENTS else event
+        self.stats["events"] += 1
+        self.events.append(
+            {
+                "store_id": store_id,
+                "event": event,
+                "status": state.status.name if state.status else "",
+                "at": at.isoformat(),
+                "since": since.isoformat(),
+            }
+        )
+
+    def on_ping(self, store_id, status: Status, timestamp: datetime):
+        state = self.stores.get(store_id)
+        if state is None:
+            if store_id not in self.timezones:
+                return  # like reports, stores need a timezone
+            state = self.stores[store_id] = StoreState(last_ping=timestamp)
+        elif timestamp < state.last_ping:
+            self.stats["late_pings"] += 1
+            return
+        self.stats["pings"] += 1
+        state.last_ping = timestamp
+        state.status = status
+        # a later deadline waits for the current entry, an earlier one is pushed
+        reschedule = state.deadline is None
+        if status is Status.active:
+            state.inactive_since = None
+            if state.alert is not None:
+                self.emit(store_id, state, "up", at=timestamp, since=timestamp)
+                reschedule = True
+        else:
+            if state.alert == "silent":
+                self.emit(
+                    store_id, state, "silent_cleared", at=timestamp, since=timestamp
+                )
+                reschedule = True
+            if state.inactive_since is None:
+                state.inactive_since = timestamp
+                reschedule = True
+        if reschedule:
+            self.schedule(store_id, state)
+
+    def check(self, store_id, state, now):
+        if state.alert is not None:
+            return
+        if (
+            state.inactive_since is not None
+            and self.open_seconds(store_id, state.inactive_since, now)
+            >= self.down_seconds
+        ):
+            self.emit(store_id, state, "down", at=now, since=state.inactive_since)
+        elif self.open_seconds(store_id, state.last_ping, now) >= self.silence_seconds:
+            self.emit(store_id, state, "silent", at=now, since=state.last_ping)
+
+    def flush(self):
+        """Store the open alerts and send the events emitted since the last flush."""
+        events, self.events = self.events, []
+        with batched() as batch:
+            for event in events:
+                if event["event"] in CLOSING_EVENTS:
+                    batch.hdel(REDIS_ALERT_STATE, event["store_id"])
+                else:
+                    batch.hset(REDIS_ALERT_STATE, event["store_id"], event["event"])
+                self.sink.emit(event, batch)
+
+    def sweep(self, now):
+        """Check the stores whose deadline passed."""
+        while self.timers and self.timers[0][0] <= now:
+            deadline, store_id = heapq.heappop(self.timers)
+            state = self.stores[store_id]
+            if state.deadline != deadline:
+                continue  # replaced by an earlier entry
+            self.stats["timers"] += 1
+            state.deadline = None
+            self.check(store_id, state, now)
+            self.schedule(store_id, state, now)
+
+
+def latest_pings(since, until):
+    """(store_id, status, timestamp_utc) of each store's newest ping in the range."""
+    newest = (
+        session.query(
+            StorePings.store_id,
+            func.max(StorePings.timestamp_utc).label("timestamp_utc"),
+        )
+        .filter(StorePings.timestamp_utc >= since)
+        .filter(StorePings.timestamp_utc < until)
+        .group_by(StorePings.store_id)
+        .subquery()
+    )
+    return (
+        session.query(StorePings.store_id, StorePings.status, StorePings.timestamp_utc)
+        .join(
+            newest,
+            and_(
+                StorePings.store_id == newest.c.store_id,
+                StorePings.timestamp_utc == newest.c.timestamp_utc,
+            ),
+        )
+        .all()
+    )
+
+
+def stream_end():
+    entries = redis_session.xrevrange(REDIS_PING_STREAM, count=1)
+    return entries[0][0] if entries else "0-0"
+
+
+def run(evaluator, sweep_interval=ALERT_SWEEP_INTERVAL):
+    evaluator.refresh()
+    last_id = stream_end()  # pings before this are in the seed
+    evaluator.seed(datetime.utcnow())
+    session.remove()
+    while True:
+        evaluator.refresh()
+        replies = redis_session.xread(
+            {REDIS_PING_STREAM: last_id}, count=100, block=int(sweep_interval * 1000)
+        )
+        for _, messages in replies:
+            for message_id, fields in messages:
+                last_id = message_id
+                for store_id, status, timestamp in json.loads(fields["pings"]):
+                    evaluator.on_ping(
+                        store_id, Status[status], datetime.fromisoformat(timestamp)
+                    )
+        evaluator.sweep(datetime.utcnow())
+        evaluator.flush()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s"
+    )
+    run(AlertEvaluator(ALERT_SINKS[ALERT_SINK]()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Daily reports over a past period, sharing ping scans between days.
+
+A backfill makes one report per day ending at `as_of`, each the same as a
+report triggered with that `as_of`. Days are taken `REPORT_BACKFILL_GROUP` at a
+time: every chunk of stores reads the pings of the whole group in one query,
+[first as_of - 7 days, last as_of), and each day's rows come from slices of
+it, so adjacent days share one scan instead of reading a week each.
+
+    python -m monitor.backfill --days 90 [--as-of 2023-01-25T18:13:22]
+"""
+import argparse
+from bisect import bisect_left
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from time import perf_counter
+from uuid import uuid4
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .model import Reports, JobStatus
+from .session import db_session as session, get_session
+from .report import LocalPing, calculate_times
+from .queries import chunk_timezones, get_timezones, stream_store_pings
+from .schedule import load_store_schedules, load_store_timings
+from .windows import (
+    WindowSpec,
+    parse_windows,
+    report_span,
+    window_header,
+    window_times,
+)
+from .zones import local_time, localize
+from .sinks import HEADER, report_sink
+from .main import UtcTime, report_time, update_report_status
+from .ingest import naive_utc
+from .retention import compacted_days, compacted_detail
+from .profiling import dump_profile, profiled, record_chunk, record_report, stage, timed
+from .env import REPORT_BACKFILL_DAYS, REPORT_BACKFILL_GROUP, REPORT_CHUNK_SIZE
+
+router = APIRouter()
+running = JobStatus.running.name
+failed = JobStatus.failed.name
+finished = JobStatus.finished.name
+
+
+def backfill_times(as_of, days):
+    """`days` report times a day apart, ending at `as_of`, oldest first."""
+    return [as_of - timedelta(days=day) for day in reversed(range(days))]
+
+
+def bulk_backfill_report(timezones: dict, times, windows=None) -> list[list]:
+    """Rows of one chunk of stores for the report as of each of `times`."""
+    store_ids = timezones.keys()
+    span = report_span(windows)
+    with stage("timings_query"):
+        store_timings = load_store_timings(store_ids)
+        schedules = load_store_schedules(store_ids) if windows else {}
+    reports = [[] for _ in times]
+    if not store_timings and windows is None:
+        return reports  # like bulk_store_report
+    for store_id, pings in timed(
+        stream_store_pings(store_ids, since=times[0] - span, until=times[-1]),
+        "ping_query",
+    ):
+        timezone = timezones[store_id]
+        timings = store_timings.get(store_id, {})
+        with stage("localize"):
+            local_pings = [
+                LocalPing(status=ping.status, local_time=moment)
+                for ping, moment in zip(
+                    pings, localize([ping.timestamp_utc for ping in pings], timezone)
+                )
+            ]
+        # oldest first, to bisect each day's [as_of - span, as_of) out of the
+        # newest first pings
+        stamps = [ping.timestamp_utc for ping in reversed(pings)]
+        for rows, as_of in zip(reports, times):
+            first = len(pings) - bisect_left(stamps, as_of)
+            last = len(pings) - bisect_left(stamps, as_of - span)
+            if first == last:
+                continue
+            current_time = local_time(as_of, timezone)
+            if windows is None:
+                values = calculate_times(local_pings[first:last], timings, current_time)
+            else:
+                values = window_times(
+                    local_pings[first:last],
+                    timings,
+                    schedules[store_id],
+                    current_time=current_time,
+                    windows=windows,
+                    span=span.total_seconds(),
+                )
+            rows.append([store_id, *values])
+    return reports
+
+
+def backfill_group(reports, chunk_size, windows, header):
+    """Write the reports of one group of (as_of, report_id), ascending."""
+    times = [as_of for as_of, _ in reports]
+    for _, report_id in reports:
+        update_report_status(report_id=report_id, status=running)
+    started = perf_counter()
+    with profiled(name=f"backfill_{reports[0][1]}") as profile:
+        try:
+            with stage("timezones"):
+                timezones = get_timezones()
+            with ExitStack() as stack:
+                sinks = [
+                    stack.enter_context(report_sink(report_id, header=header))
+                    for _, report_id in reports
+                ]
+                for chunk in chunk_timezones(timezones, chunk_size=chunk_size):
+                    for sink, rows in zip(
+                        sinks, bulk_backfill_report(chunk, times, windows)
+                    ):
+                        record_chunk(rows)
+                        with stage("write"):
+                            sink.write(rows)
+        except Exception:
+            session.rollback()
+            for _, report_id in reports:
+                update_report_status(
+                    report_id=report_id,
+                    status=failed,
+                    profile=dump_profile(profile.as_dict()),
+                )
+            record_report(profile.as_dict(), failed, perf_counter() - started)
+            raise
+    for (_, report_id), sink in zip(reports, sinks):
+        update_report_status(
+            report_id=report_id,
+            status=finished,
+            filename=sink.location,
+            profile=dump_profile(profile.as_dict()),
+        )
+    record_report(profile.as_dict(), finished, perf_counter() - started)
+
+
+def generate_backfill(
+    reports, chunk_size=REPORT_CHUNK_SIZE, windows=None, group=REPORT_BACKFILL_GROUP
+):
+    """Write the report of each (as_of, report_id), `group` days per ping scan."""
+    reports = sorted(reports)
+    header = HEADER if windows is None else window_header(windows)
+    for index in range(0, len(reports), group):
+        try:
+            backfill_group(reports[index : index + group], chunk_size, windows, header)
+        except Exception:
+            for _, report_id in reports[index + group :]:
+                update_report_status(report_id=report_id, status=failed)
+            raise
+
+
+def new_reports(times):
+    return [(as_of, str(uuid4())[:16]) for as_of in times]
+
+
+def pending_report(report_id):
+    return Reports(report_id=report_id, status="pending", created_at=datetime.utcnow())
+
+
+class BackfillSpec(BaseModel):
+    days: int = Field(gt=0, le=REPORT_BACKFILL_DAYS)
+    as_of: UtcTime | None = None
+    windows: list[WindowSpec] = []
+
+
+@router.post("/trigger_backfill")
+async def trigger_backfill(
+    spec: BackfillSpec,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_session),
+):
+    times = backfill_times(spec.as_of or report_time(), spec.days)
+    windows = parse_windows([window.model_dump() for window in spec.windows])
+    compacted = (
+        await db.scalars(compacted_days(times[0] - report_span(windows), times[-1]))
+    ).all()
+    if compacted:
+        raise HTTPException(status_code=422, detail=compacted_detail(compacted))
+    reports = new_reports(times)
+    db.add_all([pending_report(report_id) for _, report_id in reports])
+    await db.commit()
+    background_tasks.add_task(generate_backfill, reports, windows=windows)
+    return JSONResponse(
+        {
+            "reports": [
+                {"as_of": as_of.isoformat(), "report_id": report_id}
+                for as_of, report_id in reports
+            ]
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, required=True)
+    parser.add_argument(
+        "--as-of",
+        type=lambda value: naive_utc(datetime.fromisoformat(value)),
+        help="end of the last day, default now",
+    )
+    parser.add_argument("--chunk-size", type=int, default=REPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+    times = backfill_times(args.as_of or report_time(), args.days)
+    compacted = session.scalars(
+        compacted_days(times[0] - report_span(None), times[-1])
+    ).all()
+    if compacted:
+        parser.error(compacted_detail(compacted))
+    reports = new_reports(times)
+    session.add_all([pending_report(report_id) for _, report_id in reports])
+    session.commit()
+    generate_backfill(reports, chunk_size=args.chunk_size)
+    for as_of, report_id in reports:
+        print(as_of.isoformat(), report_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,13 @@
-REDIS_STORE_IDS = "monitoring:store-ids"  # redis list to store list of all redis keys
-REDIS_TIMEZONES = "monitoring:timezones"  # redis hashmap to store timezones
+REDIS_TIMEZONES = "monitoring:timezones:{}"  # redis hashmap of timezones per version
+REDIS_TIMEZONES_VERSION = "monitoring:timezones-version"  # bumped when timezones change
+REDIS_TIMINGS_VERSION = "monitoring:timings-version"  # bumped when store timings change
+REDIS_REPORT_TASKS = "monitoring:report-tasks"  # redis list of queued report tasks
+REDIS_REPORT_LEASES = "monitoring:report-leases"  # sorted set of tasks by lease expiry
+REDIS_REPORT_JOB = "monitoring:report-job:{}"  # redis hashmap with a report's job state
+REDIS_REPORT_RESULTS = "monitoring:report-results:{}"  # redis hashmap of shard rows
+REDIS_REPORT_METRICS = "monitoring:report-metrics"  # redis hashmap of report counters
+REDIS_REPORT_CACHE = "monitoring:report-cache:{}"  # report id per data watermark
+REDIS_REPORT_ALIVE = "monitoring:report-alive:{}"  # expiring heartbeat of a report
+REDIS_PING_STREAM = "monitoring:ping-stream"  # redis stream of ingested ping batches
+REDIS_ALERTS = "monitoring:alerts"  # redis stream of downtime alert events
+REDIS_ALERT_STATE = "monitoring:alert-state"  # redis hashmap of open alerts per store
@@ -1,9 +1,122 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "../.env"))
 
+
+def env_flag(name, default):
+    # true, 1, yes and on in any case turn a flag on
+    return os.environ.get(name, default).strip().lower() in ("true", "1", "yes", "on")
+
+
 DATABASE_URL = os.environ.get("DATABASE_URL")
 REDIS_URL = os.environ.get("REDIS_URL")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))  # connections kept per engine
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))  # extra under load
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))  # seconds to wait
+DB_POOL_RECYCLE = int(
+    os.environ.get("DB_POOL_RECYCLE", 1800)
+)  # seconds, below MySQL wait_timeout
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", "true")
+DB_STATEMENT_TIMEOUT = float(
+    os.environ.get("DB_STATEMENT_TIMEOUT", 0)
+)  # seconds per MySQL SELECT, 0 for none
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 10))  # seconds
+REDIS_HEALTH_CHECK_INTERVAL = int(
+    os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30)
+)  # seconds idle before a PING
+REDIS_PIPELINE_SIZE = int(os.environ.get("REDIS_PIPELINE_SIZE", 1000))  # commands
+
+REPORT_MODE = os.environ.get(
+    "REPORT_MODE", "python"
+)  # python | rollup | vector | array | interval
+REPORT_CHUNK_SIZE = int(os.environ.get("REPORT_CHUNK_SIZE", 100))
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", 1))  # >1 runs chunks in processes
+REPORT_START_METHOD = os.environ.get("REPORT_START_METHOD", "forkserver")
+PING_STREAM_BATCH = int(os.environ.get("PING_STREAM_BATCH", 10000))  # rows per fetch
+PING_BUFFER_SIZE = int(os.environ.get("PING_BUFFER_SIZE", 200000))  # max pings held
+PING_FLUSH_SIZE = int(os.environ.get("PING_FLUSH_SIZE", 5000))  # pings per INSERT batch
+PING_FLUSH_INTERVAL = float(os.environ.get("PING_FLUSH_INTERVAL", 0.5))  # seconds
+PING_FLUSH_RETRIES = int(
+    os.environ.get("PING_FLUSH_RETRIES", 5)
+)  # attempts after the first before a batch is dead lettered
+PING_PUT_TIMEOUT = float(os.environ.get("PING_PUT_TIMEOUT", 2))  # seconds before 503
+SCHEDULE_CACHE_TTL = float(os.environ.get("SCHEDULE_CACHE_TTL", 300))  # seconds
+TIMEZONE_CACHE_TTL = float(os.environ.get("TIMEZONE_CACHE_TTL", 300))  # seconds
+TIMEZONE_BATCH = int(os.environ.get("TIMEZONE_BATCH", 10000))  # hash fields per batch
+REPORT_QUEUE = os.environ.get("REPORT_QUEUE", "background")  # background | redis
+REPORT_SHARD_SIZE = int(os.environ.get("REPORT_SHARD_SIZE", 1000))  # stores per task
+REPORT_LEASE_SECONDS = int(os.environ.get("REPORT_LEASE_SECONDS", 60))
+REPORT_HEARTBEAT_SECONDS = int(os.environ.get("REPORT_HEARTBEAT_SECONDS", 15))
+REPORT_TASK_RETRIES = int(os.environ.get("REPORT_TASK_RETRIES", 3))  # per task
+REPORT_POLL_INTERVAL = float(os.environ.get("REPORT_POLL_INTERVAL", 1))  # seconds
+REPORT_JOB_TTL = int(os.environ.get("REPORT_JOB_TTL", 86400))  # seconds
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL")  # DATABASE_URL on aiomysql
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 64))  # async pool
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", 5))  # seconds
+REPORT_CONCURRENCY = int(os.environ.get("REPORT_CONCURRENCY", 1))  # chunks in flight
+REPORT_FORMAT = os.environ.get("REPORT_FORMAT", "csv")  # csv | csv.gz | parquet
+REPORT_STORAGE = os.environ.get("REPORT_STORAGE", "local")  # local | s3
+REPORT_DIR = os.environ.get(
+    "REPORT_DIR", os.path.join(tempfile.gettempdir(), "reports")
+)  # local storage
+REPORT_S3_BUCKET = os.environ.get("REPORT_S3_BUCKET", "reports")
+REPORT_S3_PREFIX = os.environ.get("REPORT_S3_PREFIX", "")
+REPORT_S3_ENDPOINT = os.environ.get("REPORT_S3_ENDPOINT")  # e.g. a MinIO server URL
+REPORT_CACHE_TTL = int(os.environ.get("REPORT_CACHE_TTL", 86400))  # 0 disables reuse
+REPORT_ALIVE_SECONDS = int(
+    os.environ.get("REPORT_ALIVE_SECONDS", 600)
+)  # unfinished reports without a heartbeat for this long are not reused
+REPORT_AS_OF_STEP = float(
+    os.environ.get("REPORT_AS_OF_STEP", 60)
+)  # seconds, default as_of is floored to it
+REPORT_BACKFILL_GROUP = int(
+    os.environ.get("REPORT_BACKFILL_GROUP", 30)
+)  # days per shared ping scan
+REPORT_BACKFILL_DAYS = int(os.environ.get("REPORT_BACKFILL_DAYS", 366))  # per request
+ROLLUP_GAP_SECONDS = int(
+    os.environ.get("ROLLUP_GAP_SECONDS", 600)
+)  # missing ping ids are looked for again this long
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 30))  # raw pings kept
+RETENTION_ARCHIVE_DIR = os.environ.get(
+    "RETENTION_ARCHIVE_DIR", os.path.join(tempfile.gettempdir(), "ping-archive")
+)  # archive files of compacted pings
+RETENTION_ARCHIVE_FORMAT = os.environ.get(
+    "RETENTION_ARCHIVE_FORMAT", "ndjson.gz"
+)  # ndjson.gz | ndjson.zst | parquet
+RETENTION_DELETE_BATCH = int(os.environ.get("RETENTION_DELETE_BATCH", 5000))  # rows
+RETENTION_DELETE_PAUSE = float(
+    os.environ.get("RETENTION_DELETE_PAUSE", 0.05)
+)  # seconds between delete batches
+STORE_SNAPSHOT = env_flag("STORE_SNAPSHOT", "false")  # shared map
+STORE_SNAPSHOT_DIR = os.environ.get(
+    "STORE_SNAPSHOT_DIR",
+    "/dev/shm/store-snapshot"
+    if os.path.isdir("/dev/shm")
+    else os.path.join(tempfile.gettempdir(), "store-snapshot"),
+)  # one directory per host, tmpfs keeps it off disk
+ALERTS = env_flag("ALERTS", "false")  # stream pings to monitor.alerts
+ALERT_DOWN_SECONDS = float(
+    os.environ.get("ALERT_DOWN_SECONDS", 900)
+)  # business hours inactive before a down alert
+ALERT_SILENCE_SECONDS = float(
+    os.environ.get("ALERT_SILENCE_SECONDS", 3600)
+)  # business hours without pings before a silent alert
+ALERT_SINK = os.environ.get("ALERT_SINK", "redis")  # redis | webhook | log
+ALERT_WEBHOOK_URL = os.environ.get("ALERT_WEBHOOK_URL")  # POSTed one JSON event each
+ALERT_STREAM_LENGTH = int(os.environ.get("ALERT_STREAM_LENGTH", 100000))  # events
+ALERT_SWEEP_INTERVAL = float(os.environ.get("ALERT_SWEEP_INTERVAL", 1))  # seconds
+STATUS_CACHE_STORES = int(os.environ.get("STATUS_CACHE_STORES", 100000))  # stores kept
+STATUS_CACHE_TTL = float(os.environ.get("STATUS_CACHE_TTL", 60))  # seconds
+REPORT_PROFILE_SAMPLE = float(
+    os.environ.get("REPORT_PROFILE_SAMPLE", 0)
+)  # 0..1 of runs
+REPORT_PROFILER = os.environ.get(
+    "REPORT_PROFILER", "cprofile"
+)  # cprofile | pyinstrument
+REPORT_PROFILE_DIR = os.environ.get(
+    "REPORT_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "report-profiles")
+)  # profiler dumps
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import (
+    AfterValidator,
+    BeforeValidator,
+    Field,
+    TypeAdapter,
+    ValidationError,
+)
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from typing_extensions import TypedDict
+
+from .model import StorePings
+from .session import async_engine
+from .status import ping_cache
+from .alerts import publish_pings
+from .env import (
+    ALERTS,
+    PING_BUFFER_SIZE,
+    PING_FLUSH_SIZE,
+    PING_FLUSH_INTERVAL,
+    PING_FLUSH_RETRIES,
+    PING_PUT_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+dead_letters = logging.getLogger(f"{__name__}.dead_letter")
+router = APIRouter()
+
+
+def strip_utc_suffix(value):
+    # same format as store_status.csv: "2023-01-22 12:09:39.388884 UTC"
+    if isinstance(value, str) and value.endswith(" UTC"):
+        return value[:-4]
+    return value
+
+
+def naive_utc(value: datetime):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# the range of a MySQL TIMESTAMP
+TIMESTAMP_MIN = datetime(1970, 1, 1, 0, 0, 1)
+TIMESTAMP_MAX = datetime(2038, 1, 19, 3, 14, 7)
+
+
+def storable_time(value: datetime):
+    if not TIMESTAMP_MIN <= value <= TIMESTAMP_MAX:
+        raise ValueError(f"must be between {TIMESTAMP_MIN} and {TIMESTAMP_MAX} UTC")
+    return value
+
+
+class PingIn(TypedDict):
+    store_id: Annotated[int, Field(gt=0, lt=2**63)]  # BIGINT
+    status: Literal["active", "inactive"]
+    timestamp_utc: Annotated[
+        datetime,
+        BeforeValidator(strip_utc_suffix),
+        AfterValidator(naive_utc),
+        AfterValidator(storable_time),
+    ]
+
+
+ping_list = TypeAdapter(list[PingIn])
+
+
+def parse_pings(body: bytes, content_type: str) -> list[PingIn]:
+    if "ndjson" in content_type:
+        lines = [line for line in body.splitlines() if line.strip()]
+        return ping_list.validate_json(b"[" + b",".join(lines) + b"]")
+    body = body.strip()
+    if body.startswith(b"{"):
+        body = b"[" + body + b"]"
+    return ping_list.validate_json(body)
+
+
+async def write_pings(pings):
+    """Insert a batch; raises only when the insert failed and wrote nothing."""
+    # executemany of a single INSERT, sent as multi-row statements by the
+    # dialect's insertmanyvalues batching
+    async with async_engine.begin() as connection:
+        await connection.execute(insert(StorePings), pings)
+    # the rows are written, a retry of the batch would insert them again
+    try:
+        ping_cache.add(pings)
+    except Exception:
+        logger.exception("Failed to add %s pings to the status cache", len(pings))
+    if ALERTS:
+        try:
+            await publish_pings(pings)
+        except Exception:
+            logger.exception("Failed to publish %s pings for alerts", len(pings))
+
+
+def dead_letter(pings):
+    """Log pings that cannot be written, one JSON line each, to replay by hand."""
+    for ping in pings:
+        dead_letters.error(
+            json.dumps(
+                {
+                    "store_id": ping["store_id"],
+                    "status": ping["status"],
+                    "timestamp_utc": ping["timestamp_utc"].isoformat(),
+                }
+            )
+        )
+
+
+class PingBuffer:
+    """In-process write buffer for pings.
+
+    Pings are flushed in batches of up to `flush_size` once that many are
+    pending or `flush_interval` seconds have passed. Producers wait while
+    `max_pings` are pending or being written.
+
+    A batch the database rejects (a constraint or a value it cannot store) is
+    split in halves until the rejected pings are found, which go to the dead
+    letter log. Other errors are retried `retries` times with a doubling
+    pause, then the batch goes to the dead letter log too, so one batch can
+    never hold up the ones behind it.
+    """
+
+    def __init__(
+        self,
+        max_pings,
+        flush_size,
+        flush_interval,
+        retries=PING_FLUSH_RETRIES,
+        writer=write_pings,
+    ):
+        self.max_pings = max_pings
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.writer = writer
+        self.pending = []
+        self.depth = 0  # pending plus in flight
+        self.condition = asyncio.Condition()
+        self.closed = False
+        self.task = None
+        self.stats = {
+            "flushes": 0,
+            "flushed_pings": 0,
+            "failed_flushes": 0,
+            "dead_letter_pings": 0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+            "total_flush_seconds": 0.0,
+        }
+
+    async def start(self):
+        self.closed = False
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        async with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.task is not None:
+            await self.task
+            self.task = None
+
+    def has_room(self, count):
+        return self.depth == 0 or self.depth + count <= self.max_pings
+
+    async def put(self, pings, timeout=None):
+        async with self.condition:
+            await asyncio.wait_for(
+                self.condition.wait_for(lambda: self.has_room(len(pings))), timeout
+            )
+            self.pending.extend(pings)
+            self.depth += len(pings)
+            if len(self.pending) >= self.flush_size:
+                self.condition.notify_all()
+
+    async def next_batch(self):
+        async with self.condition:
+            try:
+                await asyncio.wait_for(
+                    self.condition.wait_for(
+                        lambda: len(self.pending) >= self.flush_size or self.closed
+                    ),
+                    self.flush_interval,
+                )
+            except asyncio.TimeoutError:
+                pass
+            batch = self.pending[: self.flush_size]
+            del self.pending[: self.flush_size]
+            return batch
+
+    async def release(self, count):
+        async with self.condition:
+            self.depth -= count
+            self.condition.notify_all()
+
+    async def write(self, batch):
+        """Write a batch, or the parts of it that can be, dead lettering the rest."""
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                await self.writer(batch)
+            except (DataError, IntegrityError):
+                logger.exception("Database rejected %s pings", len(batch))
+                self.stats["failed_flushes"] += 1
+                if len(batch) == 1:
+                    break
+                middle = len(batch) // 2
+                await self.write(batch[:middle])
+                await self.write(batch[middle:])
+                return
+            except Exception:
+                logger.exception("Failed to write %s pings", len(batch))
+                self.stats["failed_flushes"] += 1
+                if attempt < self.retries:
+                    await asyncio.sleep(self.flush_interval * 2**attempt)
+                continue
+            elapsed = time.perf_counter() - started
+            self.stats["flushes"] += 1
+            self.stats["flushed_pings"] += len(batch)
+            self.stats["last_flush_seconds"] = elapsed
+            self.stats["max_flush_seconds"] = max(
+                self.stats["max_flush_seconds"], elapsed
+            )
+            self.stats["total_flush_seconds"] += elapsed
+            return
+        dead_letter(batch)
+        self.stats["dead_letter_pings"] += len(batch)
+
+    async def flush(self, batch):
+        try:
+            await self.write(batch)
+        finally:
+            await self.release(len(batch))
+
+    async def run(self):
+        while True:
+            batch = await self.next_batch()
+            if batch:
+                await self.flush(batch)
+            elif self.closed:
+                return
+
+    def snapshot(self):
+        flushes = self.stats["flushes"]
+        return {
+            **self.stats,
+            "queue_depth": self.depth,
+            "pending": len(self.pending),
+            "avg_flush_seconds": (
+                self.stats["total_flush_seconds"] / flushes if flushes else 0.0
+            ),
+        }
+
+
+ping_buffer = PingBuffer(
+    max_pings=PING_BUFFER_SIZE,
+    flush_size=PING_FLUSH_SIZE,
+    flush_interval=PING_FLUSH_INTERVAL,
+)
+
+
+@router.post("/pings", status_code=202)
+async def ingest_pings(request: Request):
+    body = await request.body()
+    try:
+        pings = parse_pings(body, request.headers.get("content-type", ""))
+    except ValidationError as error:
+        raise HTTPException(
+            status_code=422,
+            detail=error.errors(include_url=False, include_context=False),
+        )
+    if not pings:
+        return JSONResponse({"accepted": 0}, status_code=202)
+    try:
+        await ping_buffer.put(pings, timeout=PING_PUT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="Ping buffer is full, retry later.",
+            headers={"Retry-After": "1"},
+        )
+    return JSONResponse({"accepted": len(pings)}, status_code=202)
+
+
+@router.get("/pings/buffer")
+async def ping_buffer_status():
+    return JSONResponse(ping_buffer.snapshot())
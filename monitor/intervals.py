@@ -0,0 +1,177 @@
+"""Exact uptime and downtime from status intervals clipped to business hours.
+
+`REPORT_MODE=interval` replaces the ping count estimates of the day and week
+with durations: each ping's status holds until the next ping (the earliest
+one also back to the window start), and only the open time of the store's
+compiled `Schedule` within each interval is counted. Every ping is used, a
+ping sent while closed still gives the status the store opens with.
+
+A store's pings and window starts are swept once, oldest first, while an
+`OpenClock` walks the schedule's intervals alongside, so all windows cost
+O(pings + schedule intervals) together. Times are wall clock seconds like
+the schedule's; where the wall clock steps back at a DST change no time
+passes.
+"""
+import math
+from bisect import bisect_right
+from datetime import timedelta
+
+from .model import Status
+from .queries import range_start, stream_store_pings
+from .schedule import MONDAY, WEEK_SECONDS, load_store_schedules, wall_seconds
+from .windows import DEFAULT_WINDOWS, fetch_span
+from .zones import local_time, localize
+from .profiling import stage, timed
+
+
+class OpenClock:
+    """Open seconds of a schedule up to non-decreasing wall clock offsets."""
+
+    def __init__(self, schedule):
+        self.opens = schedule.opens
+        self.closes = schedule.closes
+        self.prefix = schedule.prefix
+        self.weekly = schedule.weekly_seconds
+        self.week = None
+        self.week_open = 0  # open seconds before the current week
+        self.index = 0  # schedule intervals opening at or before the offset
+
+    def at(self, offset):
+        week, remainder = divmod(offset, WEEK_SECONDS)
+        opens = self.opens
+        if week != self.week:
+            self.week = week
+            self.week_open = week * self.weekly
+            self.index = bisect_right(opens, remainder)
+        index = self.index
+        while index < len(opens) and opens[index] <= remainder:
+            index += 1
+        self.index = index
+        if not index:
+            return self.week_open
+        index -= 1
+        return (
+            self.week_open
+            + self.prefix[index]
+            + min(remainder, self.closes[index])
+            - opens[index]
+        )
+
+
+def interval_sums(statuses, moments, schedule, current_time, windows, since):
+    """{window index: (active, inactive) open seconds}.
+
+    `statuses` and `moments` are a store's ping statuses and local times,
+    newest first. Windows start no earlier than `since`, the start of the
+    pings read.
+    """
+    now = wall_seconds(current_time)
+    first = wall_seconds(since)
+    starts = sorted(
+        (max(now - window.seconds, first), index)
+        for index, window in enumerate(windows)
+    )
+    starts.append((math.inf, None))
+    at = OpenClock(schedule).at
+    active = inactive = 0.0
+    marks = {}
+    # the earliest ping's status also holds before it
+    holding = statuses[-1] is Status.active
+    last = starts[0][0]
+    last_open = at(last)
+    position = 0
+    for index in range(len(moments) - 1, -1, -1):
+        moment = (moments[index] - MONDAY).total_seconds()
+        if moment < last:
+            moment = last  # the wall clock stepped back
+        while starts[position][0] <= moment:
+            start, window = starts[position]
+            start_open = at(start)
+            if holding:
+                active += start_open - last_open
+            else:
+                inactive += start_open - last_open
+            marks[window] = (active, inactive)
+            last, last_open = start, start_open
+            position += 1
+        moment_open = at(moment)
+        if holding:
+            active += moment_open - last_open
+        else:
+            inactive += moment_open - last_open
+        holding = statuses[index] is Status.active
+        last, last_open = moment, moment_open
+    for start, window in starts[position:-1]:
+        start_open = at(start)
+        if holding:
+            active += start_open - last_open
+        else:
+            inactive += start_open - last_open
+        marks[window] = (active, inactive)
+        last, last_open = start, start_open
+    end_open = at(max(now, last))
+    if holding:
+        active += end_open - last_open
+    else:
+        inactive += end_open - last_open
+    return {
+        window: (active - active_before, inactive - inactive_before)
+        for window, (active_before, inactive_before) in marks.items()
+    }
+
+
+def interval_times(statuses, moments, schedule, current_time, since, windows):
+    if not statuses:
+        return [0.0, 0.0] * len(windows)
+    sums = interval_sums(statuses, moments, schedule, current_time, windows, since)
+    times = []
+    for index, window in enumerate(windows):
+        active, inactive = sums[index]
+        times += [
+            round(active / window.unit_seconds, 2),
+            round(inactive / window.unit_seconds, 2),
+        ]
+    return times
+
+
+def store_interval_report(pings, schedule, timezone, current_time, since, windows):
+    with stage("localize"):
+        moments = localize([ping.timestamp_utc for ping in pings], timezone)
+    with stage("intervals"):
+        return interval_times(
+            [ping.status for ping in pings],
+            moments,
+            schedule,
+            current_time=local_time(current_time, timezone),
+            since=local_time(since, timezone),
+            windows=windows,
+        )
+
+
+def bulk_interval_report(
+    timezones: dict, current_time, windows=DEFAULT_WINDOWS, start=None
+) -> list:
+    store_ids = timezones.keys()
+    with stage("timings_query"):
+        schedules = load_store_schedules(store_ids)
+    bulk_reports = []
+    since = range_start(
+        current_time, start, span=timedelta(seconds=fetch_span(windows))
+    )
+    for store_id, store_pings in timed(
+        stream_store_pings(store_ids, since=since, until=current_time), "ping_query"
+    ):
+        bulk_reports.append(
+            [
+                store_id,
+                *store_interval_report(
+                    store_pings,
+                    schedule=schedules[store_id],
+                    timezone=timezones[store_id],
+                    current_time=current_time,
+                    since=since,
+                    windows=windows,
+                ),
+            ]
+        )
+    return bulk_reports
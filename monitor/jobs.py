@@ -0,0 +1,242 @@
+"""Redis backed report queue.
+
+A report is queued as one `plan` task. The worker that claims it splits the
+store ids into ranges of `REPORT_SHARD_SIZE` and queues a `shard` task for
+each. Claimed tasks sit in a sorted set scored by lease expiry; workers extend
+the lease while they run and any worker puts expired tasks back on the queue.
+Shard rows are kept in a results hash, and whoever stores the last one merges
+them into the report file. A merge whose outcome could not be stored is queued
+again as a `merge` task.
+"""
+import json
+
+from .session import redis_session, async_redis
+from .constants import (
+    REDIS_REPORT_TASKS,
+    REDIS_REPORT_LEASES,
+    REDIS_REPORT_JOB,
+    REDIS_REPORT_RESULTS,
+    REDIS_REPORT_ALIVE,
+)
+from .env import REPORT_ALIVE_SECONDS, REPORT_LEASE_SECONDS, REPORT_JOB_TTL
+
+# pop a task and lease it in one step, so a crash can never lose it
+claim_script = redis_session.register_script(
+    """
+    local task = redis.call("LPOP", KEYS[1])
+    if task then
+        redis.call("ZADD", KEYS[2], ARGV[1], task)
+    end
+    return task
+    """
+)
+
+requeue_script = redis_session.register_script(
+    """
+    local expired = redis.call("ZRANGEBYSCORE", KEYS[2], "-inf", ARGV[1])
+    for _, task in ipairs(expired) do
+        redis.call("ZREM", KEYS[2], task)
+        redis.call("RPUSH", KEYS[1], task)
+    end
+    return #expired
+    """
+)
+
+# store a shard's rows only while still holding its lease; returns the number
+# of shards done, or -1 when the lease was lost to another worker
+complete_script = redis_session.register_script(
+    """
+    if redis.call("ZREM", KEYS[1], ARGV[1]) == 0 then
+        return -1
+    end
+    redis.call("HSET", KEYS[2], ARGV[2], ARGV[3])
+    redis.call("EXPIRE", KEYS[2], ARGV[4])
+    return redis.call("HLEN", KEYS[2])
+    """
+)
+
+
+def redis_now():
+    seconds, microseconds = redis_session.time()
+    return seconds + microseconds / 1e6
+
+
+def job_key(report_id):
+    return REDIS_REPORT_JOB.format(report_id)
+
+
+def results_key(report_id):
+    return REDIS_REPORT_RESULTS.format(report_id)
+
+
+def alive_key(report_id):
+    return REDIS_REPORT_ALIVE.format(report_id)
+
+
+def touch_report(report_id, pipe=None):
+    """Mark the report as worked on for another `REPORT_ALIVE_SECONDS`."""
+    pipe = redis_session if pipe is None else pipe
+    return pipe.set(alive_key(report_id), 1, ex=REPORT_ALIVE_SECONDS)
+
+
+def encode_task(task: dict):
+    # the encoded task is also its lease member, keep it stable
+    return json.dumps(task, sort_keys=True)
+
+
+def task_name(task: dict):
+    return f"{task['kind']}:{task.get('index', 0)}"
+
+
+def queue_report(pipe, report_id, mode, current_time, windows=None, start=None):
+    # commands only, so the same code fills sync and asyncio pipelines
+    job = job_key(report_id)
+    pipe.hset(
+        job,
+        mapping={
+            "status": "pending",
+            "mode": mode,
+            "current_time": current_time.isoformat(),
+            "windows": json.dumps(windows or []),
+            "start": start.isoformat() if start else "",
+        },
+    )
+    pipe.expire(job, REPORT_JOB_TTL)
+    touch_report(report_id, pipe)
+    pipe.rpush(
+        REDIS_REPORT_TASKS, encode_task({"report_id": report_id, "kind": "plan"})
+    )
+
+
+def enqueue_report(report_id, mode, current_time, windows=None, start=None):
+    with redis_session.pipeline() as pipe:
+        queue_report(pipe, report_id, mode, current_time, windows, start)
+        pipe.execute()
+
+
+async def enqueue_report_async(report_id, mode, current_time, windows=None, start=None):
+    async with async_redis.pipeline() as pipe:
+        queue_report(pipe, report_id, mode, current_time, windows, start)
+        await pipe.execute()
+
+
+def enqueue_shards(report_id, ranges):
+    """Queue one shard task per (first, last) store id range."""
+    tasks = [
+        encode_task(
+            {
+                "report_id": report_id,
+                "kind": "shard",
+                "index": index,
+                "first": first,
+                "last": last,
+            }
+        )
+        for index, (first, last) in enumerate(ranges)
+    ]
+    with redis_session.pipeline() as pipe:
+        pipe.hset(
+            job_key(report_id),
+            mapping={"status": "running", "shards": len(tasks), "started": redis_now()},
+        )
+        if tasks:
+            pipe.rpush(REDIS_REPORT_TASKS, *tasks)
+        pipe.execute()
+
+
+def claim_task():
+    expiry = redis_now() + REPORT_LEASE_SECONDS
+    task = claim_script(keys=[REDIS_REPORT_TASKS, REDIS_REPORT_LEASES], args=[expiry])
+    if task is None:
+        return None
+    decoded = json.loads(task)
+    touch_report(decoded["report_id"])
+    return task, decoded
+
+
+def requeue_expired():
+    return requeue_script(
+        keys=[REDIS_REPORT_TASKS, REDIS_REPORT_LEASES], args=[redis_now()]
+    )
+
+
+def extend_lease(task: str):
+    """Push back the lease expiry, False once the lease was lost."""
+    expiry = redis_now() + REPORT_LEASE_SECONDS
+    with redis_session.pipeline() as pipe:
+        pipe.zadd(REDIS_REPORT_LEASES, {task: expiry}, xx=True, ch=True)
+        touch_report(json.loads(task)["report_id"], pipe)
+        extended, _ = pipe.execute()
+    return bool(extended)
+
+
+def release_task(task: str):
+    return bool(redis_session.zrem(REDIS_REPORT_LEASES, task))
+
+
+def retry_task(task: str):
+    if release_task(task):
+        redis_session.rpush(REDIS_REPORT_TASKS, task)
+
+
+def job_state(report_id):
+    return redis_session.hgetall(job_key(report_id))
+
+
+def record_attempt(task: dict):
+    return redis_session.hincrby(
+        job_key(task["report_id"]), f"attempts:{task_name(task)}"
+    )
+
+
+def record_profile(task: dict, profile: dict):
+    redis_session.hset(
+        job_key(task["report_id"]), f"profile:{task_name(task)}", json.dumps(profile)
+    )
+
+
+def job_profiles(job: dict):
+    return [
+        json.loads(value)
+        for field, value in job.items()
+        if field.startswith("profile:")
+    ]
+
+
+def complete_shard(task: str, report_id, index, rows):
+    return complete_script(
+        keys=[REDIS_REPORT_LEASES, results_key(report_id)],
+        args=[task, index, json.dumps(rows), REPORT_JOB_TTL],
+    )
+
+
+def claim_merge(report_id):
+    return bool(redis_session.hsetnx(job_key(report_id), "merging", 1))
+
+
+def requeue_merge(report_id):
+    """Queue the report's merge again as a `merge` task.
+
+    `merging` stays set, the merge task's lease is what claims the merge now.
+    """
+    with redis_session.pipeline() as pipe:
+        pipe.rpush(
+            REDIS_REPORT_TASKS, encode_task({"report_id": report_id, "kind": "merge"})
+        )
+        touch_report(report_id, pipe)
+        pipe.execute()
+
+
+def shard_results(report_id):
+    """Each shard's rows in shard order, one shard in memory at a time."""
+    key = results_key(report_id)
+    for index in sorted(redis_session.hkeys(key), key=int):
+        yield json.loads(redis_session.hget(key, index))
+
+
+def finish_job(report_id, status):
+    with redis_session.pipeline() as pipe:
+        pipe.hset(job_key(report_id), "status", status)
+        pipe.expire(job_key(report_id), REPORT_JOB_TTL)
+        pipe.delete(results_key(report_id), alive_key(report_id))
+        pipe.execute()
@@ -1,313 +1,215 @@
-import zoneinfo
-from datetime import datetime, timedelta, time, date
-from dataclasses import dataclass
-from itertools import islice
-import tempfile
-import csv
-
-from fastapi import APIRouter, BackgroundTasks, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from datetime import datetime, timedelta
+from functools import partial
+from time import perf_counter
+import asyncio
+import json
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import AfterValidator, BaseModel, BeforeValidator, Field
+from typing import Annotated
 from sqlalchemy.exc import NoResultFound
 from uuid import uuid4
-from .model import Reports, StoreTimezones, StorePings, StoreTimings, JobStatus
-from .session import db_session as session, redis_session
-from sqlalchemy import desc, update
-from .utils import check_exists
-from .constants import REDIS_STORE_IDS, REDIS_TIMEZONES
+from .model import Reports, JobStatus
+from .session import db_session as session, get_session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from .report import StoreStatus, store_report
+from .queries import (
+    get_timezones,
+    chunk_timezones,
+    range_start,
+    stream_store_pings,
+)
+from .schedule import load_store_timings
+from .rollup import update_rollups, bulk_rollup_report
+from .vectorized import bulk_vector_report
+from .pingstore import bulk_array_report
+from .intervals import bulk_interval_report
+from .parallel import concurrent_reports, parallel_reports
+from .jobs import enqueue_report_async, touch_report
+from .ingest import naive_utc, strip_utc_suffix
+from .retention import compacted_days, compacted_detail
+from .memo import cached_report, claim_report, report_key
+from .sinks import HEADER, format_for, parse_range, report_sink, storage_for
+from .windows import (
+    WindowSpec,
+    bulk_window_report,
+    encode_windows,
+    parse_windows,
+    report_span,
+    window_header,
+)
+from .profiling import dump_profile, profiled, record_chunk, record_report, stage, timed
+from .env import (
+    REPORT_MODE,
+    REPORT_CHUNK_SIZE,
+    REPORT_WORKERS,
+    REPORT_CONCURRENCY,
+    REPORT_QUEUE,
+    REPORT_CACHE_TTL,
+    REPORT_AS_OF_STEP,
+)
 
 router = APIRouter()
 running = JobStatus.running.name
 failed = JobStatus.failed.name
 finished = JobStatus.finished.name
 
-start_time = datetime(year=2023, month=1, day=25, hour=18, minute=13, second=22)
-
-
-@dataclass
-class StoreStatus:
-    active_hour: int
-    inactive_hour: int
-    active_day: int
-    inactive_day: int
-    active_week: int
-    inactive_week: int
-
-
-@dataclass
-class LocalPing:
-    status: str
-    local_time: datetime
-
-
-machine_user_text = {
-    "active_hour": "uptime_last_hour(in minutes)",
-    "inactive_hour": "downtime_last_hour(in minutes)",
-    "active_day": "uptime_last_day(in hours)",
-    "inactive_day": "downtime_last_day(in hours)",
-    "active_week": "uptime_last_week(in hours)",
-    "inactive_week": "downtime_last_week(in hours)",
-}
-
-
-def cache_timezones():
-    all_zones = session.query(
-        StoreTimezones.store_id, StoreTimezones.timezone_str
-    ).all()
-    zone_map = {}
-    for zone in all_zones:
-        zone_map.update({zone.store_id: zone.timezone_str})
-    redis_session.hmset(REDIS_TIMEZONES, zone_map)
-    return zone_map
-
-
-def get_timezones():
-    if check_exists(redis_key=REDIS_STORE_IDS):
-        return redis_session.hgetall(REDIS_TIMEZONES)
-    else:
-        return cache_timezones()
-
-
-def last_hour_status(pings: list[LocalPing], current_time, timings):
-    last_hour = {"active": timedelta(seconds=0), "inactive": timedelta(seconds=0)}
-    next_ping = current_time
-    for ping in pings:
-        if not valid_ping(ping, timings=timings):
-            continue
-        elif (current_time - ping.local_time) < timedelta(hours=1):
-            last_hour[ping.status.name] += next_ping - ping.local_time
-        else:
-            last_time = next_ping - current_time + timedelta(hours=1)
-            if last_time > timedelta(seconds=0):
-                last_hour[ping.status.name] += last_time
-            break
-        next_ping = ping.local_time
-    active_time = round(last_hour["active"].total_seconds() / 60, 2)
-    inactive_time = round(last_hour["inactive"].total_seconds() / 60, 2)
-    return active_time, inactive_time
-
-
-def valid_ping(ping, timings):
-    weekday = ping.local_time.weekday()
-    if timings.get(weekday):
-        temp_start_time = timings[weekday][0]
-        temp_end_time = timings[weekday][1]
-    else:
-        temp_start_time = time.min
-        temp_end_time = time.max
-    day_time = ping.local_time.time()
-    if day_time < temp_start_time or day_time > temp_end_time:
-        return False
-    return True
-
-
-def timediff(start_time, end_time):
-    diff = datetime.combine(date.min, end_time) - datetime.combine(date.min, start_time)
-    if diff < timedelta(seconds=0):
-        return timedelta(seconds=0)
-    return diff
-
-
-def close_timings(ping, timings):
-    weekday = ping.local_time.weekday()
-    if timings.get(weekday):
-        start_time = timings[weekday][0]
-    else:
-        start_time = time.min
-    yesterday = (weekday - 1) % 7
-    if timings.get(yesterday):
-        end_time = timings[yesterday][1]
-    else:
-        end_time = time.max
-    return start_time, end_time
-
-
-def working_hours_week(timings):
-    total_hours_week = timedelta(seconds=0)
-    for i in range(6):
-        if timings.get(i):
-            total_hours_week += timediff(*timings[i])
-        else:
-            total_hours_week += timedelta(days=1)
-    total_hours_week = total_hours_week.total_seconds() / (60 * 60)
-    return total_hours_week
-
-
-def cumulative_status(pings: list[LocalPing], timings, current_time):
-    last_week_counts = {"active": 0, "inactive": 0}
-    last_day_counts = {"active": 0, "inactive": 0}
-    yesterday_end, today_start = close_timings(ping=pings[0], timings=timings)
-    total_hours_week = working_hours_week(timings=timings)
-    max_ping_day = pings[0].local_time
-    for ping in pings:
-        if not valid_ping(ping, timings=timings):
-            continue
-        if ping.local_time > current_time - timedelta(days=1):
-            last_day_counts[ping.status.name] += 1
-        last_week_counts[ping.status.name] += 1
-    active_week = round(
-        last_week_counts["active"]
-        / (last_week_counts["active"] + last_week_counts["inactive"] + 1e-6)
-        * total_hours_week,
-        2,
-    )
-    inactive_week = round(
-        last_week_counts["inactive"]
-        / (last_week_counts["active"] + last_week_counts["inactive"] + 1e-6)
-        * total_hours_week,
-        2,
-    )
-    working_hours = timediff(today_start, max_ping_day.time()) + timediff(
-        (max_ping_day - timedelta(days=1)).time(), yesterday_end
-    )
-    working_hours = working_hours.total_seconds() / (60 * 60)
-    active_day = round(
-        last_day_counts["active"]
-        / (last_day_counts["active"] + last_day_counts["inactive"] + 1e-6)
-        * (working_hours),
-        2,
-    )
-    inactive_day = round(
-        last_day_counts["inactive"]
-        / (last_day_counts["active"] + last_day_counts["inactive"] + 1e-6)
-        * (working_hours),
-        2,
-    )
-    return active_day, inactive_day, active_week, inactive_week
-
-
-def calculate_times(pings, timings, current_time):
-    active_hour, inactive_hour = last_hour_status(
-        pings=pings, current_time=current_time, timings=timings
-    )
-    active_day, inactive_day, active_week, inactive_week = cumulative_status(
-        pings=pings, timings=timings, current_time=current_time
-    )
-    return [
-        active_hour,
-        inactive_hour,
-        active_day,
-        inactive_day,
-        active_week,
-        inactive_week,
-    ]
+EPOCH = datetime(1970, 1, 1)
+UtcTime = Annotated[
+    datetime, BeforeValidator(strip_utc_suffix), AfterValidator(naive_utc)
+]
 
 
-def store_report(pings, timings, timezone, current_time):
-    local_pings = []
-    for ping in pings:
-        local_pings.append(
-            LocalPing(
-                status=ping.status,
-                local_time=ping.timestamp_utc.astimezone(zoneinfo.ZoneInfo(timezone)),
-            )
-        )
-    return calculate_times(
-        pings=local_pings,
-        timings=timings,
-        current_time=current_time.astimezone(zoneinfo.ZoneInfo(timezone)),
-    )
+def report_time(step=REPORT_AS_OF_STEP):
+    """UTC now, floored to `step` seconds so triggers close together share a report."""
+    now = datetime.utcnow()
+    if step <= 0:
+        return now
+    step = timedelta(seconds=step)
+    return EPOCH + (now - EPOCH) // step * step
 
 
-def bulk_store_report(timezones: dict, current_time) -> list[StoreStatus]:
+def bulk_store_report(timezones: dict, current_time, start=None) -> list[StoreStatus]:
     store_ids = timezones.keys()
-    pings = (
-        session.query(StorePings.status, StorePings.timestamp_utc, StorePings.store_id)
-        .filter(StorePings.store_id.in_(store_ids))
-        .filter(StorePings.timestamp_utc > (current_time - timedelta(days=7)))
-        .order_by(StorePings.store_id, desc(StorePings.timestamp_utc))
-        .all()
-    )
-    timings = (
-        session.query(
-            StoreTimings.start_time_local,
-            StoreTimings.end_time_local,
-            StoreTimings.day,
-            StoreTimings.store_id,
-        )
-        .filter(StoreTimings.store_id.in_(store_ids))
-        .order_by(StoreTimings.store_id)
-        .all()
-    )
-    if not pings or not timings:
+    with stage("timings_query"):
+        store_timings = load_store_timings(store_ids)
+    if not store_timings:
         return []
-    store_timings = {}
-    for timing in timings:
-        if not store_timings.get(timing.store_id):
-            store_timings[timing.store_id] = {}
-        store_timings[timing.store_id][timing.day] = (
-            timing.start_time_local,
-            timing.end_time_local,
-        )
-    prev_store_id = None
-    store_pings = []
     bulk_reports = []
-    for ping in pings:
-        if ping.store_id != prev_store_id and prev_store_id != None and store_pings:
-            bulk_reports.append(
-                [
-                    prev_store_id,
-                    *store_report(
-                        store_pings,
-                        timezone=timezones[prev_store_id],
-                        timings=store_timings.get(prev_store_id, {}),
-                        current_time=current_time.astimezone(
-                            zoneinfo.ZoneInfo(timezones[prev_store_id])
-                        ),
-                    ),
-                ]
-            )
-            store_pings = []
-        else:
-            store_pings.append(ping)
-        prev_store_id = ping.store_id
-    if store_pings:
+    for store_id, store_pings in timed(
+        stream_store_pings(
+            store_ids, since=range_start(current_time, start), until=current_time
+        ),
+        "ping_query",
+    ):
         bulk_reports.append(
-            store_report(
-                store_pings,
-                timezone=timezones[prev_store_id],
-                timings=store_timings.get(prev_store_id, {}),
-                current_time=current_time,
-            )
+            [
+                store_id,
+                *store_report(
+                    store_pings,
+                    timezone=timezones[store_id],
+                    timings=store_timings.get(store_id, {}),
+                    current_time=current_time,
+                ),
+            ]
         )
     return bulk_reports
 
 
-def chunk_timezones(timezones, chunk_size=100):
-    it = iter(timezones)
-    for idx in range(0, len(timezones), chunk_size):
-        yield {k: timezones[k] for k in islice(it, chunk_size)}
+report_modes = {
+    "python": bulk_store_report,
+    "rollup": bulk_rollup_report,
+    "vector": bulk_vector_report,
+    "array": bulk_array_report,
+    "interval": bulk_interval_report,
+}
 
 
-def convert_csv(final_reports, report_id):
-    with tempfile.NamedTemporaryFile(
-        suffix=f"_{report_id}.csv", delete=False, mode="w"
-    ) as csvfile:
-        writer = csv.writer(
-            csvfile,
+def report_chunks(
+    timezones: dict,
+    current_time,
+    mode=REPORT_MODE,
+    chunk_size=REPORT_CHUNK_SIZE,
+    workers=REPORT_WORKERS,
+    concurrency=REPORT_CONCURRENCY,
+    windows=None,
+    start=None,
+):
+    bulk_report = report_modes[mode]
+    if windows is not None and mode == "interval":
+        bulk_report = partial(bulk_interval_report, windows=windows)
+    elif windows is not None:
+        bulk_report = partial(bulk_window_report, windows=windows)
+    if start is not None:
+        bulk_report = partial(bulk_report, start=start)
+    chunks = chunk_timezones(timezones=timezones, chunk_size=chunk_size)
+    if workers > 1:
+        chunk_reports = parallel_reports(
+            bulk_report, chunks, current_time=current_time, workers=workers
+        )
+    elif concurrency > 1:
+        chunk_reports = concurrent_reports(
+            bulk_report, chunks, current_time=current_time, concurrency=concurrency
+        )
+    else:
+        chunk_reports = (
+            bulk_report(timezones=chunked_zones, current_time=current_time)
+            for chunked_zones in chunks
         )
-        writer.writerow(["store_id", *list(machine_user_text.values())])
-        writer.writerows(final_reports)
-        return csvfile.name
+    for chunk_report in chunk_reports:
+        record_chunk(chunk_report)
+        yield chunk_report
 
 
-def generate_report(report_id, chunk_size=100, update_db=True):
+def report_rows(timezones: dict, current_time, **options):
+    final_report = []
+    for chunk_report in report_chunks(timezones, current_time, **options):
+        final_report.extend(chunk_report)
+    return final_report
+
+
+def generate_report(
+    report_id,
+    chunk_size=REPORT_CHUNK_SIZE,
+    update_db=True,
+    mode=REPORT_MODE,
+    workers=REPORT_WORKERS,
+    windows=None,
+    as_of=None,
+    start=None,
+):
+    """Write the report of pings in [start, as_of), as of `as_of` (default now)."""
     if update_db:
         update_report_status(report_id=report_id, status=running)
-    current_time = start_time  # Should be substituted with datetime.utcnow()
-    final_report = []
-    for chunked_zones in chunk_timezones(
-        timezones=get_timezones(), chunk_size=chunk_size
-    ):
-        final_report.extend(
-            bulk_store_report(timezones=chunked_zones, current_time=current_time)
-        )
-    filename = convert_csv(final_report, report_id="test")
+    current_time = as_of or datetime.utcnow()
+    started = perf_counter()
+    with profiled(name=f"report_{report_id}") as profile:
+        try:
+            if mode == "rollup":
+                update_rollups(chunk_size=chunk_size)
+            with stage("timezones"):
+                timezones = get_timezones()
+            header = HEADER if windows is None else window_header(windows)
+            with report_sink(report_id, header=header) as sink:
+                for chunk_report in report_chunks(
+                    timezones,
+                    current_time=current_time,
+                    mode=mode,
+                    chunk_size=chunk_size,
+                    workers=workers,
+                    windows=windows,
+                    start=start,
+                ):
+                    with stage("write"):
+                        sink.write(chunk_report)
+                    if update_db:
+                        touch_report(report_id)
+        except Exception:
+            if update_db:
+                session.rollback()
+                update_report_status(
+                    report_id=report_id,
+                    status=failed,
+                    profile=dump_profile(profile.as_dict()),
+                )
+                record_report(profile.as_dict(), failed, perf_counter() - started)
+            raise
     if update_db:
-        update_report_status(report_id=report_id, status=finished, filename=filename)
+        update_report_status(
+            report_id=report_id,
+            status=finished,
+            filename=sink.location,
+            profile=dump_profile(profile.as_dict()),
+        )
+        record_report(profile.as_dict(), finished, perf_counter() - started)
 
 
-def update_report_status(report_id, status, filename=None):
+def update_report_status(report_id, status, filename=None, profile=None):
     update_values = {"status": status, "filename": filename}
+    if profile is not None:
+        update_values["profile"] = profile
     if status == running:
         update_values["started_at"] = datetime.utcnow()
     elif status == finished:
@@ -319,36 +221,139 @@ def update_report_status(report_id, status, filename=None):
     session.commit()
 
 
+class ReportSpec(BaseModel):
+    windows: list[WindowSpec] = []
+    as_of: UtcTime | None = None
+    start: UtcTime | None = Field(None, alias="from")
+
+
 @router.post(
     "/trigger_report",
 )
-async def trigger_report(background_tasks: BackgroundTasks):
+async def trigger_report(
+    background_tasks: BackgroundTasks,
+    spec: ReportSpec | None = None,
+    db: AsyncSession = Depends(get_session),
+):
+    spec = spec or ReportSpec()
+    specs = [window.model_dump() for window in spec.windows]
+    windows = parse_windows(specs)
+    as_of = spec.as_of or report_time()
+    if spec.start is not None and spec.start >= as_of:
+        raise HTTPException(status_code=422, detail="from must be before as_of.")
+    span = report_span(windows)
+    if spec.start is not None and spec.start < as_of - span:
+        # no column covers pings that old, they would not be counted
+        days = span / timedelta(days=1)
+        raise HTTPException(
+            status_code=422, detail=f"from must be at most {days:g} days before as_of."
+        )
+    compacted = (
+        await db.scalars(compacted_days(spec.start or as_of - span, as_of))
+    ).all()
+    if compacted:
+        raise HTTPException(status_code=422, detail=compacted_detail(compacted))
+    key = cached_id = None
+    if REPORT_CACHE_TTL > 0:
+        key = await report_key(
+            db,
+            REPORT_MODE,
+            as_of,
+            windows=encode_windows(windows),
+            start=spec.start,
+        )
+        cached_id, reusable = await cached_report(db, key)
+        if reusable:
+            return JSONResponse({"report_id": cached_id})
     report_id = str(uuid4())[:16]
     report = Reports(
         report_id=report_id, status="pending", created_at=datetime.utcnow()
     )
-    session.add(report)
-    session.commit()
-    background_tasks.add_task(generate_report, report_id)
+    db.add(report)
+    await db.commit()
+    if key is not None:
+        holder = await claim_report(key, report_id, previous=cached_id)
+        if holder != report_id:
+            # a concurrent trigger got there first, follow its report
+            await db.delete(report)
+            await db.commit()
+            return JSONResponse({"report_id": holder})
+    if REPORT_QUEUE == "redis":
+        await enqueue_report_async(
+            report_id,
+            mode=REPORT_MODE,
+            current_time=as_of,
+            windows=specs,
+            start=spec.start,
+        )
+    else:
+        background_tasks.add_task(
+            generate_report, report_id, windows=windows, as_of=as_of, start=spec.start
+        )
     return JSONResponse({"report_id": report_id})
 
 
+async def report_download(location, report_id, range_header=None):
+    storage = storage_for(location)
+    writer_class = format_for(location)
+    size = await asyncio.to_thread(storage.size, location)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": (
+            f'attachment; filename="report_{report_id}.{writer_class.extension}"'
+        ),
+    }
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        raise HTTPException(
+            status_code=416, headers={"Content-Range": f"bytes */{size}"}
+        )
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range is not None:
+        status_code = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    # a sync iterator, starlette pulls each chunk in its threadpool
+    return StreamingResponse(
+        storage.read(location, start, end) if size else iter(()),
+        status_code=status_code,
+        media_type=writer_class.media_type,
+        headers=headers,
+    )
+
+
 @router.get("/get_report/{report_id}")
-async def get_report(report_id: str):
+async def get_report(
+    report_id: str, request: Request, db: AsyncSession = Depends(get_session)
+):
     try:
-        report = (
-            session.query(Reports.filename, Reports.status)
-            .filter(Reports.report_id == report_id)
-            .one()
+        result = await db.execute(
+            select(Reports.filename, Reports.status).where(
+                Reports.report_id == report_id
+            )
         )
+        report = result.one()
         status = report.status.name
         if status == finished:
-            return FileResponse(
-                path=report.filename,
-                media_type="text/csv",
-                filename=f"report_{report_id}.csv",
+            return await report_download(
+                report.filename, report_id, request.headers.get("range")
             )
         else:
             return JSONResponse(content={"status": status})
     except NoResultFound:
         raise HTTPException(status_code=404, detail=f"Report_id {report_id} not found.")
+
+
+@router.get("/get_report/{report_id}/profile")
+async def get_report_profile(report_id: str, db: AsyncSession = Depends(get_session)):
+    profile = await db.scalar(
+        select(Reports.profile).where(Reports.report_id == report_id)
+    )
+    if profile is None:
+        raise HTTPException(
+            status_code=404, detail=f"No profile for report_id {report_id}."
+        )
+    return JSONResponse(json.loads(profile))
@@ -0,0 +1,78 @@
+"""Reuse finished or running reports built from the same data.
+
+A report is keyed by its mode, file format, time range, rolling windows, the
+highest `store_pings.id` and the store timings and timezones versions. While
+none of them moves, `/trigger_report` hands back the report already made (or being
+made) for that key instead of starting another one. A report not finished yet
+is only handed back while its heartbeat key lives, i.e. something queued it or
+worked on it in the last `REPORT_ALIVE_SECONDS`.
+"""
+from sqlalchemy import func, select
+
+from .model import Reports, StorePings, JobStatus
+from .session import async_redis
+from .jobs import alive_key
+from .constants import (
+    REDIS_REPORT_CACHE,
+    REDIS_TIMEZONES_VERSION,
+    REDIS_TIMINGS_VERSION,
+)
+from .env import REPORT_ALIVE_SECONDS, REPORT_CACHE_TTL, REPORT_FORMAT
+
+# point the key at ARGV[1] unless another report took it since it was read,
+# and start the new report's heartbeat
+claim_script = async_redis.register_script(
+    """
+    local current = redis.call("GET", KEYS[1])
+    if current and current ~= ARGV[2] then
+        return current
+    end
+    redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[3])
+    redis.call("SET", KEYS[2], 1, "EX", ARGV[4])
+    return ARGV[1]
+    """
+)
+
+
+async def report_key(
+    db, mode, current_time, report_format=REPORT_FORMAT, windows="", start=None
+):
+    max_ping_id = await db.scalar(select(func.max(StorePings.id)))
+    timings_version, timezones_version = await async_redis.mget(
+        REDIS_TIMINGS_VERSION, REDIS_TIMEZONES_VERSION
+    )
+    return REDIS_REPORT_CACHE.format(
+        f"{mode}:{report_format}:{current_time.isoformat()}:{max_ping_id or 0}"
+        f":{timings_version or 0}:{timezones_version or 0}:{windows}"
+        f":{start.isoformat() if start else ''}"
+    )
+
+
+async def report_status(db, report_id):
+    status = await db.scalar(
+        select(Reports.status).where(Reports.report_id == report_id)
+    )
+    return status and status.name
+
+
+async def cached_report(db, key):
+    """(report_id, reusable) of the report last claimed for `key`."""
+    report_id = await async_redis.get(key)
+    if report_id is None:
+        return None, False
+    status = await report_status(db, report_id)
+    if status == JobStatus.finished.name:
+        return report_id, True
+    if status == JobStatus.failed.name:
+        return report_id, False
+    # pending or running: reused while queued or worked on, replaced once the
+    # heartbeat of one whose enqueue failed or whose process died runs out
+    return report_id, bool(await async_redis.exists(alive_key(report_id)))
+
+
+async def claim_report(key, report_id, previous=None):
+    """Claim `key` for `report_id`; returns the report that holds it."""
+    return await claim_script(
+        keys=[key, alive_key(report_id)],
+        args=[report_id, previous or "", REPORT_CACHE_TTL, REPORT_ALIVE_SECONDS],
+    )
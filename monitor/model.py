@@ -1,7 +1,19 @@
 from sqlalchemy.orm import declarative_base
 import enum
 
-from sqlalchemy import Column, BIGINT, VARCHAR, TIME, TIMESTAMP, INT, Enum, BINARY, func
+from sqlalchemy import (
+    Column,
+    BIGINT,
+    VARCHAR,
+    TIME,
+    TIMESTAMP,
+    DATE,
+    INT,
+    TEXT,
+    Enum,
+    BINARY,
+    func,
+)
 
 Base = declarative_base()
 
@@ -49,3 +61,45 @@ class Reports(Base):
     started_at = Column("started_at", TIMESTAMP, nullable=True)
     finished_at = Column("finished_at", TIMESTAMP, nullable=False)
     filename = Column("filename", VARCHAR(255), nullable=True)
+    profile = Column("profile", TEXT, nullable=True)  # JSON stage timings
+
+
+class StoreHourlyRollups(Base):
+    __tablename__ = "store_hourly_rollups"
+    store_id = Column("store_id", BIGINT, primary_key=True)
+    hour_utc = Column("hour_utc", TIMESTAMP, primary_key=True)
+    active_count = Column("active_count", INT, nullable=False, default=0)
+    inactive_count = Column("inactive_count", INT, nullable=False, default=0)
+
+
+class StoreRollupTails(Base):
+    __tablename__ = "store_rollup_tails"
+    store_id = Column("store_id", BIGINT, primary_key=True)
+    last_ping_utc = Column("last_ping_utc", TIMESTAMP, nullable=True)
+
+
+class StorePingSummaries(Base):
+    __tablename__ = "store_ping_summaries"
+    store_id = Column("store_id", BIGINT, primary_key=True)
+    hour_utc = Column("hour_utc", TIMESTAMP, primary_key=True)
+    active_count = Column("active_count", INT, nullable=False, default=0)
+    inactive_count = Column("inactive_count", INT, nullable=False, default=0)
+
+
+class PingArchives(Base):
+    __tablename__ = "ping_archives"
+    id = Column("id", BIGINT, primary_key=True, autoincrement=True)
+    day = Column("day", DATE, nullable=False, index=True)
+    location = Column("location", VARCHAR(255), nullable=False)
+    ping_count = Column("ping_count", BIGINT, nullable=False)
+    first_id = Column("first_id", BIGINT, nullable=False)
+    last_id = Column("last_id", BIGINT, nullable=False)
+    created_at = Column("created_at", TIMESTAMP, server_default=func.now())
+
+
+class RollupCheckpoints(Base):
+    __tablename__ = "rollup_checkpoints"
+    name = Column("name", VARCHAR(64), primary_key=True)
+    last_ping_id = Column("last_ping_id", BIGINT, nullable=False, default=0)
+    gaps = Column("gaps", TEXT, nullable=True)  # JSON [first, last, seen] id ranges
+    updated_at = Column("updated_at", TIMESTAMP, nullable=True)
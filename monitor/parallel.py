@@ -0,0 +1,74 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from .session import engine, db_session as session
+from .profiling import current_profile, profiled
+from .env import REPORT_START_METHOD
+
+
+def init_worker():
+    # connections inherited from the parent (fork) must never be shared, give
+    # the worker a fresh pool and session of its own
+    engine.dispose(close=False)
+    session.remove()
+
+
+def parallel_reports(bulk_report, chunks, current_time, workers):
+    """Run `bulk_report` over timezone chunks in a process pool.
+
+    Chunk results are yielded in submission order, so callers see the same
+    sequence of rows as the serial loop in `generate_report`.
+    """
+    context = multiprocessing.get_context(REPORT_START_METHOD)
+    if REPORT_START_METHOD == "forkserver":
+        # workers fork from a server that already imported the report code
+        function = getattr(bulk_report, "func", bulk_report)  # unwrap partials
+        context.set_forkserver_preload([function.__module__])
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=init_worker
+    ) as pool:
+        profile = current_profile.get()
+        if profile is None:
+            yield from pool.map(partial(bulk_report, current_time=current_time), chunks)
+            return
+        for rows, chunk_profile in pool.map(
+            partial(profiled_chunk, bulk_report, current_time=current_time), chunks
+        ):
+            profile.merge(chunk_profile)
+            yield rows
+
+
+def profiled_chunk(bulk_report, timezones, current_time):
+    # stage timings of a pool process go back to the parent with the rows
+    with profiled() as profile:
+        rows = bulk_report(timezones=timezones, current_time=current_time)
+    return rows, profile.as_dict()
+
+
+def chunk_in_thread(bulk_report, timezones, current_time, profile=None):
+    # scoped sessions are per thread, hand the connection back after each chunk
+    token = current_profile.set(profile)
+    try:
+        return bulk_report(timezones=timezones, current_time=current_time)
+    finally:
+        current_profile.reset(token)
+        session.remove()
+
+
+def concurrent_reports(bulk_report, chunks, current_time, concurrency):
+    """Run `bulk_report` over timezone chunks in threads of this process.
+
+    Each thread queries on its own session and connection, so up to
+    `concurrency` chunk queries are in flight while other chunks compute.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        yield from pool.map(
+            partial(
+                chunk_in_thread,
+                bulk_report,
+                current_time=current_time,
+                profile=current_profile.get(),
+            ),
+            chunks,
+        )
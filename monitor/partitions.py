@@ -0,0 +1,70 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from .session import db_session as session
+
+PARTITION_PREFIX = "p"
+PARTITION_DAYS_AHEAD = 7
+
+
+def partition_name(day: date):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def partition_day(name):
+    return datetime.strptime(name[len(PARTITION_PREFIX) :], "%Y%m%d").date()
+
+
+def day_partitions():
+    rows = session.execute(
+        text(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'store_pings' "
+            "AND PARTITION_NAME IS NOT NULL AND PARTITION_NAME != 'pmax'"
+        )
+    ).scalars()
+    return sorted(partition_day(name) for name in rows)
+
+
+def days_after(last: date, until: date):
+    """The days after `last` up to and including `until`."""
+    return [last + timedelta(days=day) for day in range(1, (until - last).days + 1)]
+
+
+def reorganize_statement(days):
+    """Split `pmax` into one partition per day of `days`, ascending, and `pmax`."""
+    definitions = [
+        f"PARTITION {partition_name(day)} VALUES LESS THAN "
+        f"(UNIX_TIMESTAMP('{day + timedelta(days=1):%Y-%m-%d} 00:00:00'))"
+        for day in days
+    ]
+    definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return (
+        "ALTER TABLE store_pings REORGANIZE PARTITION pmax "
+        f"INTO ({', '.join(definitions)})"
+    )
+
+
+def ensure_partitions(until: date = None):
+    """Split `pmax` so there is one partition per UTC day up to `until`.
+
+    Does nothing on a table that is not partitioned by day.
+    """
+    until = until or datetime.utcnow().date() + timedelta(days=PARTITION_DAYS_AHEAD)
+    existing = day_partitions()
+    if not existing:
+        return []
+    created = days_after(existing[-1], until)
+    if created:
+        session.execute(text(reorganize_statement(created)))
+    return created
+
+
+def drop_partitions(before: date):
+    """Drop whole days of pings older than `before`, without scanning rows."""
+    expired = [day for day in day_partitions() if day < before]
+    if expired:
+        names = ", ".join(partition_name(day) for day in expired)
+        session.execute(text(f"ALTER TABLE store_pings DROP PARTITION {names}"))
+    return expired
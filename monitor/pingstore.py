@@ -0,0 +1,143 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from operator import attrgetter
+
+from .model import Status
+from .report import calculate_times
+from .queries import ping_query, range_start
+from .zones import local_time, window_table
+from .schedule import load_store_timings
+from .profiling import stage, timed
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+NAIVE_EPOCH = EPOCH.replace(tzinfo=None)
+MICROSECOND = timedelta(microseconds=1)
+STATUSES = {status.value: status for status in Status}
+
+
+def epoch_us(timestamp_utc: datetime):
+    # naive timestamps are UTC, as stored in store_pings
+    if timestamp_utc.tzinfo is None:
+        return (timestamp_utc - NAIVE_EPOCH) // MICROSECOND
+    return (timestamp_utc - EPOCH) // MICROSECOND
+
+
+class PingView:
+    """Read-only `LocalPing` look-alike for one row of a `PingArray`."""
+
+    __slots__ = ("pings", "index", "_local_time")
+
+    def __init__(self, pings, index):
+        self.pings = pings
+        self.index = index
+        self._local_time = None
+
+    @property
+    def status(self):
+        return STATUSES[self.pings.statuses[self.index]]
+
+    @property
+    def local_time(self):
+        if self._local_time is None:
+            self._local_time = self.pings.local_time(self.index)
+        return self._local_time
+
+    def __repr__(self):
+        return f"PingView(status={self.status}, local_time={self.local_time})"
+
+
+class PingArray:
+    """One store's pings as packed columns, 9 bytes per ping.
+
+    Holds UTC epoch microseconds in `array('q')` and status values in
+    `array('b')`. Indexing and iteration hand out `PingView` objects, so
+    `last_hour_status`, `cumulative_status` and `valid_ping` run on it
+    unchanged; like the rows they replace, pings are kept newest first and
+    their local times are naive wall clock times, as `zones.localize` gives.
+    """
+
+    __slots__ = ("timestamps", "statuses", "timezone", "table")
+
+    def __init__(self, timezone):
+        self.timestamps = array("q")
+        self.statuses = array("b")
+        self.timezone = timezone
+        self.table = None  # `ZoneTable` over the pings, built on first use
+
+    def append(self, status: Status, timestamp_utc: datetime):
+        self.timestamps.append(epoch_us(timestamp_utc))
+        self.statuses.append(status.value)
+        self.table = None
+
+    def local_time(self, index):
+        if self.table is None:
+            self.table = window_table(
+                self.timezone,
+                NAIVE_EPOCH + timedelta(microseconds=min(self.timestamps)),
+                NAIVE_EPOCH + timedelta(microseconds=max(self.timestamps)),
+            )
+        return self.table.to_local(
+            NAIVE_EPOCH + timedelta(microseconds=self.timestamps[index])
+        )
+
+    def extend(self, pings):
+        for ping in pings:
+            self.append(ping.status, ping.timestamp_utc)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.timestamps)
+        if not 0 <= index < len(self.timestamps):
+            raise IndexError("ping index out of range")
+        return PingView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.timestamps)):
+            yield PingView(self, index)
+
+    def nbytes(self):
+        itemsize = self.timestamps.itemsize + self.statuses.itemsize
+        return itemsize * len(self.timestamps)
+
+
+def array_store_report(pings: PingArray, timings, current_time):
+    return calculate_times(
+        pings=pings,
+        timings=timings,
+        current_time=local_time(current_time, pings.timezone),
+    )
+
+
+def bulk_array_report(timezones: dict, current_time, start=None) -> list:
+    store_ids = timezones.keys()
+    with stage("timings_query"):
+        store_timings = load_store_timings(store_ids)
+    if not store_timings:
+        return []
+    bulk_reports = []
+    for store_id, rows in groupby(
+        timed(
+            ping_query(
+                store_ids, since=range_start(current_time, start), until=current_time
+            ),
+            "ping_query",
+        ),
+        key=attrgetter("store_id"),
+    ):
+        pings = PingArray(timezones[store_id])
+        pings.extend(rows)
+        bulk_reports.append(
+            [
+                store_id,
+                *array_store_report(
+                    pings,
+                    timings=store_timings.get(store_id, {}),
+                    current_time=current_time,
+                ),
+            ]
+        )
+    return bulk_reports
@@ -0,0 +1,362 @@
+"""Stage timings of report runs.
+
+Code running inside `profiled()` adds the time spent in each `stage(name)`
+block, the rows of each chunk and every database round trip to the run's
+`Profile`, along with the time spent waiting for pooled connections. Outside
+of a run the stages cost a context variable lookup. Finished profiles are
+stored on the report (`Reports.profile`) and summed into Redis counters, which
+`/metrics` serves in the Prometheus text format next to the connection pool
+figures of the serving process.
+"""
+import contextvars
+import cProfile
+import json
+import os
+import random
+import resource
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+
+from .session import engine, redis_session, async_engine, async_redis, pool_waits
+from .constants import REDIS_REPORT_METRICS
+from .env import REPORT_PROFILE_DIR, REPORT_PROFILE_SAMPLE, REPORT_PROFILER
+
+router = APIRouter()
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+class Profile:
+    def __init__(self):
+        self.lock = threading.Lock()  # chunks may run in threads
+        self.stages = {}  # name -> [calls, seconds]
+        self.chunk_rows = []
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.max_query_seconds = 0.0
+        self.pool_waits = 0
+        self.pool_wait_seconds = 0.0
+        self.peak_rss_bytes = 0
+
+    def add(self, name, seconds):
+        with self.lock:
+            totals = self.stages.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def chunk(self, rows):
+        with self.lock:
+            self.chunk_rows.append(rows)
+
+    def query(self, seconds):
+        with self.lock:
+            self.queries += 1
+            self.query_seconds += seconds
+            self.max_query_seconds = max(self.max_query_seconds, seconds)
+
+    def pool_wait(self, seconds):
+        with self.lock:
+            self.pool_waits += 1
+            self.pool_wait_seconds += seconds
+
+    def merge(self, profile: dict):
+        with self.lock:
+            for name, stage_totals in profile["stages"].items():
+                totals = self.stages.setdefault(name, [0, 0.0])
+                totals[0] += stage_totals["calls"]
+                totals[1] += stage_totals["seconds"]
+            self.chunk_rows.extend(profile["chunk_rows"])
+            self.queries += profile["db"]["queries"]
+            self.query_seconds += profile["db"]["seconds"]
+            self.max_query_seconds = max(
+                self.max_query_seconds, profile["db"]["max_seconds"]
+            )
+            self.pool_waits += profile["db"]["pool_waits"]
+            self.pool_wait_seconds += profile["db"]["pool_wait_seconds"]
+            self.peak_rss_bytes = max(self.peak_rss_bytes, profile["peak_rss_bytes"])
+
+    def as_dict(self):
+        # ru_maxrss is in KiB on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return {
+            "stages": {
+                name: {"calls": calls, "seconds": round(seconds, 6)}
+                for name, (calls, seconds) in self.stages.items()
+            },
+            "chunk_rows": self.chunk_rows,
+            "db": {
+                "queries": self.queries,
+                "seconds": round(self.query_seconds, 6),
+                "max_seconds": round(self.max_query_seconds, 6),
+                "pool_waits": self.pool_waits,
+                "pool_wait_seconds": round(self.pool_wait_seconds, 6),
+            },
+            "peak_rss_bytes": max(self.peak_rss_bytes, peak_rss),
+        }
+
+
+class stage:
+    """Add the time spent in the block to the current profile's `name`."""
+
+    __slots__ = ("name", "profile", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profile = current_profile.get()
+        if self.profile is not None:
+            self.started = perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.add(self.name, perf_counter() - self.started)
+
+
+def timed(iterable, name):
+    """Yield from `iterable`, adding the time spent fetching items to `name`."""
+    if current_profile.get() is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def record_chunk(rows):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.chunk(len(rows))
+
+
+@contextmanager
+def profiled(name=None, profile=None):
+    """Collect a `Profile` for the block.
+
+    With `REPORT_PROFILE_SAMPLE` set, that fraction of blocks named `name` are
+    also run under `REPORT_PROFILER` (cprofile or pyinstrument) and dumped to
+    `REPORT_PROFILE_DIR`.
+    """
+    profile = profile or Profile()
+    token = current_profile.set(profile)
+    try:
+        if name and random.random() < REPORT_PROFILE_SAMPLE:
+            with profile_dump(name):
+                yield profile
+        else:
+            yield profile
+    finally:
+        current_profile.reset(token)
+
+
+@contextmanager
+def profile_dump(name):
+    os.makedirs(REPORT_PROFILE_DIR, exist_ok=True)
+    if REPORT_PROFILER == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(os.path.join(REPORT_PROFILE_DIR, f"{name}.html"), "w") as dump:
+                dump.write(profiler.output_html())
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(REPORT_PROFILE_DIR, f"{name}.prof"))
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def query_started(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info["query_started"] = perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def query_finished(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    started = conn.info.pop("query_started", None)
+    if profile is not None and started is not None:
+        profile.query(perf_counter() - started)
+
+
+@event.listens_for(engine, "checkout")
+def connection_checkout(dbapi_connection, connection_record, connection_proxy):
+    profile = current_profile.get()
+    seconds = connection_record.info.pop("checkout_wait", None)
+    if profile is not None and seconds is not None:
+        profile.pool_wait(seconds)
+
+
+def record_report(profile: dict, status, seconds):
+    """Add a finished run to the counters behind `/metrics`."""
+    with redis_session.pipeline(transaction=False) as pipe:
+        pipe.hincrby(REDIS_REPORT_METRICS, f"runs:{status}", 1)
+        pipe.hincrbyfloat(REDIS_REPORT_METRICS, "run_seconds", seconds)
+        for name, totals in profile["stages"].items():
+            pipe.hincrby(REDIS_REPORT_METRICS, f"stage_calls:{name}", totals["calls"])
+            pipe.hincrbyfloat(
+                REDIS_REPORT_METRICS, f"stage_seconds:{name}", totals["seconds"]
+            )
+        pipe.hincrby(REDIS_REPORT_METRICS, "chunks", len(profile["chunk_rows"]))
+        pipe.hincrby(REDIS_REPORT_METRICS, "rows", sum(profile["chunk_rows"]))
+        pipe.hincrby(REDIS_REPORT_METRICS, "db_queries", profile["db"]["queries"])
+        pipe.hincrbyfloat(REDIS_REPORT_METRICS, "db_seconds", profile["db"]["seconds"])
+        pipe.hincrbyfloat(
+            REDIS_REPORT_METRICS,
+            "db_pool_wait_seconds",
+            profile["db"]["pool_wait_seconds"],
+        )
+        pipe.hset(REDIS_REPORT_METRICS, "last_run_seconds", seconds)
+        pipe.hset(
+            REDIS_REPORT_METRICS, "last_peak_rss_bytes", profile["peak_rss_bytes"]
+        )
+        pipe.execute()
+
+
+def dump_profile(profile: dict):
+    return json.dumps(profile, separators=(",", ":"))
+
+
+METRICS = {
+    # hash field prefix: (metric name, type, help)
+    "runs": ("report_runs_total", "counter", "Report runs by final status."),
+    "run_seconds": (
+        "report_run_seconds_total",
+        "counter",
+        "Seconds spent in report runs.",
+    ),
+    "stage_calls": (
+        "report_stage_calls_total",
+        "counter",
+        "Times a report stage ran.",
+    ),
+    "stage_seconds": (
+        "report_stage_seconds_total",
+        "counter",
+        "Seconds spent per report stage.",
+    ),
+    "chunks": ("report_chunks_total", "counter", "Report chunks computed."),
+    "rows": ("report_rows_total", "counter", "Report rows computed."),
+    "db_queries": (
+        "report_db_queries_total",
+        "counter",
+        "Database round trips of report runs.",
+    ),
+    "db_seconds": (
+        "report_db_seconds_total",
+        "counter",
+        "Seconds spent in database round trips of report runs.",
+    ),
+    "db_pool_wait_seconds": (
+        "report_db_pool_wait_seconds_total",
+        "counter",
+        "Seconds report runs waited for a pooled database connection.",
+    ),
+    "last_run_seconds": (
+        "report_last_run_seconds",
+        "gauge",
+        "Duration of the last report run.",
+    ),
+    "last_peak_rss_bytes": (
+        "report_last_peak_rss_bytes",
+        "gauge",
+        "Peak resident memory of the last report run's processes.",
+    ),
+}
+LABELS = {"runs": "status", "stage_calls": "stage", "stage_seconds": "stage"}
+
+
+def render_metrics(fields: dict):
+    samples = {}
+    for field, value in sorted(fields.items()):
+        prefix, _, label = field.partition(":")
+        if prefix not in METRICS:
+            continue
+        name = METRICS[prefix][0]
+        if label:
+            name = f'{name}{{{LABELS[prefix]}="{label}"}}'
+        samples.setdefault(prefix, []).append(f"{name} {value}")
+    lines = []
+    for prefix, (name, kind, help_text) in METRICS.items():
+        if prefix in samples:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += samples[prefix]
+    return "\n".join(lines) + "\n"
+
+
+POOL_METRICS = [
+    # (metric name, type, help, value of (waits, pool))
+    (
+        "db_pool_checkouts_total",
+        "counter",
+        "Connections checked out of this process's pool.",
+        lambda waits, pool: waits.checkouts,
+    ),
+    (
+        "db_pool_checkout_wait_seconds_total",
+        "counter",
+        "Seconds this process waited to check out connections.",
+        lambda waits, pool: round(waits.seconds, 6),
+    ),
+    (
+        "db_pool_checkout_wait_max_seconds",
+        "gauge",
+        "Longest wait for a connection in this process.",
+        lambda waits, pool: round(waits.max_seconds, 6),
+    ),
+    (
+        "db_pool_checked_out",
+        "gauge",
+        "Connections of this process's pool in use.",
+        lambda waits, pool: pool.checkedout(),
+    ),
+    (
+        "db_pool_overflow",
+        "gauge",
+        "Connections open beyond the pool size, negative while below it.",
+        lambda waits, pool: pool.overflow(),
+    ),
+]
+
+
+def render_pool_metrics(pools: dict):
+    """Pool figures of `pools` ({label: pool}) that are sized queue pools."""
+    pools = {
+        label: pool for label, pool in pools.items() if hasattr(pool, "checkedout")
+    }
+    lines = []
+    for name, kind, help_text, value in POOL_METRICS:
+        if not pools:
+            break
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines += [
+            f'{name}{{pool="{label}"}} {value(pool_waits[label], pool)}'
+            for label, pool in pools.items()
+        ]
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+@router.get("/metrics")
+async def metrics():
+    fields = await async_redis.hgetall(REDIS_REPORT_METRICS)
+    return PlainTextResponse(
+        render_metrics(fields)
+        + render_pool_metrics({"sync": engine.pool, "async": async_engine.pool}),
+        media_type="text/plain; version=0.0.4",
+    )
@@ -0,0 +1,186 @@
+import time as clock
+from datetime import timedelta
+from itertools import groupby, islice
+from operator import attrgetter
+from types import MappingProxyType
+from uuid import uuid4
+
+from sqlalchemy import desc
+
+from .model import StorePings, StoreTimezones, StoreTimings
+from .session import db_session as session, redis_session
+from .constants import REDIS_TIMEZONES, REDIS_TIMEZONES_VERSION
+from .env import (
+    PING_STREAM_BATCH,
+    STORE_SNAPSHOT,
+    TIMEZONE_BATCH,
+    TIMEZONE_CACHE_TTL,
+)
+
+REPORT_SPAN = timedelta(days=7)
+
+
+def timezones_key(version):
+    return REDIS_TIMEZONES.format(version)
+
+
+def timezones_version():
+    return redis_session.get(REDIS_TIMEZONES_VERSION) or "0"
+
+
+def cache_timezones(version):
+    """Copy store_timezones into the Redis hash of `version` and return it.
+
+    The hash is filled under a temporary name in pipelined batches of
+    `TIMEZONE_BATCH` fields and renamed once complete, so readers never see
+    a partial map.
+    """
+    rows = session.query(StoreTimezones.store_id, StoreTimezones.timezone_str)
+    zone_map = {}
+    building = f"{timezones_key(version)}:building:{uuid4().hex}"
+    with redis_session.pipeline(transaction=False) as pipe:
+        batch = {}
+        for store_id, timezone in rows.yield_per(TIMEZONE_BATCH):
+            zone_map[store_id] = batch[store_id] = timezone
+            if len(batch) == TIMEZONE_BATCH:
+                pipe.hset(building, mapping=batch)
+                pipe.execute()
+                batch = {}
+        if batch:
+            pipe.hset(building, mapping=batch)
+            pipe.execute()
+    if zone_map:
+        redis_session.rename(building, timezones_key(version))
+        if timezones_version() != version:
+            # invalidated while filling, drop it like any old version
+            redis_session.expire(timezones_key(version), int(TIMEZONE_CACHE_TTL))
+    return zone_map
+
+
+def read_timezones(version):
+    return {
+        int(store_id): timezone
+        for store_id, timezone in redis_session.hscan_iter(
+            timezones_key(version), count=TIMEZONE_BATCH
+        )
+    }
+
+
+class TimezoneCache:
+    """Process wide snapshot of the store timezones, in front of Redis.
+
+    The snapshot is read again when `REDIS_TIMEZONES_VERSION` changes (see
+    `invalidate_timezones`) or after `ttl` seconds.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = None
+        self.loaded_at = 0.0
+        self.snapshot = MappingProxyType({})
+
+    def clear(self):
+        self.version = None
+
+    def get(self):
+        version = timezones_version()
+        expired = clock.monotonic() - self.loaded_at > self.ttl
+        if version != self.version or expired:
+            timezones = read_timezones(version) or cache_timezones(version)
+            self.snapshot = MappingProxyType(timezones)
+            self.version = version
+            self.loaded_at = clock.monotonic()
+        return self.snapshot
+
+
+timezone_cache = TimezoneCache(ttl=TIMEZONE_CACHE_TTL)
+
+
+def get_timezones():
+    """Read only {store_id: timezone} of every store."""
+    if STORE_SNAPSHOT:
+        from .snapshot import snapshot_timezones
+
+        timezones = snapshot_timezones()
+        if timezones is not None:
+            return timezones
+    return timezone_cache.get()
+
+
+def invalidate_timezones():
+    previous = timezones_key(timezones_version())
+    redis_session.incr(REDIS_TIMEZONES_VERSION)
+    # let reports already scanning the old hash finish
+    redis_session.expire(previous, int(TIMEZONE_CACHE_TTL))
+    timezone_cache.clear()
+
+
+def chunk_timezones(timezones, chunk_size=100):
+    if not chunk_size:
+        if timezones:
+            yield dict(timezones)
+        return
+    it = iter(timezones)
+    for idx in range(0, len(timezones), chunk_size):
+        yield {k: timezones[k] for k in islice(it, chunk_size)}
+
+
+def query_store_timings(store_ids):
+    return (
+        session.query(
+            StoreTimings.start_time_local,
+            StoreTimings.end_time_local,
+            StoreTimings.day,
+            StoreTimings.store_id,
+        )
+        .filter(StoreTimings.store_id.in_(store_ids))
+        .order_by(StoreTimings.store_id, StoreTimings.id)
+        .all()
+    )
+
+
+def timings_by_store(timings):
+    store_timings = {}
+    for timing in timings:
+        if not store_timings.get(timing.store_id):
+            store_timings[timing.store_id] = {}
+        store_timings[timing.store_id][timing.day] = (
+            timing.start_time_local,
+            timing.end_time_local,
+        )
+    return store_timings
+
+
+def range_start(current_time, start=None, span=REPORT_SPAN):
+    """First ping time a report as of `current_time` reads.
+
+    `start` can only narrow the `span` the report's columns cover, an earlier
+    one is ignored here and rejected by `/trigger_report`.
+    """
+    if start is None:
+        return current_time - span
+    return max(start, current_time - span)
+
+
+def ping_query(store_ids, since, until=None, batch_size=PING_STREAM_BATCH):
+    """Pings of `store_ids` in [since, until), by store and newest first."""
+    # yield_per streams rows off a server side cursor (SSCursor on PyMySQL), so
+    # no other statement may run on the session until the rows are consumed
+    query = (
+        session.query(StorePings.status, StorePings.timestamp_utc, StorePings.store_id)
+        .filter(StorePings.store_id.in_(store_ids))
+        .filter(StorePings.timestamp_utc >= since)
+    )
+    if until is not None:
+        query = query.filter(StorePings.timestamp_utc < until)
+    return query.order_by(
+        StorePings.store_id, desc(StorePings.timestamp_utc)
+    ).yield_per(batch_size)
+
+
+def stream_store_pings(store_ids, since, until=None, batch_size=PING_STREAM_BATCH):
+    for store_id, store_pings in groupby(
+        ping_query(store_ids, since=since, until=until, batch_size=batch_size),
+        key=attrgetter("store_id"),
+    ):
+        yield store_id, list(store_pings)
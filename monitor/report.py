@@ -0,0 +1,170 @@
+from datetime import datetime, timedelta, time, date
+from dataclasses import dataclass
+
+from .zones import local_time, localize
+from .profiling import stage
+
+
+@dataclass
+class StoreStatus:
+    active_hour: int
+    inactive_hour: int
+    active_day: int
+    inactive_day: int
+    active_week: int
+    inactive_week: int
+
+
+@dataclass(slots=True)
+class LocalPing:
+    status: str
+    local_time: datetime
+
+
+machine_user_text = {
+    "active_hour": "uptime_last_hour(in minutes)",
+    "inactive_hour": "downtime_last_hour(in minutes)",
+    "active_day": "uptime_last_day(in hours)",
+    "inactive_day": "downtime_last_day(in hours)",
+    "active_week": "uptime_last_week(in hours)",
+    "inactive_week": "downtime_last_week(in hours)",
+}
+
+
+def last_hour_status(pings: list[LocalPing], current_time, timings):
+    last_hour = {"active": timedelta(seconds=0), "inactive": timedelta(seconds=0)}
+    next_ping = current_time
+    for ping in pings:
+        if not valid_ping(ping, timings=timings):
+            continue
+        elif (current_time - ping.local_time) < timedelta(hours=1):
+            last_hour[ping.status.name] += next_ping - ping.local_time
+        else:
+            last_time = next_ping - current_time + timedelta(hours=1)
+            if last_time > timedelta(seconds=0):
+                last_hour[ping.status.name] += last_time
+            break
+        next_ping = ping.local_time
+    active_time = round(last_hour["active"].total_seconds() / 60, 2)
+    inactive_time = round(last_hour["inactive"].total_seconds() / 60, 2)
+    return active_time, inactive_time
+
+
+def valid_ping(ping, timings):
+    weekday = ping.local_time.weekday()
+    if timings.get(weekday):
+        temp_start_time = timings[weekday][0]
+        temp_end_time = timings[weekday][1]
+    else:
+        temp_start_time = time.min
+        temp_end_time = time.max
+    day_time = ping.local_time.time()
+    if day_time < temp_start_time or day_time > temp_end_time:
+        return False
+    return True
+
+
+def timediff(start_time, end_time):
+    diff = datetime.combine(date.min, end_time) - datetime.combine(date.min, start_time)
+    if diff < timedelta(seconds=0):
+        return timedelta(seconds=0)
+    return diff
+
+
+def close_timings(ping, timings):
+    weekday = ping.local_time.weekday()
+    if timings.get(weekday):
+        start_time = timings[weekday][0]
+    else:
+        start_time = time.min
+    yesterday = (weekday - 1) % 7
+    if timings.get(yesterday):
+        end_time = timings[yesterday][1]
+    else:
+        end_time = time.max
+    return start_time, end_time
+
+
+def working_hours_week(timings):
+    total_hours_week = timedelta(seconds=0)
+    for i in range(6):
+        if timings.get(i):
+            total_hours_week += timediff(*timings[i])
+        else:
+            total_hours_week += timedelta(days=1)
+    total_hours_week = total_hours_week.total_seconds() / (60 * 60)
+    return total_hours_week
+
+
+def working_hours_day(latest_ping: LocalPing, timings):
+    yesterday_end, today_start = close_timings(ping=latest_ping, timings=timings)
+    max_ping_day = latest_ping.local_time
+    working_hours = timediff(today_start, max_ping_day.time()) + timediff(
+        (max_ping_day - timedelta(days=1)).time(), yesterday_end
+    )
+    return working_hours.total_seconds() / (60 * 60)
+
+
+def ping_counts(pings: list[LocalPing], timings, current_time):
+    last_week_counts = {"active": 0, "inactive": 0}
+    last_day_counts = {"active": 0, "inactive": 0}
+    for ping in pings:
+        if not valid_ping(ping, timings=timings):
+            continue
+        if ping.local_time > current_time - timedelta(days=1):
+            last_day_counts[ping.status.name] += 1
+        last_week_counts[ping.status.name] += 1
+    return last_day_counts, last_week_counts
+
+
+def split_hours(counts, hours):
+    total = counts["active"] + counts["inactive"] + 1e-6
+    active = round(counts["active"] / total * hours, 2)
+    inactive = round(counts["inactive"] / total * hours, 2)
+    return active, inactive
+
+
+def cumulative_status(pings: list[LocalPing], timings, current_time):
+    last_day_counts, last_week_counts = ping_counts(
+        pings=pings, timings=timings, current_time=current_time
+    )
+    active_week, inactive_week = split_hours(
+        last_week_counts, working_hours_week(timings=timings)
+    )
+    active_day, inactive_day = split_hours(
+        last_day_counts, working_hours_day(latest_ping=pings[0], timings=timings)
+    )
+    return active_day, inactive_day, active_week, inactive_week
+
+
+def calculate_times(pings, timings, current_time):
+    with stage("last_hour"):
+        active_hour, inactive_hour = last_hour_status(
+            pings=pings, current_time=current_time, timings=timings
+        )
+    with stage("cumulative"):
+        active_day, inactive_day, active_week, inactive_week = cumulative_status(
+            pings=pings, timings=timings, current_time=current_time
+        )
+    return [
+        active_hour,
+        inactive_hour,
+        active_day,
+        inactive_day,
+        active_week,
+        inactive_week,
+    ]
+
+
+def store_report(pings, timings, timezone, current_time):
+    with stage("localize"):
+        local_times = localize([ping.timestamp_utc for ping in pings], timezone)
+        local_pings = [
+            LocalPing(status=ping.status, local_time=moment)
+            for ping, moment in zip(pings, local_times)
+        ]
+    return calculate_times(
+        pings=local_pings,
+        timings=timings,
+        current_time=local_time(current_time, timezone),
+    )
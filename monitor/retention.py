@@ -0,0 +1,490 @@
+"""Compaction of old pings: hourly summaries, archive files and batched deletes.
+
+Pings older than `RETENTION_DAYS` are compacted one UTC day at a time:
+1. the day's rows are written to an archive file under `RETENTION_ARCHIVE_DIR`
+   (`RETENTION_ARCHIVE_FORMAT`: ndjson.gz, ndjson.zst or parquet),
+2. their active/inactive counts are added to `store_ping_summaries` per store
+   and hour, in the transaction that records the file in `ping_archives`,
+3. the archived ids are deleted `RETENTION_DELETE_BATCH` rows per statement
+   and commit, or the day's partition is dropped on a partitioned table.
+
+Rows of a day that already has archives, left by an interrupted run or
+rehydrated for an audit, are deleted again without being counted twice.
+Pings arriving late for a compacted day go to a further archive of that day.
+
+    python -m monitor.retention compact [--every 3600]
+
+Each compact run also adds the partitions of the next days on a table
+partitioned by day (see `monitor.partitions`).
+    python -m monitor.retention rehydrate --from 2023-01-01 --to 2023-01-02 \\
+        [--output audit.ndjson]
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import time
+from array import array
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func, insert, select
+
+from .model import PingArchives, Status, StorePingSummaries, StorePings
+from .session import db_session as session
+from .partitions import day_partitions, drop_partitions, ensure_partitions
+from .rollup import floor_hour, prune_rollups
+from .sinks import LocalStorage
+from .env import (
+    PING_STREAM_BATCH,
+    REPORT_BACKFILL_DAYS,
+    RETENTION_ARCHIVE_DIR,
+    RETENTION_ARCHIVE_FORMAT,
+    RETENTION_DAYS,
+    RETENTION_DELETE_BATCH,
+    RETENTION_DELETE_PAUSE,
+)
+
+logger = logging.getLogger(__name__)
+ROW_GROUP_ROWS = 65536
+
+
+def ping_record(ping):
+    return {
+        "id": ping.id,
+        "store_id": ping.store_id,
+        "status": ping.status.name,
+        "timestamp_utc": ping.timestamp_utc.isoformat(),
+    }
+
+
+class NdjsonArchive:
+    extension = "ndjson.gz"
+
+    def __init__(self, fileobj):
+        self.stream = gzip.GzipFile(fileobj=fileobj, mode="wb")
+
+    def write(self, pings):
+        self.stream.write(
+            b"".join(json.dumps(ping_record(ping)).encode() + b"\n" for ping in pings)
+        )
+
+    def close(self):
+        self.stream.close()  # keeps fileobj open
+
+    @classmethod
+    def open(cls, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+
+    @classmethod
+    def read(cls, fileobj):
+        for line in cls.open(fileobj):
+            yield json.loads(line)
+
+
+class ZstdNdjsonArchive(NdjsonArchive):
+    extension = "ndjson.zst"
+
+    def __init__(self, fileobj):
+        self.stream = zstandard().ZstdCompressor().stream_writer(fileobj, closefd=False)
+
+    @classmethod
+    def open(cls, fileobj):
+        return io.BufferedReader(zstandard().ZstdDecompressor().stream_reader(fileobj))
+
+
+def zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(
+            "RETENTION_ARCHIVE_FORMAT=ndjson.zst needs zstandard installed"
+        )
+    return zstandard
+
+
+class ParquetArchive:
+    extension = "parquet"
+
+    def __init__(self, fileobj):
+        self.pyarrow = parquet_module()
+        self.schema = self.pyarrow.schema(
+            [
+                ("id", self.pyarrow.int64()),
+                ("store_id", self.pyarrow.int64()),
+                ("status", self.pyarrow.string()),
+                ("timestamp_utc", self.pyarrow.timestamp("us")),
+            ]
+        )
+        self.writer = self.pyarrow.parquet.ParquetWriter(fileobj, self.schema)
+        self.rows = []
+
+    def write(self, pings):
+        self.rows.extend(
+            (ping.id, ping.store_id, ping.status.name, ping.timestamp_utc)
+            for ping in pings
+        )
+        if len(self.rows) >= ROW_GROUP_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        self.writer.write_table(
+            self.pyarrow.Table.from_arrays(
+                [self.pyarrow.array(column) for column in columns], schema=self.schema
+            )
+        )
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    @classmethod
+    def read(cls, fileobj):
+        for batch in parquet_module().parquet.ParquetFile(fileobj).iter_batches():
+            for row in batch.to_pylist():
+                yield {**row, "timestamp_utc": row["timestamp_utc"].isoformat()}
+
+
+def parquet_module():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("RETENTION_ARCHIVE_FORMAT=parquet needs pyarrow installed")
+    return pyarrow
+
+
+ARCHIVE_FORMATS = {
+    archive.extension: archive
+    for archive in (NdjsonArchive, ZstdNdjsonArchive, ParquetArchive)
+}
+
+
+def format_for(location):
+    for extension, archive in ARCHIVE_FORMATS.items():
+        if location.endswith(f".{extension}"):
+            return archive
+    raise ValueError(f"Unknown archive format: {location}")
+
+
+def read_archive(location):
+    """Rows of an archive file as dicts of ping_record's fields."""
+    with open(location, "rb") as fileobj:
+        yield from format_for(location).read(fileobj)
+
+
+def day_pings(day: date):
+    start = datetime.combine(day, datetime.min.time())
+    return (
+        session.query(
+            StorePings.id,
+            StorePings.store_id,
+            StorePings.status,
+            StorePings.timestamp_utc,
+        )
+        .filter(StorePings.timestamp_utc >= start)
+        .filter(StorePings.timestamp_utc < start + timedelta(days=1))
+    )
+
+
+def delete_ids(ids, batch=RETENTION_DELETE_BATCH, pause=RETENTION_DELETE_PAUSE):
+    """Delete pings by id, one short transaction per `batch` ids."""
+    deleted = 0
+    for start in range(0, len(ids), batch):
+        result = session.execute(
+            StorePings.__table__.delete().where(
+                StorePings.id.in_(ids[start : start + batch].tolist())
+            )
+        )
+        session.commit()
+        deleted += result.rowcount
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def archived_ids(archive: PingArchives):
+    return array("q", (row["id"] for row in read_archive(archive.location)))
+
+
+def clear_archived(day: date):
+    """Delete rows of `day` that its archives already hold, returns the count."""
+    deleted = 0
+    for archive in session.query(PingArchives).filter(PingArchives.day == day):
+        left = session.scalar(
+            day_pings(day)
+            .filter(StorePings.id.between(archive.first_id, archive.last_id))
+            .with_entities(func.count())
+            .statement
+        )
+        if left:
+            deleted += delete_ids(archived_ids(archive))
+    return deleted
+
+
+def upsert_summaries(counts):
+    if not counts:
+        return
+    rows = [
+        {
+            "store_id": store_id,
+            "hour_utc": hour_utc,
+            "active_count": active,
+            "inactive_count": inactive,
+        }
+        for (store_id, hour_utc), (active, inactive) in counts.items()
+    ]
+    columns = ("active_count", "inactive_count")
+    if session.get_bind().dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as upsert
+
+        statement = upsert(StorePingSummaries).values(rows)
+        statement = statement.on_duplicate_key_update(
+            {
+                column: getattr(StorePingSummaries, column)
+                + getattr(statement.inserted, column)
+                for column in columns
+            }
+        )
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+
+        statement = upsert(StorePingSummaries).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["store_id", "hour_utc"],
+            set_={
+                column: getattr(StorePingSummaries, column)
+                + getattr(statement.excluded, column)
+                for column in columns
+            },
+        )
+    session.execute(statement)
+
+
+def archive_day(day: date, archive_format=RETENTION_ARCHIVE_FORMAT):
+    """Archive and summarize the rows of `day` no archive holds yet.
+
+    Returns the ids written, to be deleted once the archive is recorded.
+    """
+    archive = ARCHIVE_FORMATS[archive_format]
+    storage = LocalStorage(os.path.join(RETENTION_ARCHIVE_DIR, f"{day:%Y/%m}"))
+    ids = array("q")
+    counts = {}
+    location = storage.location(f"store_pings_{day:%Y%m%d}_{time.time_ns()}")
+    location = f"{location}.{archive.extension}"
+    with storage.writer(location) as fileobj:
+        writer = archive(fileobj)
+        # streamed like ping_query, nothing else runs on the session meanwhile
+        pings = session.execute(
+            day_pings(day).order_by(StorePings.id).statement,
+            execution_options={"yield_per": PING_STREAM_BATCH},
+        )
+        for partition in pings.partitions():
+            writer.write(partition)
+            for ping in partition:
+                ids.append(ping.id)
+                hour = counts.setdefault(
+                    (ping.store_id, floor_hour(ping.timestamp_utc)), [0, 0]
+                )
+                hour[ping.status is not Status.active] += 1
+        writer.close()
+    if not ids:
+        os.remove(location)
+        return ids
+    try:
+        session.add(
+            PingArchives(
+                day=day,
+                location=location,
+                ping_count=len(ids),
+                first_id=ids[0],
+                last_id=ids[-1],
+            )
+        )
+        upsert_summaries(counts)
+        session.commit()
+    except Exception:
+        session.rollback()
+        os.remove(location)
+        raise
+    return ids
+
+
+def partitioned(day: date):
+    """Whether `day` has its own partition of a partitioned `store_pings`."""
+    return session.get_bind().dialect.name == "mysql" and day in day_partitions()
+
+
+def compact_day(day: date):
+    deleted = clear_archived(day)
+    ids = archive_day(day)
+    if partitioned(day):
+        # days before it were compacted already, their partitions are empty
+        deleted += len(ids)
+        drop_partitions(before=day + timedelta(days=1))
+    else:
+        deleted += delete_ids(ids)
+    logger.info("Compacted %s: %s archived, %s deleted", day, len(ids), deleted)
+    return len(ids)
+
+
+def compact(before: date = None):
+    """Compact every day of pings before `before` (`RETENTION_DAYS` ago)."""
+    before = before or datetime.utcnow().date() - timedelta(days=RETENTION_DAYS)
+    horizon = datetime.combine(before, datetime.min.time())
+    archived = 0
+    while True:
+        oldest = session.scalar(
+            select(func.min(StorePings.timestamp_utc)).where(
+                StorePings.timestamp_utc < horizon
+            )
+        )
+        if oldest is None:
+            break
+        archived += compact_day(oldest.date())
+    prune_rollups(horizon)
+    return archived
+
+
+def archives_between(start: datetime, end: datetime):
+    return (
+        session.query(PingArchives)
+        .filter(PingArchives.day >= start.date(), PingArchives.day <= end.date())
+        .order_by(PingArchives.day, PingArchives.first_id)
+        .all()
+    )
+
+
+def compacted_days(start: datetime, end: datetime):
+    """Query of the days in [start, end) whose archived pings are not restored.
+
+    A day counts as restored while the first and last ids of its archives are
+    back in `store_pings`, as `rehydrate` puts them.
+    """
+
+    def restored(ping_id):
+        return select(StorePings.id).where(StorePings.id == ping_id).exists()
+
+    last_day = (end - timedelta(microseconds=1)).date()
+    return (
+        select(PingArchives.day)
+        .where(PingArchives.day >= start.date(), PingArchives.day <= last_day)
+        .where(~and_(restored(PingArchives.first_id), restored(PingArchives.last_id)))
+        .distinct()
+        .order_by(PingArchives.day)
+    )
+
+
+def compacted_detail(days):
+    listed = ", ".join(day.isoformat() for day in days[:3])
+    more = f" and {len(days) - 3} more" if len(days) > 3 else ""
+    return (
+        f"Pings of {listed}{more} were compacted, rehydrate them first"
+        " (python -m monitor.retention rehydrate)."
+    )
+
+
+def archived_pings(start: datetime, end: datetime):
+    """Archived rows with `timestamp_utc` in [start, end), as dicts."""
+    for archive in archives_between(start, end):
+        for row in read_archive(archive.location):
+            if start <= datetime.fromisoformat(row["timestamp_utc"]) < end:
+                yield row
+
+
+def rehydrate(start: datetime, end: datetime, batch=RETENTION_DELETE_BATCH):
+    """Insert archived pings in [start, end) back into `store_pings`.
+
+    Rows keep their ids, so rows still present are skipped and the next
+    compaction deletes them again without counting them twice.
+    """
+    inserted = 0
+    rows = []
+    for row in archived_pings(start, end):
+        rows.append(row)
+        if len(rows) >= batch:
+            inserted += insert_missing(rows)
+            rows = []
+    if rows:
+        inserted += insert_missing(rows)
+    return inserted
+
+
+def insert_missing(rows):
+    present = set(
+        session.scalars(
+            select(StorePings.id).where(StorePings.id.in_([row["id"] for row in rows]))
+        )
+    )
+    missing = [
+        {
+            **row,
+            "status": Status[row["status"]],
+            "timestamp_utc": datetime.fromisoformat(row["timestamp_utc"]),
+        }
+        for row in rows
+        if row["id"] not in present
+    ]
+    if missing:
+        session.execute(insert(StorePings), missing)
+    session.commit()
+    return len(missing)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact_parser = commands.add_parser("compact", help="compact old pings")
+    compact_parser.add_argument("--before", type=date.fromisoformat)
+    compact_parser.add_argument(
+        "--every", type=float, help="seconds between runs, runs once without"
+    )
+    rehydrate_parser = commands.add_parser("rehydrate", help="restore archived pings")
+    rehydrate_parser.add_argument(
+        "--from", dest="start", type=datetime.fromisoformat, required=True
+    )
+    rehydrate_parser.add_argument(
+        "--to", dest="end", type=datetime.fromisoformat, required=True
+    )
+    rehydrate_parser.add_argument(
+        "--output", help="write NDJSON here instead of inserting into store_pings"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s"
+    )
+    if args.command == "rehydrate":
+        if args.output:
+            with open(args.output, "w") as output:
+                for row in archived_pings(args.start, args.end):
+                    output.write(json.dumps(row) + "\n")
+        else:
+            print(f"{rehydrate(args.start, args.end)} pings restored")
+        return
+    if RETENTION_DAYS < REPORT_BACKFILL_DAYS:
+        logger.warning(
+            "RETENTION_DAYS=%s is below REPORT_BACKFILL_DAYS=%s, backfills reaching"
+            " compacted days are rejected until their pings are rehydrated",
+            RETENTION_DAYS,
+            REPORT_BACKFILL_DAYS,
+        )
+    while True:
+        if session.get_bind().dialect.name == "mysql":
+            # days ahead get their partition before pings land in pmax
+            created = ensure_partitions()
+            if created:
+                logger.info("Partitions added through %s", created[-1])
+        logger.info("%s pings archived", compact(args.before))
+        if not args.every:
+            return
+        session.remove()
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
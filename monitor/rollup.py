@@ -0,0 +1,385 @@
+import json
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import attrgetter
+
+from sqlalchemy import case, desc, func, or_
+from sqlalchemy.dialects.mysql import insert
+
+from .model import (
+    RollupCheckpoints,
+    Status,
+    StoreHourlyRollups,
+    StorePings,
+    StoreRollupTails,
+)
+from .session import db_session as session
+from .report import (
+    LocalPing,
+    last_hour_status,
+    split_hours,
+    valid_ping,
+    working_hours_day,
+    working_hours_week,
+)
+from .queries import chunk_timezones, get_timezones, range_start
+from .schedule import load_store_timings
+from .zones import local_time, localize
+from .profiling import stage
+from .env import PING_STREAM_BATCH, ROLLUP_GAP_SECONDS
+
+CHECKPOINT_NAME = "store_pings"
+RAW_LOOKBACK = timedelta(days=1)  # raw history read before the last hour
+
+
+def floor_hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def lock_checkpoint():
+    """The checkpoint row, locked until the transaction ends.
+
+    The upsert creates the row on the first run and takes its exclusive lock
+    either way, so concurrent runs wait here instead of both adding the same
+    pings; the locking read then sees the checkpoint the last run committed.
+    """
+    statement = insert(RollupCheckpoints).values(name=CHECKPOINT_NAME, last_ping_id=0)
+    session.execute(statement.on_duplicate_key_update(name=statement.inserted.name))
+    return session.get(
+        RollupCheckpoints, CHECKPOINT_NAME, with_for_update=True, populate_existing=True
+    )
+
+
+def id_filter(ranges):
+    return or_(*(StorePings.id.between(first, last) for first, last in ranges))
+
+
+def missing_ranges(first, last):
+    """Ranges of ids in [first, last] without a visible ping."""
+    missing = []
+    expected = first
+    ids = (
+        session.query(StorePings.id)
+        .filter(StorePings.id.between(first, last))
+        .order_by(StorePings.id)
+        .yield_per(PING_STREAM_BATCH)
+    )
+    for (ping_id,) in ids:
+        if ping_id > expected:
+            missing.append((expected, ping_id - 1))
+        expected = ping_id + 1
+    if expected <= last:
+        missing.append((expected, last))
+    return missing
+
+
+def empty_bucket():
+    return {"active_count": 0, "inactive_count": 0}
+
+
+def rollup_store(store_id, pings, tail, timezone, timings, buckets):
+    """Count one store's new valid pings into hourly buckets.
+
+    The tail keeps the newest ping time seen, which reports use as the store's
+    latest ping.
+    """
+    local_times = localize([ping.timestamp_utc for ping in pings], timezone)
+    for ping, moment in zip(pings, local_times):
+        if tail.last_ping_utc is None or ping.timestamp_utc > tail.last_ping_utc:
+            tail.last_ping_utc = ping.timestamp_utc
+        local_ping = LocalPing(status=ping.status, local_time=moment)
+        if not valid_ping(local_ping, timings=timings):
+            continue
+        bucket = buckets.setdefault(
+            (store_id, floor_hour(ping.timestamp_utc)), empty_bucket()
+        )
+        bucket[f"{ping.status.name}_count"] += 1
+
+
+def upsert_buckets(buckets):
+    if not buckets:
+        return
+    statement = insert(StoreHourlyRollups).values(
+        [
+            {"store_id": store_id, "hour_utc": hour_utc, **bucket}
+            for (store_id, hour_utc), bucket in buckets.items()
+        ]
+    )
+    statement = statement.on_duplicate_key_update(
+        {
+            column: getattr(StoreHourlyRollups, column)
+            + getattr(statement.inserted, column)
+            for column in empty_bucket()
+        }
+    )
+    session.execute(statement)
+
+
+def rollup_chunk(timezones: dict, ranges):
+    store_ids = timezones.keys()
+    store_timings = load_store_timings(store_ids)
+    tails = {
+        tail.store_id: tail
+        for tail in session.query(StoreRollupTails).filter(
+            StoreRollupTails.store_id.in_(store_ids)
+        )
+    }
+    pings = (
+        session.query(StorePings.status, StorePings.timestamp_utc, StorePings.store_id)
+        .filter(StorePings.store_id.in_(store_ids))
+        .filter(id_filter(ranges))
+        .order_by(StorePings.store_id, StorePings.timestamp_utc)
+        .yield_per(PING_STREAM_BATCH)
+    )
+    buckets = {}
+    processed = 0
+    for store_id, store_pings in groupby(pings, key=attrgetter("store_id")):
+        if store_id not in tails:
+            tails[store_id] = StoreRollupTails(store_id=store_id)
+            session.add(tails[store_id])
+        store_pings = list(store_pings)
+        processed += len(store_pings)
+        rollup_store(
+            store_id,
+            store_pings,
+            tail=tails[store_id],
+            timezone=timezones[store_id],
+            timings=store_timings.get(store_id, {}),
+            buckets=buckets,
+        )
+    upsert_buckets(buckets)
+    return processed
+
+
+def update_rollups(chunk_size=100):
+    """Roll every ping above the checkpoint into `store_hourly_rollups`.
+
+    The checkpoint row stays locked for the run, and all chunks and the new
+    checkpoint are committed together, so a failed run leaves the rollups
+    untouched and concurrent runs never add the same pings twice.
+
+    Auto-increment ids are handed out before their insert commits, so ids
+    missing below the newest one may still show up. Each such gap is kept on
+    the checkpoint with the time it was first seen and read again by the runs
+    of the next `ROLLUP_GAP_SECONDS`.
+    """
+    try:
+        checkpoint = lock_checkpoint()
+        now = datetime.utcnow()
+        horizon = now - timedelta(seconds=ROLLUP_GAP_SECONDS)
+        gaps = [
+            (first, last, seen)
+            for first, last, seen in json.loads(checkpoint.gaps or "[]")
+            if datetime.fromisoformat(seen) > horizon
+        ]
+        max_ping_id = session.query(func.max(StorePings.id)).scalar() or 0
+        if max_ping_id > checkpoint.last_ping_id:
+            gaps.append((checkpoint.last_ping_id + 1, max_ping_id, now.isoformat()))
+        elif not gaps:
+            session.rollback()
+            return 0
+        ranges = [(first, last) for first, last, _ in gaps]
+        processed = 0
+        for chunked_zones in chunk_timezones(
+            timezones=get_timezones(), chunk_size=chunk_size
+        ):
+            processed += rollup_chunk(chunked_zones, ranges)
+        checkpoint.gaps = json.dumps(
+            [
+                (missing_first, missing_last, seen)
+                for first, last, seen in gaps
+                for missing_first, missing_last in missing_ranges(first, last)
+            ]
+        )
+        checkpoint.last_ping_id = max(checkpoint.last_ping_id, max_ping_id)
+        checkpoint.updated_at = now
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return processed
+
+
+def prune_rollups(before):
+    session.query(StoreHourlyRollups).filter(
+        StoreHourlyRollups.hour_utc < before
+    ).delete(synchronize_session=False)
+    session.commit()
+
+
+def raw_pings(store_ids, since, until):
+    query = (
+        session.query(StorePings.status, StorePings.timestamp_utc, StorePings.store_id)
+        .filter(StorePings.store_id.in_(store_ids))
+        .filter(StorePings.timestamp_utc >= since)
+        .filter(StorePings.timestamp_utc < until)
+    )
+    with stage("ping_query"):
+        pings = query.order_by(
+            StorePings.store_id, desc(StorePings.timestamp_utc)
+        ).all()
+    return {
+        store_id: list(rows)
+        for store_id, rows in groupby(pings, key=attrgetter("store_id"))
+    }
+
+
+def latest_pings_before(store_ids, since, until):
+    """{store_id: newest ping time in [since, until)} of the stores with one."""
+    return dict(
+        session.query(StorePings.store_id, func.max(StorePings.timestamp_utc))
+        .filter(StorePings.store_id.in_(store_ids))
+        .filter(StorePings.timestamp_utc >= since)
+        .filter(StorePings.timestamp_utc < until)
+        .group_by(StorePings.store_id)
+        .all()
+    )
+
+
+def has_carry_over(pings, timezone, timings, current_time):
+    for ping in reversed(pings):
+        if current_time - ping.timestamp_utc < timedelta(hours=1):
+            return False
+        local_ping = LocalPing(
+            status=ping.status, local_time=local_time(ping.timestamp_utc, timezone)
+        )
+        if valid_ping(local_ping, timings=timings):
+            return True
+    return False
+
+
+def bulk_rollup_report(timezones: dict, current_time, start=None) -> list:
+    """Same rows as `bulk_store_report`, built from the hourly rollups.
+
+    Whole hours inside the week are summed in SQL, so the week and day windows
+    start on the first full hour after `current_time - 7d` / `- 1d`. Raw pings
+    are read only for the still open hour and for `last_hour_status`, which
+    also needs the last valid ping before the hour; stores without one inside
+    `RAW_LOOKBACK` get a second, narrower query over the rest of the week.
+    """
+    store_ids = timezones.keys()
+    hour_start = floor_hour(current_time)
+    day_start = current_time - timedelta(days=1)
+    week_start = range_start(current_time, start)
+    raw_start = max(current_time - timedelta(hours=1) - RAW_LOOKBACK, week_start)
+    day_filter = StoreHourlyRollups.hour_utc >= day_start
+    query = (
+        session.query(
+            StoreHourlyRollups.store_id,
+            func.sum(
+                case((day_filter, StoreHourlyRollups.active_count), else_=0)
+            ).label("active_day"),
+            func.sum(
+                case((day_filter, StoreHourlyRollups.inactive_count), else_=0)
+            ).label("inactive_day"),
+            func.sum(StoreHourlyRollups.active_count).label("active_week"),
+            func.sum(StoreHourlyRollups.inactive_count).label("inactive_week"),
+        )
+        .filter(StoreHourlyRollups.store_id.in_(store_ids))
+        .filter(StoreHourlyRollups.hour_utc >= week_start)
+        .filter(StoreHourlyRollups.hour_utc < hour_start)
+        .group_by(StoreHourlyRollups.store_id)
+    )
+    with stage("rollup_query"):
+        sums = query.all()
+    store_pings = raw_pings(store_ids, since=raw_start, until=current_time)
+    if not sums and not store_pings:
+        return []
+    with stage("timings_query"):
+        store_timings = load_store_timings(store_ids)
+    if not store_timings:
+        return []
+    store_sums = {row.store_id: row for row in sums}
+    report_store_ids = sorted(store_sums.keys() | store_pings.keys())
+    missing = [
+        store_id
+        for store_id in report_store_ids
+        if not has_carry_over(
+            store_pings.get(store_id, []),
+            timezone=timezones[store_id],
+            timings=store_timings.get(store_id, {}),
+            current_time=current_time,
+        )
+    ]
+    if missing:
+        older_pings = raw_pings(missing, since=week_start, until=raw_start)
+        for store_id, pings in older_pings.items():
+            store_pings.setdefault(store_id, []).extend(pings)
+    latest_pings = dict(
+        session.query(StoreRollupTails.store_id, StoreRollupTails.last_ping_utc)
+        .filter(StoreRollupTails.store_id.in_(store_ids))
+        .all()
+    )
+    # tails track the newest ping overall, look up reports as of an earlier time
+    later = [
+        store_id for store_id, latest in latest_pings.items() if latest >= current_time
+    ]
+    if later:
+        for store_id in later:
+            del latest_pings[store_id]
+        latest_pings.update(
+            latest_pings_before(later, since=week_start, until=current_time)
+        )
+    bulk_reports = []
+    for store_id in report_store_ids:
+        timezone = timezones[store_id]
+        timings = store_timings.get(store_id, {})
+        local_now = local_time(current_time, timezone)
+        row = store_sums.get(store_id)
+        last_day_counts = {
+            "active": int(row.active_day) if row else 0,
+            "inactive": int(row.inactive_day) if row else 0,
+        }
+        last_week_counts = {
+            "active": int(row.active_week) if row else 0,
+            "inactive": int(row.inactive_week) if row else 0,
+        }
+        pings = store_pings.get(store_id, [])
+        with stage("localize"):
+            local_pings = [
+                LocalPing(status=ping.status, local_time=moment)
+                for ping, moment in zip(
+                    pings,
+                    localize([ping.timestamp_utc for ping in pings], timezone),
+                )
+            ]
+        for ping, local_ping in zip(pings, local_pings):
+            if ping.timestamp_utc < hour_start:
+                break
+            if not valid_ping(local_ping, timings=timings):
+                continue
+            if local_ping.local_time > local_now - timedelta(days=1):
+                last_day_counts[ping.status.name] += 1
+            last_week_counts[ping.status.name] += 1
+        latest_ping_utc = latest_pings.get(store_id)
+        if pings and (
+            latest_ping_utc is None or pings[0].timestamp_utc > latest_ping_utc
+        ):
+            latest_ping_utc = pings[0].timestamp_utc
+        if latest_ping_utc is None:
+            continue
+        latest_ping = LocalPing(
+            status=Status.active, local_time=local_time(latest_ping_utc, timezone)
+        )
+        with stage("last_hour"):
+            active_hour, inactive_hour = last_hour_status(
+                pings=local_pings, current_time=local_now, timings=timings
+            )
+        active_day, inactive_day = split_hours(
+            last_day_counts, working_hours_day(latest_ping=latest_ping, timings=timings)
+        )
+        active_week, inactive_week = split_hours(
+            last_week_counts, working_hours_week(timings=timings)
+        )
+        bulk_reports.append(
+            [
+                store_id,
+                active_hour,
+                inactive_hour,
+                active_day,
+                inactive_day,
+                active_week,
+                inactive_week,
+            ]
+        )
+    return bulk_reports
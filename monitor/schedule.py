@@ -0,0 +1,270 @@
+import math
+import threading
+import time as clock
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import datetime, time
+
+from .session import redis_session
+from .queries import query_store_timings, timings_by_store
+from .constants import REDIS_TIMINGS_VERSION
+from .env import SCHEDULE_CACHE_TTL, STORE_SNAPSHOT
+
+DAY_SECONDS = 24 * 60 * 60
+WEEK_SECONDS = 7 * DAY_SECONDS
+MONDAY = datetime(1970, 1, 5)  # wall clock origin, a Monday
+
+
+def time_seconds(day_time: time):
+    return (
+        day_time.hour * 3600
+        + day_time.minute * 60
+        + day_time.second
+        + day_time.microsecond / 1e6
+    )
+
+
+def wall_seconds(local_time: datetime):
+    """Wall clock seconds of a local datetime since `MONDAY`, DST ignored."""
+    return (local_time.replace(tzinfo=None) - MONDAY).total_seconds()
+
+
+@dataclass(frozen=True, slots=True)
+class Schedule:
+    """A store's weekly business hours as sorted, disjoint [open, close] offsets.
+
+    Offsets are seconds from Monday 00:00 local time. `prefix[i]` holds the
+    open seconds before `opens[i]`, so open time between any two instants is
+    two bisects away.
+    """
+
+    opens: tuple
+    closes: tuple
+    prefix: tuple
+
+    @classmethod
+    def from_intervals(cls, intervals):
+        merged = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        prefix, total = [], 0
+        for start, end in merged:
+            prefix.append(total)
+            total += end - start
+        return cls(
+            opens=tuple(start for start, _ in merged),
+            closes=tuple(end for _, end in merged),
+            prefix=tuple(prefix + [total]),
+        )
+
+    @property
+    def weekly_seconds(self):
+        return self.prefix[-1]
+
+    def is_open_at(self, offset):
+        offset %= WEEK_SECONDS
+        index = bisect_right(self.opens, offset) - 1
+        return index >= 0 and offset <= self.closes[index]
+
+    def is_open(self, local_time: datetime):
+        return self.is_open_at(wall_seconds(local_time))
+
+    def open_before(self, offset):
+        """Open seconds in the week before `offset` (0 <= offset <= week)."""
+        index = bisect_right(self.opens, offset) - 1
+        if index < 0:
+            return 0
+        return self.prefix[index] + min(offset, self.closes[index]) - self.opens[index]
+
+    def open_seconds_between(self, start, end):
+        """Open seconds between start and end, wall clock seconds since `MONDAY`."""
+        if end <= start:
+            return 0
+
+        def cumulative(offset):
+            weeks, remainder = divmod(offset, WEEK_SECONDS)
+            return weeks * self.weekly_seconds + self.open_before(remainder)
+
+        return cumulative(end) - cumulative(start)
+
+    def open_seconds(self, start: datetime, end: datetime):
+        return self.open_seconds_between(wall_seconds(start), wall_seconds(end))
+
+    def open_after(self, start, seconds):
+        """Wall clock offset once `seconds` of open time passed since `start`.
+
+        Infinite for a schedule that never opens.
+        """
+        if not self.weekly_seconds:
+            return math.inf
+        weeks, remainder = divmod(start, WEEK_SECONDS)
+        target = self.open_before(remainder) + seconds
+        extra, target = divmod(target, self.weekly_seconds)
+        if not target and extra:
+            extra, target = extra - 1, self.weekly_seconds  # a week's last close
+        index = min(bisect_left(self.prefix, target), len(self.opens)) - 1
+        index = max(index, 0)
+        return (
+            (weeks + extra) * WEEK_SECONDS
+            + self.opens[index]
+            + target
+            - self.prefix[index]
+        )
+
+
+def compile_schedule(timings):
+    """Compile (day, start_time_local, end_time_local) rows into a `Schedule`.
+
+    A day may have several rows. An end before the start is an overnight
+    shift closing the next day, wrapping from Sunday into Monday. Both ends are
+    inclusive like in `valid_ping`, and days without rows are open all day.
+    """
+    intervals = []
+    days = set()
+    for day, start_time, end_time in timings:
+        days.add(day)
+        start = day * DAY_SECONDS + time_seconds(start_time)
+        end = day * DAY_SECONDS + time_seconds(end_time)
+        if end_time < start_time:
+            end += DAY_SECONDS
+        if end > WEEK_SECONDS:
+            intervals.append((start, WEEK_SECONDS))
+            intervals.append((0, end - WEEK_SECONDS))
+        else:
+            intervals.append((start, end))
+    for day in set(range(7)) - days:
+        intervals.append((day * DAY_SECONDS, (day + 1) * DAY_SECONDS))
+    return Schedule.from_intervals(intervals)
+
+
+class ScheduleCache:
+    """Process wide cache of store timings and compiled schedules.
+
+    Entries are dropped when `REDIS_TIMINGS_VERSION` changes (see
+    `invalidate_schedules`) or after `ttl` seconds, whichever comes first.
+    Report threads share it, so entries change under `lock`; timings are
+    queried outside it and only kept when no clear happened meanwhile.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.generation = 0  # bumped by every clear
+        self.version = None
+        self.loaded_at = 0.0
+        self.rows = {}
+        self.timings = {}
+        self.schedules = {}
+
+    def reset(self):
+        self.generation += 1
+        self.rows.clear()
+        self.timings.clear()
+        self.schedules.clear()
+
+    def clear(self):
+        with self.lock:
+            self.reset()
+
+    def refresh(self):
+        version = redis_session.get(REDIS_TIMINGS_VERSION)
+        with self.lock:
+            expired = clock.monotonic() - self.loaded_at > self.ttl
+            if version != self.version or expired:
+                self.reset()
+                self.version = version
+                self.loaded_at = clock.monotonic()
+
+    def load(self, store_ids):
+        """({store_id: timing rows}, generation they belong to)."""
+        self.refresh()
+        store_ids = [int(store_id) for store_id in store_ids]
+        with self.lock:
+            generation = self.generation
+            found = {
+                store_id: self.rows[store_id]
+                for store_id in store_ids
+                if store_id in self.rows
+            }
+        missing = [store_id for store_id in store_ids if store_id not in found]
+        if missing:
+            loaded = {store_id: [] for store_id in missing}
+            for timing in query_store_timings(missing):
+                loaded[timing.store_id].append(timing)
+            with self.lock:
+                if self.generation == generation:
+                    self.rows.update(loaded)
+            found.update(loaded)
+        return found, generation
+
+    def derived(self, cache, store_ids, build):
+        """`build(rows)` of each store, kept in `cache` while rows are current."""
+        rows, generation = self.load(store_ids)
+        values = {}
+        with self.lock:
+            current = self.generation == generation
+            for store_id, store_rows in rows.items():
+                value = cache.get(store_id) if current else None
+                if value is None:
+                    value = build(store_rows)
+                    if current:
+                        cache[store_id] = value
+                values[store_id] = value
+        return values
+
+    def store_timings(self, store_ids):
+        timings = self.derived(
+            self.timings,
+            store_ids,
+            lambda rows: timings_by_store(rows).get(rows[0].store_id) if rows else {},
+        )
+        return {store_id: value for store_id, value in timings.items() if value}
+
+    def store_schedules(self, store_ids):
+        return self.derived(
+            self.schedules,
+            store_ids,
+            lambda rows: compile_schedule(
+                (row.day, row.start_time_local, row.end_time_local) for row in rows
+            ),
+        )
+
+
+schedule_cache = ScheduleCache(ttl=SCHEDULE_CACHE_TTL)
+
+
+def load_store_timings(store_ids):
+    """`{store_id: {day: (start, end)}}` for stores with rows, as `valid_ping` reads it."""
+    if STORE_SNAPSHOT:
+        # imported here, the snapshot compiles schedules with this module
+        from .snapshot import snapshot_timings
+
+        timings = snapshot_timings(store_ids)
+        if timings is not None:
+            return timings
+    return schedule_cache.store_timings(store_ids)
+
+
+def load_store_schedules(store_ids):
+    if STORE_SNAPSHOT:
+        from .snapshot import snapshot_intervals
+
+        intervals = snapshot_intervals(store_ids)
+        if intervals is not None:
+            return {
+                store_id: (
+                    compile_schedule(())
+                    if store_intervals is None
+                    else Schedule.from_intervals(zip(*store_intervals))
+                )
+                for store_id, store_intervals in intervals.items()
+            }
+    return schedule_cache.store_schedules(store_ids)
+
+
+def invalidate_schedules():
+    redis_session.incr(REDIS_TIMINGS_VERSION)
+    schedule_cache.clear()
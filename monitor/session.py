@@ -1,10 +1,156 @@
-from sqlalchemy import create_engine
+import threading
+from contextvars import ContextVar
+from time import perf_counter
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import redis
+import redis.asyncio
+
+from .env import (
+    DATABASE_URL,
+    ASYNC_DATABASE_URL,
+    REDIS_URL,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_STATEMENT_TIMEOUT,
+)
+
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite"}
+
+
+def async_database_url(url):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+class PoolWaits:
+    """Time this process spent waiting for connections of one pool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+
+# pools are recreated on dispose(), so the totals live outside of them
+pool_waits = {"sync": PoolWaits(), "async": PoolWaits()}
+# per thread, and per greenlet on the async engine
+checkout_started = ContextVar("checkout_started", default=None)
+
+
+class TimedCheckout:
+    """Marks when `connect` starts, the `checkout` event of `time_checkouts` ends it."""
+
+    def connect(self):
+        token = checkout_started.set(perf_counter())
+        try:
+            return super().connect()
+        finally:
+            checkout_started.reset(token)
 
-from .env import DATABASE_URL, REDIS_URL
 
-engine = create_engine(url=DATABASE_URL)
+class TimedQueuePool(TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def time_checkouts(sync_engine, waits: PoolWaits):
+    @event.listens_for(sync_engine, "checkout")
+    def checkout_wait(dbapi_connection, connection_record, connection_proxy):
+        started = checkout_started.get()
+        if started is None:
+            return  # not a timed pool
+        # includes the pre-ping, the time to get a connection that works
+        seconds = perf_counter() - started
+        waits.add(seconds)
+        connection_record.info["checkout_wait"] = seconds  # read by profiling
+
+
+def engine_options(url, poolclass):
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}  # one connection per thread, nothing to size
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def set_statement_timeout(sync_engine):
+    if sync_engine.dialect.name != "mysql" or not DB_STATEMENT_TIMEOUT:
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def statement_timeout(dbapi_connection, connection_record):
+        # MySQL aborts read only SELECTs running longer than this
+        cursor = dbapi_connection.cursor()
+        cursor.execute(
+            f"SET SESSION max_execution_time = {int(DB_STATEMENT_TIMEOUT * 1000)}"
+        )
+        cursor.close()
+
+
+engine = create_engine(url=DATABASE_URL, **engine_options(DATABASE_URL, TimedQueuePool))
+set_statement_timeout(engine)
+time_checkouts(engine, pool_waits["sync"])
 
 db_session = scoped_session(sessionmaker(engine))
-redis_session = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+redis_session = redis.Redis.from_url(
+    REDIS_URL,
+    decode_responses=True,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_keepalive=True,
+    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+)
+
+# the API's event loop side: one AsyncSession per request and a bounded pool
+# of async Redis connections that waits for a free connection when exhausted
+async_url = ASYNC_DATABASE_URL or async_database_url(DATABASE_URL)
+async_engine = create_async_engine(
+    async_url, **engine_options(async_url, TimedAsyncQueuePool)
+)
+set_statement_timeout(async_engine.sync_engine)
+time_checkouts(async_engine.sync_engine, pool_waits["async"])
+async_session = async_sessionmaker(async_engine, expire_on_commit=False)
+async_redis = redis.asyncio.Redis(
+    connection_pool=redis.asyncio.BlockingConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        decode_responses=True,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    )
+)
+
+
+async def get_session():
+    async with async_session() as session:
+        yield session
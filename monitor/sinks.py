@@ -0,0 +1,243 @@
+"""Report files: streamed out chunk by chunk, stored locally or in S3.
+
+A report's location is kept in `Reports.filename`: a local path, or
+`s3://bucket/key` for the S3 compatible store (MinIO, Ceph, ... via
+`REPORT_S3_ENDPOINT`). Parquet needs `pyarrow` and S3 needs `boto3`.
+"""
+import csv
+import gzip
+import io
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+from .report import machine_user_text
+from .env import (
+    REPORT_DIR,
+    REPORT_FORMAT,
+    REPORT_S3_BUCKET,
+    REPORT_S3_ENDPOINT,
+    REPORT_S3_PREFIX,
+    REPORT_STORAGE,
+)
+
+HEADER = ["store_id", *machine_user_text.values()]
+READ_CHUNK = 1 << 16
+GZIP_LEVEL = 6
+ROW_GROUP_ROWS = 65536
+
+
+class CsvWriter:
+    extension = "csv"
+    media_type = "text/csv"
+
+    def __init__(self, fileobj, header=HEADER):
+        self.text = io.TextIOWrapper(self.wrap(fileobj), encoding="utf-8", newline="")
+        self.writer = csv.writer(self.text)
+        self.writer.writerow(header)
+
+    def wrap(self, fileobj):
+        return fileobj
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        # leave the storage's file open, the storage finalizes it
+        self.text.flush()
+        self.text.detach()
+
+
+class GzipCsvWriter(CsvWriter):
+    extension = "csv.gz"
+    media_type = "application/gzip"
+
+    def wrap(self, fileobj):
+        self.gzip = gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=GZIP_LEVEL)
+        return self.gzip
+
+    def close(self):
+        super().close()
+        self.gzip.close()  # writes the gzip trailer, keeps fileobj open
+
+
+class ParquetWriter:
+    """Rows are buffered into row groups of up to `ROW_GROUP_ROWS` rows."""
+
+    extension = "parquet"
+    media_type = "application/vnd.apache.parquet"
+
+    def __init__(self, fileobj, header=HEADER):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("REPORT_FORMAT=parquet needs pyarrow installed")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [("store_id", pyarrow.int64())]
+            + [(name, pyarrow.float64()) for name in header[1:]]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(fileobj, self.schema)
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= ROW_GROUP_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        self.writer.write_table(
+            self.pyarrow.Table.from_arrays(
+                [self.pyarrow.array(column) for column in columns], schema=self.schema
+            )
+        )
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+REPORT_FORMATS = {
+    writer.extension: writer for writer in (CsvWriter, GzipCsvWriter, ParquetWriter)
+}
+
+
+def format_for(location):
+    for extension, writer in REPORT_FORMATS.items():
+        if location.endswith(f".{extension}"):
+            return writer
+    return CsvWriter
+
+
+class LocalStorage:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def location(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def writer(self, location):
+        os.makedirs(os.path.dirname(location) or ".", exist_ok=True)
+        part = f"{location}.part"
+        try:
+            with open(part, "wb") as fileobj:
+                yield fileobj
+        except BaseException:
+            os.remove(part)
+            raise
+        os.replace(part, location)
+
+    def size(self, location):
+        return os.path.getsize(location)
+
+    def read(self, location, start, end):
+        """Bytes start..end (inclusive) in chunks of `READ_CHUNK`."""
+        with open(location, "rb") as fileobj:
+            fileobj.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = fileobj.read(min(READ_CHUNK, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+
+class S3Storage:
+    def __init__(self, bucket, prefix="", endpoint_url=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("REPORT_STORAGE=s3 needs boto3 installed")
+            self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+        return self._client
+
+    def location(self, name):
+        return f"s3://{self.bucket}/{self.prefix}{name}"
+
+    def key(self, location):
+        return location[len(f"s3://{self.bucket}/") :]
+
+    @contextmanager
+    def writer(self, location):
+        # spool on disk and upload once complete; upload_fileobj switches to a
+        # multipart upload for large files, memory stays at one part
+        with tempfile.TemporaryFile() as spool:
+            yield spool
+            spool.seek(0)
+            self.client.upload_fileobj(spool, self.bucket, self.key(location))
+
+    def size(self, location):
+        head = self.client.head_object(Bucket=self.bucket, Key=self.key(location))
+        return head["ContentLength"]
+
+    def read(self, location, start, end):
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.key(location), Range=f"bytes={start}-{end}"
+        )
+        yield from response["Body"].iter_chunks(READ_CHUNK)
+
+
+def report_storage():
+    if REPORT_STORAGE == "s3":
+        return S3Storage(
+            REPORT_S3_BUCKET, prefix=REPORT_S3_PREFIX, endpoint_url=REPORT_S3_ENDPOINT
+        )
+    return LocalStorage(REPORT_DIR)
+
+
+def storage_for(location):
+    if location.startswith("s3://"):
+        bucket = location[len("s3://") :].split("/", 1)[0]
+        return S3Storage(bucket, endpoint_url=REPORT_S3_ENDPOINT)
+    return LocalStorage(os.path.dirname(location))
+
+
+@contextmanager
+def report_sink(report_id, report_format=REPORT_FORMAT, storage=None, header=HEADER):
+    """Yield a writer taking row chunks; the file is stored once the block exits.
+
+    The writer's `location` is where the report ends up.
+    """
+    storage = storage or report_storage()
+    writer_class = REPORT_FORMATS[report_format]
+    location = storage.location(f"report_{report_id}.{writer_class.extension}")
+    with storage.writer(location) as fileobj:
+        writer = writer_class(fileobj, header=header)
+        writer.location = location
+        yield writer
+        writer.close()
+
+
+def parse_range(header, size):
+    """(start, end) of a single `bytes=` range, None to send the whole file.
+
+    Raises ValueError when the range can not be satisfied.
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header or "")
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, end
@@ -0,0 +1,437 @@
+"""Store metadata shared by every process of a host through one mapped file.
+
+With `STORE_SNAPSHOT=true`, `get_timezones`, `load_store_timings` and
+`load_store_schedules` read a read-only snapshot of every store's timezone,
+`store_timings` rows and compiled schedule, packed into flat arrays in a file
+under `STORE_SNAPSHOT_DIR` (tmpfs by default). Each API worker, report worker
+and pool process maps the same file, so the pages are held once per host and
+attaching costs an open and an `mmap`, not a Redis scan and database queries.
+
+Snapshots carry a generation. A new one is written to its own file and
+swapped in by replacing the `current` symlink, so readers see the old or the
+new file and pick up the new one on their next call. A snapshot records the
+Redis timezones and timings versions it was built from; once either moves,
+the first process to take the build lock writes the next generation and the
+others keep using the per-process caches until it is there.
+
+    python -m monitor.snapshot [--every 5]
+"""
+import argparse
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import time as day_time
+from types import MappingProxyType
+
+from sqlalchemy import select
+
+from .model import StoreTimezones, StoreTimings
+from .session import engine, redis_session
+from .schedule import compile_schedule
+from .constants import REDIS_TIMEZONES_VERSION, REDIS_TIMINGS_VERSION
+from .env import STORE_SNAPSHOT_DIR
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"STSN"
+FORMAT_VERSION = 1
+# magic, format, generation, stores, stores with a timezone, zones, timing
+# rows, schedule intervals, timezones version, timings version
+HEADER = struct.Struct("<4sIQQQIQQ32s32s")
+NO_ZONE = 0xFFFF
+CURRENT = "current"
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+def layout(stores, rows, intervals, zone_bytes):
+    """(name, typecode, count) of each section, in file order."""
+    return [
+        ("store_ids", "q", stores),
+        ("zones", "H", stores),
+        ("timing_offsets", "Q", stores + 1),
+        ("timing_days", "B", rows),
+        ("timing_starts", "q", rows),
+        ("timing_ends", "q", rows),
+        ("interval_offsets", "Q", stores + 1),
+        ("opens", "d", intervals),
+        ("closes", "d", intervals),
+        ("zone_names", "B", zone_bytes),
+    ]
+
+
+def section_offsets(sections):
+    offsets, offset = {}, align(HEADER.size)
+    for name, typecode, count in sections:
+        offsets[name] = offset
+        offset = align(offset + struct.calcsize(typecode) * count)
+    return offsets, offset
+
+
+def time_us(value: day_time):
+    return (
+        (value.hour * 60 + value.minute) * 60 + value.second
+    ) * 1_000_000 + value.microsecond
+
+
+def us_time(value):
+    seconds, microsecond = divmod(value, 1_000_000)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    return day_time(hour, minute, second, microsecond)
+
+
+class StoreSnapshot:
+    """Zero copy view of a snapshot file; arrays are memoryviews of the map."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fileobj:
+            self.map = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            file_format,
+            self.generation,
+            stores,
+            self.zoned,
+            zones,
+            rows,
+            intervals,
+            timezones_version,
+            timings_version,
+        ) = HEADER.unpack_from(self.map)
+        if magic != MAGIC or file_format != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a store snapshot")
+        self.versions = (
+            timezones_version.rstrip(b"\0").decode(),
+            timings_version.rstrip(b"\0").decode(),
+        )
+        view = memoryview(self.map)
+        sections = layout(stores, rows, intervals, 0)
+        offsets, _ = section_offsets(sections)
+        for name, typecode, count in sections[:-1]:
+            start = offsets[name]
+            end = start + struct.calcsize(typecode) * count
+            setattr(self, name, view[start:end].cast(typecode))
+        # a few hundred names, decoded once per process
+        names = bytes(view[offsets["zone_names"] :]).split(b"\0", 1)[0].decode()
+        self.zone_names = tuple(names.split("\n")) if zones else ()
+
+    def index(self, store_id):
+        index = bisect_left(self.store_ids, store_id)
+        if index < len(self.store_ids) and self.store_ids[index] == store_id:
+            return index
+        return None
+
+    def timezone(self, store_id):
+        index = self.index(store_id)
+        if index is None or self.zones[index] == NO_ZONE:
+            return None
+        return self.zone_names[self.zones[index]]
+
+    def timings(self, store_id):
+        """{day: (start, end)} like `timings_by_store`, None without rows."""
+        index = self.index(store_id)
+        if index is None:
+            return None
+        first, last = self.timing_offsets[index], self.timing_offsets[index + 1]
+        if first == last:
+            return None
+        return {
+            self.timing_days[row]: (
+                us_time(self.timing_starts[row]),
+                us_time(self.timing_ends[row]),
+            )
+            for row in range(first, last)
+        }
+
+    def intervals(self, store_id):
+        """The compiled schedule's (opens, closes), None for unknown stores."""
+        index = self.index(store_id)
+        if index is None:
+            return None
+        first = self.interval_offsets[index]
+        last = self.interval_offsets[index + 1]
+        return self.opens[first:last].tolist(), self.closes[first:last].tolist()
+
+
+class SnapshotTimezones(Mapping):
+    """Read only {store_id: timezone} over a snapshot, like `get_timezones`."""
+
+    def __init__(self, snapshot: StoreSnapshot):
+        self.snapshot = snapshot
+
+    def __getitem__(self, store_id):
+        timezone = self.snapshot.timezone(store_id)
+        if timezone is None:
+            raise KeyError(store_id)
+        return timezone
+
+    def __iter__(self):
+        for store_id, zone in zip(self.snapshot.store_ids, self.snapshot.zones):
+            if zone != NO_ZONE:
+                yield store_id
+
+    def __len__(self):
+        return self.snapshot.zoned
+
+    def items(self):
+        names = self.snapshot.zone_names
+        for store_id, zone in zip(self.snapshot.store_ids, self.snapshot.zones):
+            if zone != NO_ZONE:
+                yield store_id, names[zone]
+
+
+def source_versions():
+    timezones, timings = redis_session.mget(
+        REDIS_TIMEZONES_VERSION, REDIS_TIMINGS_VERSION
+    )
+    return timezones or "0", timings or "0"
+
+
+def read_metadata(connection):
+    """{store_id: timezone} and {store_id: [(day, start, end)]} of every store."""
+    timezones = dict(
+        connection.execute(
+            select(StoreTimezones.store_id, StoreTimezones.timezone_str)
+        ).all()
+    )
+    timings = {}
+    for store_id, day, start, end in connection.execute(
+        select(
+            StoreTimings.store_id,
+            StoreTimings.day,
+            StoreTimings.start_time_local,
+            StoreTimings.end_time_local,
+        ).order_by(StoreTimings.store_id, StoreTimings.id)
+    ):
+        timings.setdefault(store_id, []).append((day, start, end))
+    return timezones, timings
+
+
+def pack(timezones, timings, generation, versions):
+    """The bytes of a snapshot of `timezones` and `timings` rows."""
+    store_ids = sorted(timezones.keys() | timings.keys())
+    zone_names = sorted(set(timezones.values()))
+    if len(zone_names) >= NO_ZONE:
+        raise ValueError(f"{len(zone_names)} timezones do not fit a snapshot")
+    zone_index = {name: index for index, name in enumerate(zone_names)}
+    arrays = {
+        "store_ids": array("q", store_ids),
+        "zones": array("H"),
+        "timing_offsets": array("Q", [0]),
+        "timing_days": array("B"),
+        "timing_starts": array("q"),
+        "timing_ends": array("q"),
+        "interval_offsets": array("Q", [0]),
+        "opens": array("d"),
+        "closes": array("d"),
+    }
+    for store_id in store_ids:
+        zone = timezones.get(store_id)
+        arrays["zones"].append(NO_ZONE if zone is None else zone_index[zone])
+        rows = timings.get(store_id, [])
+        # the last row of a day wins, as in timings_by_store
+        days = {day: (start, end) for day, start, end in rows}
+        for day, (start, end) in days.items():
+            arrays["timing_days"].append(day)
+            arrays["timing_starts"].append(time_us(start))
+            arrays["timing_ends"].append(time_us(end))
+        arrays["timing_offsets"].append(len(arrays["timing_days"]))
+        schedule = compile_schedule(rows)
+        arrays["opens"].extend(schedule.opens)
+        arrays["closes"].extend(schedule.closes)
+        arrays["interval_offsets"].append(len(arrays["opens"]))
+    names = "\n".join(zone_names).encode() + b"\0"
+    sections = layout(
+        len(store_ids), len(arrays["timing_days"]), len(arrays["opens"]), len(names)
+    )
+    offsets, size = section_offsets(sections)
+    data = bytearray(size)
+    HEADER.pack_into(
+        data,
+        0,
+        MAGIC,
+        FORMAT_VERSION,
+        generation,
+        len(store_ids),
+        len(timezones),
+        len(zone_names),
+        len(arrays["timing_days"]),
+        len(arrays["opens"]),
+        versions[0].encode(),
+        versions[1].encode(),
+    )
+    for name, _, _ in sections[:-1]:
+        packed = arrays[name].tobytes()
+        data[offsets[name] : offsets[name] + len(packed)] = packed
+    data[offsets["zone_names"] : offsets["zone_names"] + len(names)] = names
+    return data
+
+
+def generation_of(name):
+    return int(name[len("stores-") : -len(".snap")])
+
+
+def current_path(directory=STORE_SNAPSHOT_DIR):
+    return os.path.join(directory, CURRENT)
+
+
+def current_file(directory=STORE_SNAPSHOT_DIR):
+    try:
+        return os.readlink(current_path(directory))
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def build_lock(directory=STORE_SNAPSHOT_DIR, blocking=True):
+    """Yield whether this process holds the build lock of `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "build.lock"), "w") as lock:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def write_snapshot(directory=STORE_SNAPSHOT_DIR):
+    """Build the next generation from the database and swap it in.
+
+    Call it holding `build_lock`. Returns the new snapshot's file name.
+    """
+    versions = source_versions()  # before reading, so changes during it rebuild
+    name = current_file(directory)
+    generation = generation_of(name) + 1 if name else 1
+    with engine.connect() as connection:
+        timezones, timings = read_metadata(connection)
+    data = pack(timezones, timings, generation, versions)
+    name = f"stores-{generation}.snap"
+    part = os.path.join(directory, f"{name}.part")
+    with open(part, "wb") as fileobj:
+        fileobj.write(data)
+    os.replace(part, os.path.join(directory, name))
+    link = os.path.join(directory, f"{CURRENT}.{os.getpid()}")
+    os.symlink(name, link)
+    os.replace(link, current_path(directory))
+    # processes still mapping older files keep their pages until they move on
+    for old in os.listdir(directory):
+        if old.startswith("stores-") and old.endswith(".snap"):
+            if generation_of(old) < generation - 1:
+                os.remove(os.path.join(directory, old))
+    logger.info(
+        "Store snapshot %s: %s stores, %s bytes", generation, len(timezones), len(data)
+    )
+    return name
+
+
+class SnapshotCache:
+    """This process's mapping of the current snapshot."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = None
+        self.snapshot = None
+        self.timezones = MappingProxyType({})
+
+    def attach(self):
+        """The current snapshot, or None while there is none for this data."""
+        name = current_file(self.directory)
+        if name is None:
+            return None
+        if name != self.name:
+            self.snapshot = StoreSnapshot(os.path.join(self.directory, name))
+            self.timezones = SnapshotTimezones(self.snapshot)
+            self.name = name
+        return self.snapshot
+
+    def get(self):
+        snapshot = self.attach()
+        if snapshot is not None and snapshot.versions == source_versions():
+            return snapshot
+        with build_lock(self.directory, blocking=False) as locked:
+            if locked:
+                write_snapshot(self.directory)
+                snapshot = self.attach()
+                if snapshot.versions == source_versions():
+                    return snapshot
+        return None  # another process is building it
+
+    def ensure(self):
+        """Wait for a snapshot of the current data, building it if needed."""
+        snapshot = self.attach()
+        if snapshot is None or snapshot.versions != source_versions():
+            with build_lock(self.directory):
+                snapshot = self.attach()
+                if snapshot is None or snapshot.versions != source_versions():
+                    write_snapshot(self.directory)
+                    snapshot = self.attach()
+        return snapshot
+
+
+snapshot_cache = SnapshotCache(STORE_SNAPSHOT_DIR)
+
+
+def snapshot_timezones():
+    """`get_timezones` from the snapshot, None without a current one."""
+    if snapshot_cache.get() is None:
+        return None
+    return snapshot_cache.timezones
+
+
+def snapshot_timings(store_ids):
+    snapshot = snapshot_cache.get()
+    if snapshot is None:
+        return None
+    timings = {}
+    for store_id in store_ids:
+        store_timings = snapshot.timings(int(store_id))
+        if store_timings is not None:
+            timings[int(store_id)] = store_timings
+    return timings
+
+
+def snapshot_intervals(store_ids):
+    """{store_id: (opens, closes)}, None without a current snapshot."""
+    snapshot = snapshot_cache.get()
+    if snapshot is None:
+        return None
+    return {int(store_id): snapshot.intervals(int(store_id)) for store_id in store_ids}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--every", type=float, help="seconds between checks, builds once without"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s"
+    )
+    while True:
+        with build_lock():
+            snapshot = snapshot_cache.attach()
+            if snapshot is None or snapshot.versions != source_versions():
+                write_snapshot()
+        if not args.every:
+            return
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Uptime of single stores, answered from a per-process cache of recent pings.
+
+A store's pings since the start of the report window are loaded on first use
+and kept newest last; pings accepted by `POST /pings` are added to the stores
+already cached once they are written. Entries are reloaded after
+`STATUS_CACHE_TTL` seconds, which also picks up pings written by other
+processes, and the least recently used store is dropped past
+`STATUS_CACHE_STORES`.
+"""
+import threading
+import time as clock
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from dataclasses import asdict
+from datetime import datetime
+from operator import attrgetter
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+
+from .model import Status
+from .session import db_session as session
+from .report import StoreStatus, store_report
+from .queries import REPORT_SPAN, get_timezones, stream_store_pings
+from .schedule import load_store_timings
+from .env import STATUS_CACHE_STORES, STATUS_CACHE_TTL
+
+router = APIRouter()
+
+CachedPing = namedtuple("CachedPing", ["timestamp_utc", "status"])
+timestamp = attrgetter("timestamp_utc")
+
+
+class PingCache:
+    def __init__(self, max_stores, ttl):
+        self.max_stores = max_stores
+        self.ttl = ttl
+        self.stores = OrderedDict()  # store_id -> (loaded_at, since, pings)
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.stores.clear()
+
+    def cached(self, store_id, since):
+        entry = self.stores.get(store_id)
+        if entry is None:
+            return None
+        loaded_at, cached_since, pings = entry
+        if cached_since > since or clock.monotonic() - loaded_at > self.ttl:
+            return None
+        self.stores.move_to_end(store_id)
+        return pings
+
+    def store(self, store_id, since, pings):
+        self.stores[store_id] = (clock.monotonic(), since, pings)
+        self.stores.move_to_end(store_id)
+        while len(self.stores) > self.max_stores:
+            self.stores.popitem(last=False)
+
+    def pings(self, store_ids, since, until):
+        """{store_id: pings in [since, until), newest first}, loading misses."""
+        with self.lock:
+            found = {}
+            for store_id in store_ids:
+                pings = self.cached(store_id, since)
+                if pings is not None:
+                    found[store_id] = pings[::-1]
+            missing = [store_id for store_id in store_ids if store_id not in found]
+        if missing:
+            loaded = {store_id: [] for store_id in missing}
+            for store_id, rows in stream_store_pings(missing, since=since):
+                loaded[store_id] = [
+                    CachedPing(row.timestamp_utc, row.status) for row in reversed(rows)
+                ]
+            with self.lock:
+                for store_id, pings in loaded.items():
+                    self.store(store_id, since, pings)
+                    found[store_id] = pings[::-1]
+        return {
+            store_id: [
+                ping for ping in found[store_id] if since <= ping.timestamp_utc < until
+            ]
+            for store_id in store_ids
+        }
+
+    def add(self, pings):
+        """Add written pings to the stores already cached."""
+        with self.lock:
+            for ping in pings:
+                entry = self.stores.get(ping["store_id"])
+                if entry is None:
+                    continue
+                cached = CachedPing(ping["timestamp_utc"], Status[ping["status"]])
+                entries = entry[2]
+                # the write may already be in a load that raced with it
+                first = bisect_left(entries, cached.timestamp_utc, key=timestamp)
+                last = bisect_right(entries, cached.timestamp_utc, key=timestamp)
+                if cached not in entries[first:last]:
+                    entries.insert(last, cached)
+
+
+ping_cache = PingCache(max_stores=STATUS_CACHE_STORES, ttl=STATUS_CACHE_TTL)
+
+
+def store_statuses(store_ids, current_time=None):
+    """{store_id: StoreStatus} of the known stores with pings in the last week."""
+    current_time = current_time or datetime.utcnow()
+    timezones = get_timezones()
+    store_ids = [store_id for store_id in store_ids if store_id in timezones]
+    store_timings = load_store_timings(store_ids)
+    recent = ping_cache.pings(
+        store_ids, since=current_time - REPORT_SPAN, until=current_time
+    )
+    return {
+        store_id: StoreStatus(
+            *store_report(
+                pings,
+                timings=store_timings.get(store_id, {}),
+                timezone=timezones[store_id],
+                current_time=current_time,
+            )
+        )
+        for store_id, pings in recent.items()
+        if pings
+    }
+
+
+def threadpool_statuses(store_ids):
+    # sync endpoints run in threadpool threads, hand their scoped session back so
+    # no connection and no REPEATABLE READ snapshot outlives the request
+    try:
+        return store_statuses(store_ids)
+    finally:
+        session.remove()
+
+
+@router.get("/stores/{store_id}/status")
+def store_status(store_id: int):
+    status = threadpool_statuses([store_id]).get(store_id)
+    if status is None:
+        raise HTTPException(
+            status_code=404, detail=f"No pings for store {store_id} in the last week."
+        )
+    return JSONResponse({"store_id": store_id, **asdict(status)})
+
+
+@router.post("/stores/status")
+def batch_store_status(store_ids: list[int]):
+    statuses = threadpool_statuses(list(dict.fromkeys(store_ids)))
+    return JSONResponse(
+        {
+            "stores": [
+                {"store_id": store_id, **asdict(status)}
+                for store_id, status in statuses.items()
+            ],
+            "missing": [store_id for store_id in store_ids if store_id not in statuses],
+        }
+    )
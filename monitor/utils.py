@@ -1,5 +1,56 @@
+from contextlib import contextmanager
+
 from .session import redis_session
+from .env import REDIS_PIPELINE_SIZE
+
+
+class Batch:
+    """Redis commands queued on a pipeline and sent every `size` commands.
+
+    Call commands on it like on a client; their replies are in `results`, in
+    order, once the batch is flushed.
+    """
+
+    def __init__(self, client, size=REDIS_PIPELINE_SIZE):
+        self.pipe = client.pipeline(transaction=False)
+        self.size = size
+        self.queued = 0
+        self.results = []
+
+    def __getattr__(self, name):
+        command = getattr(self.pipe, name)
+
+        def queue(*args, **kwargs):
+            command(*args, **kwargs)
+            self.queued += 1
+            if self.queued >= self.size:
+                self.flush()
+
+        return queue
+
+    def flush(self):
+        if self.queued:
+            self.results.extend(self.pipe.execute())
+            self.queued = 0
+
+
+@contextmanager
+def batched(client=redis_session, size=REDIS_PIPELINE_SIZE):
+    """Yield a `Batch`, sending what is left of it when the block exits."""
+    batch = Batch(client, size=size)
+    with batch.pipe:
+        yield batch
+        batch.flush()
 
 
-def check_exists(redis_key):
-    return redis_session.exists(redis_key)
+def get_many(redis_keys, size=REDIS_PIPELINE_SIZE):
+    """{key: value} of the keys that are set, MGET `size` keys at a time."""
+    values = {}
+    for start in range(0, len(redis_keys), size):
+        keys = redis_keys[start : start + size]
+        values.update(
+            (key, value)
+            for key, value in zip(keys, redis_session.mget(keys))
+            if value is not None
+        )
+    return values
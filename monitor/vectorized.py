@@ -0,0 +1,214 @@
+from datetime import datetime, timedelta
+from itertools import islice
+
+import numpy as np
+
+from .model import Status
+from .report import LocalPing, working_hours_day, working_hours_week, split_hours
+from .queries import ping_query, range_start
+from .schedule import load_store_timings
+from .profiling import stage
+from .zones import local_time, zone_offsets
+from .env import PING_STREAM_BATCH
+
+MICROSECONDS = 10**6
+DAY = 86400 * MICROSECONDS
+HOUR = 3600 * MICROSECONDS
+EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_us(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def time_us(day_time):
+    return (
+        day_time.hour * 3600 + day_time.minute * 60 + day_time.second
+    ) * MICROSECONDS + day_time.microsecond
+
+
+def ping_columns(pings):
+    # rows as selected by bulk_vector_report: (status, timestamp_utc, store_id)
+    statuses, timestamps, store_ids = zip(*pings)
+    count = len(pings)
+    active = Status.active
+    return (
+        np.array(store_ids, dtype=np.int64),
+        np.fromiter(
+            (epoch_us(timestamp) for timestamp in timestamps),
+            dtype=np.int64,
+            count=count,
+        ),
+        np.fromiter(
+            (1 if status is active else 2 for status in statuses),
+            dtype=np.int8,
+            count=count,
+        ),
+    )
+
+
+def stream_columns(pings, batch_size=PING_STREAM_BATCH):
+    # convert rows batch by batch so only one batch of Row objects is alive
+    batches = []
+    pings = iter(pings)
+    while batch := list(islice(pings, batch_size)):
+        batches.append(ping_columns(batch))
+    if not batches:
+        return None
+    return tuple(np.concatenate(column) for column in zip(*batches))
+
+
+def local_offsets(timestamps, ping_zones, zone_names):
+    offsets = np.zeros(len(timestamps), dtype=np.int64)
+    start = int(timestamps.min() // MICROSECONDS) - 1
+    end = int(timestamps.max() // MICROSECONDS) + 1
+    # day aligned bounds so every chunk of a report shares the cached tables
+    start, end = start - start % 86400, end - end % 86400 + 86400
+    for zone_index, zone_name in enumerate(zone_names):
+        mask = ping_zones == zone_index
+        if not mask.any():
+            continue
+        points, zone_offsets_ = zone_offsets(zone_name, start, end)
+        position = np.searchsorted(
+            np.asarray(points, dtype=np.int64) * MICROSECONDS,
+            timestamps[mask],
+            side="right",
+        )
+        offsets[mask] = np.asarray(zone_offsets_, dtype=np.int64)[position - 1]
+    return offsets * MICROSECONDS
+
+
+def schedule_table(stores, store_timings):
+    opens = np.zeros((len(stores), 7), dtype=np.int64)
+    closes = np.full((len(stores), 7), DAY - 1, dtype=np.int64)
+    for index, store_id in enumerate(stores):
+        for day, (start_time, end_time) in store_timings.get(store_id, {}).items():
+            opens[index, day] = time_us(start_time)
+            closes[index, day] = time_us(end_time)
+    return opens, closes
+
+
+def group_sum(values, groups, size):
+    return np.bincount(groups, weights=values, minlength=size).astype(np.int64)
+
+
+def columns_report(columns, timezones, store_timings, current_time):
+    store_ids, timestamps, statuses = columns
+    stores, first_rows, store_index = np.unique(
+        store_ids, return_index=True, return_inverse=True
+    )
+    size = len(stores)
+    zone_names = sorted({timezones[store_id] for store_id in stores.tolist()})
+    zone_index = {zone_name: index for index, zone_name in enumerate(zone_names)}
+    store_zones = np.array(
+        [zone_index[timezones[store_id]] for store_id in stores.tolist()],
+        dtype=np.int64,
+    )
+    local = timestamps + local_offsets(timestamps, store_zones[store_index], zone_names)
+    weekdays = (local // DAY + 3) % 7  # 1970-01-01 was a Thursday
+    day_times = local % DAY
+    opens, closes = schedule_table(stores.tolist(), store_timings)
+    valid = (day_times >= opens[store_index, weekdays]) & (
+        day_times <= closes[store_index, weekdays]
+    )
+    active = statuses == Status.active.value
+    # like the python path, the hour and the day are measured on each store's
+    # wall clock, which runs an hour back when DST ends
+    store_current = np.array(
+        [
+            epoch_us(local_time(current_time, timezones[store_id]))
+            for store_id in stores.tolist()
+        ],
+        dtype=np.int64,
+    )
+    current_local = store_current[store_index]
+
+    in_day = local > current_local - DAY
+    counts = {
+        "active_week": group_sum(valid & active, store_index, size),
+        "inactive_week": group_sum(valid & ~active, store_index, size),
+        "active_day": group_sum(valid & active & in_day, store_index, size),
+        "inactive_day": group_sum(valid & ~active & in_day, store_index, size),
+    }
+
+    # last_hour_status: walk valid pings newest first, crediting the gap up to
+    # the next newer valid ping, and the remainder of the hour to the first
+    # valid ping older than an hour; the walk stops there, and after a DST
+    # fall back later pings can be newer on the wall clock again.
+    rows = np.flatnonzero(valid)
+    valid_stores = store_index[rows]
+    valid_times = local[rows]
+    valid_current = current_local[rows]
+    group_start = np.ones(len(rows), dtype=bool)
+    group_start[1:] = valid_stores[1:] != valid_stores[:-1]
+    next_times = np.empty(len(rows), dtype=np.int64)
+    next_times[1:] = valid_times[:-1]
+    next_times[group_start] = valid_current[group_start]
+    older = (valid_current - valid_times) >= HOUR
+    older_seen = np.cumsum(older) - older
+    group_seen = older_seen[group_start]
+    past = older_seen - group_seen[np.cumsum(group_start) - 1] > 0
+    first_older = older & ~past
+    elapsed = np.where(older | past, 0, next_times - valid_times)
+    elapsed[first_older] = np.maximum(next_times - valid_current + HOUR, 0)[first_older]
+    valid_active = active[rows]
+    hour_active = group_sum(np.where(valid_active, elapsed, 0), valid_stores, size)
+    hour_inactive = group_sum(np.where(valid_active, 0, elapsed), valid_stores, size)
+
+    bulk_reports = []
+    for index, store_id in enumerate(stores.tolist()):
+        timings = store_timings.get(store_id, {})
+        latest = EPOCH + timedelta(microseconds=int(timestamps[first_rows[index]]))
+        latest_ping = LocalPing(
+            status=Status(int(statuses[first_rows[index]])),
+            local_time=local_time(latest, timezones[store_id]),
+        )
+        active_day, inactive_day = split_hours(
+            {
+                "active": int(counts["active_day"][index]),
+                "inactive": int(counts["inactive_day"][index]),
+            },
+            working_hours_day(latest_ping=latest_ping, timings=timings),
+        )
+        active_week, inactive_week = split_hours(
+            {
+                "active": int(counts["active_week"][index]),
+                "inactive": int(counts["inactive_week"][index]),
+            },
+            working_hours_week(timings=timings),
+        )
+        bulk_reports.append(
+            [
+                store_id,
+                round(int(hour_active[index]) / MICROSECONDS / 60, 2),
+                round(int(hour_inactive[index]) / MICROSECONDS / 60, 2),
+                active_day,
+                inactive_day,
+                active_week,
+                inactive_week,
+            ]
+        )
+    return bulk_reports
+
+
+def bulk_vector_report(timezones: dict, current_time, start=None) -> list:
+    store_ids = timezones.keys()
+    with stage("timings_query"):
+        store_timings = load_store_timings(store_ids)
+    if not store_timings:
+        return []
+    with stage("ping_query"):
+        columns = stream_columns(
+            ping_query(
+                store_ids, since=range_start(current_time, start), until=current_time
+            )
+        )
+    if columns is None:
+        return []
+    with stage("columns"):
+        return columns_report(
+            columns,
+            timezones=timezones,
+            store_timings=store_timings,
+            current_time=current_time,
+        )
@@ -0,0 +1,238 @@
+"""Reports over any set of rolling windows, computed in one pass per store.
+
+A window is a duration back from the report time and a mode:
+- `interpolate`: each valid ping's status holds until the next valid ping,
+  like `last_hour_status`,
+- `count`: the share of active valid pings times the business hours in the
+  window, like `cumulative_status`.
+
+The business hours of a `count` window are the open time of the store's
+compiled schedule within it, whatever its length.
+
+A store's valid pings are walked once, newest first, into prefix sums of
+interpolated microseconds and ping counts per status; each window is then a
+bisect and a few subtractions. Windows report in the unit they were asked in,
+day windows in hours like the default report.
+"""
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Literal
+
+from pydantic import BaseModel, PositiveFloat
+
+from .model import Status
+from .report import LocalPing, split_hours, valid_ping
+from .queries import REPORT_SPAN, range_start, stream_store_pings
+from .schedule import (
+    DAY_SECONDS,
+    WEEK_SECONDS,
+    load_store_schedules,
+    load_store_timings,
+)
+from .zones import local_time, localize
+from .profiling import stage, timed
+
+MICROSECOND = timedelta(microseconds=1)
+UNIT_SECONDS = {"minutes": 60, "hours": 3600, "days": DAY_SECONDS}
+COLUMN_UNITS = {"minutes": "minutes", "hours": "hours", "days": "hours"}
+
+
+class WindowSpec(BaseModel):
+    duration: PositiveFloat
+    unit: Literal["minutes", "hours", "days"] = "hours"
+    mode: Literal["interpolate", "count"] = "count"
+
+
+@dataclass(frozen=True, slots=True)
+class Window:
+    label: str
+    seconds: float
+    mode: str
+    unit: str  # of the column values
+
+    @classmethod
+    def from_spec(cls, spec: WindowSpec):
+        return cls(
+            label=f"{spec.duration:g}_{spec.unit}",
+            seconds=spec.duration * UNIT_SECONDS[spec.unit],
+            mode=spec.mode,
+            unit=COLUMN_UNITS[spec.unit],
+        )
+
+    @property
+    def unit_seconds(self):
+        return UNIT_SECONDS[self.unit]
+
+    @property
+    def columns(self):
+        return [
+            f"uptime_last_{self.label}(in {self.unit})",
+            f"downtime_last_{self.label}(in {self.unit})",
+        ]
+
+
+DEFAULT_WINDOWS = (
+    Window("60_minutes", 3600, "interpolate", "minutes"),
+    Window("1_days", DAY_SECONDS, "count", "hours"),
+    Window("7_days", WEEK_SECONDS, "count", "hours"),
+)
+
+
+def parse_windows(windows: list):
+    """Windows of a request's `windows` list, None for the default report."""
+    if not windows:
+        return None
+    return tuple(Window.from_spec(WindowSpec.model_validate(spec)) for spec in windows)
+
+
+def encode_windows(windows):
+    if windows is None:
+        return ""
+    return ",".join(f"{window.label}:{window.mode}" for window in windows)
+
+
+def window_header(windows):
+    return ["store_id"] + [column for window in windows for column in window.columns]
+
+
+def fetch_span(windows):
+    # the default report reads a week of pings, longer windows read more
+    return max([WEEK_SECONDS] + [window.seconds for window in windows])
+
+
+def report_span(windows):
+    """How far before `as_of` a report reads, `windows` None for the default one."""
+    return REPORT_SPAN if windows is None else timedelta(seconds=fetch_span(windows))
+
+
+class WindowSums:
+    """Prefix sums over a store's valid pings, newest first."""
+
+    def __init__(self, pings, timings, current_time):
+        self.current_time = current_time
+        self.latest = pings[0] if pings else None
+        self.pings = []
+        # furthest age (microseconds before current_time) seen so far; local
+        # times step back at a DST change, so ages alone are not sorted
+        self.reach = []
+        self.ages = {Status.active: [], Status.inactive: []}
+        self.active_us = [0]
+        self.inactive_us = [0]
+        next_time = current_time
+        for ping in pings:
+            if not valid_ping(ping, timings=timings):
+                continue
+            held = (next_time - ping.local_time) // MICROSECOND
+            age = (current_time - ping.local_time) // MICROSECOND
+            if ping.status is Status.active:
+                self.active_us.append(self.active_us[-1] + held)
+                self.inactive_us.append(self.inactive_us[-1])
+            else:
+                self.active_us.append(self.active_us[-1])
+                self.inactive_us.append(self.inactive_us[-1] + held)
+            self.reach.append(max(age, self.reach[-1]) if self.reach else age)
+            self.ages[ping.status].append(age)
+            self.pings.append(ping)
+            next_time = ping.local_time
+        for ages in self.ages.values():
+            ages.sort()  # nearly sorted already
+
+    def interpolated(self, seconds):
+        """(active, inactive) seconds held within the last `seconds`."""
+        window_us = round(seconds * 1e6)
+        inside = bisect_left(self.reach, window_us)
+        active, inactive = self.active_us[inside], self.inactive_us[inside]
+        if inside < len(self.pings):
+            # the first ping outside holds from the window start on
+            newer = self.pings[inside - 1].local_time if inside else self.current_time
+            held = (
+                newer - self.current_time + timedelta(microseconds=window_us)
+            ) // MICROSECOND
+            if held > 0:
+                if self.pings[inside].status is Status.active:
+                    active += held
+                else:
+                    inactive += held
+        return active / 1e6, inactive / 1e6
+
+    def counts(self, seconds, everything=False):
+        """Valid pings per status within the last `seconds`."""
+        window_us = round(seconds * 1e6)
+        return {
+            status.name: len(ages) if everything else bisect_left(ages, window_us)
+            for status, ages in self.ages.items()
+        }
+
+
+def open_seconds(window, schedule, current_time):
+    """Business seconds in a window, so a longer window never holds fewer."""
+    start = current_time - timedelta(seconds=window.seconds)
+    return schedule.open_seconds(start, current_time)
+
+
+def window_times(pings, timings, schedule, current_time, windows, span):
+    sums = WindowSums(pings, timings, current_time)
+    times = []
+    for window in windows:
+        if window.mode == "interpolate":
+            active, inactive = sums.interpolated(window.seconds)
+            times += [
+                round(active / window.unit_seconds, 2),
+                round(inactive / window.unit_seconds, 2),
+            ]
+        elif sums.latest is None:
+            times += [0.0, 0.0]
+        else:
+            times += split_hours(
+                sums.counts(window.seconds, everything=window.seconds >= span),
+                open_seconds(window, schedule, current_time) / window.unit_seconds,
+            )
+    return times
+
+
+def store_window_report(pings, timings, schedule, timezone, current_time, windows):
+    with stage("localize"):
+        local_pings = [
+            LocalPing(status=ping.status, local_time=moment)
+            for ping, moment in zip(
+                pings, localize([ping.timestamp_utc for ping in pings], timezone)
+            )
+        ]
+    with stage("windows"):
+        return window_times(
+            local_pings,
+            timings,
+            schedule,
+            current_time=local_time(current_time, timezone),
+            windows=windows,
+            span=fetch_span(windows),
+        )
+
+
+def bulk_window_report(timezones: dict, current_time, windows, start=None) -> list:
+    store_ids = timezones.keys()
+    with stage("timings_query"):
+        store_timings = load_store_timings(store_ids)
+        schedules = load_store_schedules(store_ids)
+    bulk_reports = []
+    since = range_start(
+        current_time, start, span=timedelta(seconds=fetch_span(windows))
+    )
+    for store_id, store_pings in timed(
+        stream_store_pings(store_ids, since=since, until=current_time), "ping_query"
+    ):
+        bulk_reports.append(
+            [
+                store_id,
+                *store_window_report(
+                    store_pings,
+                    timings=store_timings.get(store_id, {}),
+                    schedule=schedules[store_id],
+                    timezone=timezones[store_id],
+                    current_time=current_time,
+                    windows=windows,
+                ),
+            ]
+        )
+    return bulk_reports
@@ -0,0 +1,257 @@
+"""Report worker, run as many as needed on any host that reaches MySQL and Redis.
+
+    python -m monitor.worker [--burst]
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+
+from .session import db_session as session
+from .queries import get_timezones
+from .rollup import update_rollups
+from .main import report_rows, update_report_status
+from .sinks import HEADER, report_sink
+from .windows import parse_windows, window_header
+from .model import JobStatus
+from .profiling import Profile, dump_profile, profiled, record_report, stage, timed
+from .jobs import (
+    claim_merge,
+    claim_task,
+    complete_shard,
+    enqueue_shards,
+    extend_lease,
+    finish_job,
+    job_profiles,
+    job_state,
+    record_attempt,
+    record_profile,
+    redis_now,
+    release_task,
+    requeue_expired,
+    requeue_merge,
+    retry_task,
+    shard_results,
+    task_name,
+)
+from .env import (
+    REPORT_CHUNK_SIZE,
+    REPORT_HEARTBEAT_SECONDS,
+    REPORT_POLL_INTERVAL,
+    REPORT_SHARD_SIZE,
+    REPORT_TASK_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+running = JobStatus.running.name
+failed = JobStatus.failed.name
+finished = JobStatus.finished.name
+
+
+class Heartbeat(threading.Thread):
+    """Extends a task's lease every `interval` seconds until stopped."""
+
+    def __init__(self, task: str, interval=REPORT_HEARTBEAT_SECONDS):
+        super().__init__(daemon=True)
+        self.task = task
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if not extend_lease(self.task):
+                    logger.warning("Lost the lease on %s", self.task)
+                    return
+            except Exception:
+                logger.exception("Heartbeat failed for %s", self.task)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.join()
+
+
+def shard_ranges(store_ids, shard_size=REPORT_SHARD_SIZE):
+    store_ids = sorted(store_ids)
+    return [
+        (store_ids[start], store_ids[min(start + shard_size, len(store_ids)) - 1])
+        for start in range(0, len(store_ids), shard_size)
+    ]
+
+
+def plan_report(report_id, job):
+    update_report_status(report_id=report_id, status=running)
+    if job["mode"] == "rollup":
+        update_rollups(chunk_size=REPORT_CHUNK_SIZE)
+    with stage("timezones"):
+        ranges = shard_ranges(get_timezones())
+    if not ranges:
+        merge_report(report_id)
+        return
+    enqueue_shards(report_id, ranges)
+
+
+def run_shard(task: dict, job):
+    first, last = task["first"], task["last"]
+    with stage("timezones"):
+        timezones = {
+            store_id: timezone
+            for store_id, timezone in get_timezones().items()
+            if first <= store_id <= last
+        }
+    return report_rows(
+        timezones,
+        current_time=datetime.fromisoformat(job["current_time"]),
+        mode=job["mode"],
+        windows=job_windows(job),
+        start=datetime.fromisoformat(job["start"]) if job.get("start") else None,
+    )
+
+
+def job_windows(job):
+    return parse_windows(json.loads(job.get("windows") or "[]"))
+
+
+def merge_report(report_id, attempt=0, claimed=False):
+    """Write the shards' rows to the report file and store the outcome.
+
+    When the outcome cannot be stored the merge is queued again, up to
+    `REPORT_TASK_RETRIES` times, then the job is marked failed in Redis.
+    """
+    if not claimed and not claim_merge(report_id):
+        return
+    windows = job_windows(job_state(report_id))
+    header = HEADER if windows is None else window_header(windows)
+    status, filename = finished, None
+    with profiled() as profile:
+        try:
+            with report_sink(report_id, header=header) as sink:
+                for rows in timed(shard_results(report_id), "shard_results"):
+                    with stage("write"):
+                        sink.write(rows)
+            filename = sink.location
+        except Exception:
+            logger.exception("Failed to write report %s", report_id)
+            session.rollback()
+            status = failed
+    try:
+        end_report(report_id, status, profile, filename=filename)
+    except Exception:
+        # the shard leases are gone by now, nothing else would retry the merge
+        session.rollback()
+        if attempt < REPORT_TASK_RETRIES:
+            logger.exception("Failed to store report %s, merging again", report_id)
+            requeue_merge(report_id)
+        else:
+            logger.exception("Giving up on storing report %s", report_id)
+            finish_job(report_id, failed)
+        return
+    logger.info("Report %s %s: %s", report_id, status, filename)
+
+
+def fail_report(report_id, profile=None):
+    try:
+        end_report(report_id, failed, profile or Profile())
+    except Exception:
+        logger.exception("Failed to store the failure of report %s", report_id)
+        session.rollback()
+        finish_job(report_id, failed)
+
+
+def end_report(report_id, status, profile, filename=None):
+    """Store the report's outcome along with the profiles of all its tasks."""
+    job = job_state(report_id)
+    for task_profile in job_profiles(job):
+        profile.merge(task_profile)
+    report_profile = profile.as_dict()
+    update_report_status(
+        report_id=report_id,
+        status=status,
+        filename=filename,
+        profile=dump_profile(report_profile),
+    )
+    if job.get("status") in (finished, failed):
+        return  # another shard already gave up on the report
+    finish_job(report_id, status)
+    started = float(job.get("started") or redis_now())
+    record_report(report_profile, status, redis_now() - started)
+
+
+def run_task(encoded: str, task: dict):
+    report_id = task["report_id"]
+    job = job_state(report_id)
+    if job.get("status") not in ("pending", "running"):
+        # the report failed, finished or expired while this task was queued
+        release_task(encoded)
+        return
+    attempt = record_attempt(task)
+    if task["kind"] == "merge":
+        merge_report(report_id, attempt=attempt, claimed=True)
+        release_task(encoded)
+        return
+    try:
+        with profiled(name=f"report_{report_id}_{task_name(task)}") as profile:
+            if task["kind"] == "plan":
+                plan_report(report_id, job)
+            else:
+                rows = run_shard(task, job)
+        record_profile(task, profile.as_dict())
+        if task["kind"] == "plan":
+            release_task(encoded)
+            return
+        done = complete_shard(encoded, report_id, task["index"], rows)
+        if done == -1:
+            logger.warning("Lease on %s expired before it finished", encoded)
+        elif done >= int(job_state(report_id).get("shards", 0)):
+            merge_report(report_id)
+    except Exception:
+        session.rollback()
+        if attempt > REPORT_TASK_RETRIES:
+            logger.exception("Giving up on %s after %s attempts", encoded, attempt)
+            release_task(encoded)
+            fail_report(report_id)
+        else:
+            logger.exception("Attempt %s of %s failed, retrying", attempt, encoded)
+            retry_task(encoded)
+
+
+def work(burst=False):
+    logger.info("Report worker started")
+    while True:
+        requeue_expired()
+        claimed = claim_task()
+        if claimed is None:
+            if burst:
+                return
+            time.sleep(REPORT_POLL_INTERVAL)
+            continue
+        encoded, task = claimed
+        started = time.perf_counter()
+        try:
+            with Heartbeat(encoded):
+                run_task(encoded, task)
+        finally:
+            session.remove()
+        logger.info("%s took %.2fs", encoded, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued report tasks.")
+    parser.add_argument(
+        "--burst", action="store_true", help="exit once the queue is empty"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s"
+    )
+    work(burst=args.burst)
+
+
+if __name__ == "__main__":
+    main()
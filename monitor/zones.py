@@ -0,0 +1,127 @@
+import zoneinfo
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+
+EPOCH = datetime(1970, 1, 1)
+DAY_SECONDS = 86400
+OFFSET_PROBE = 7 * DAY_SECONDS  # seconds; zones never change offset twice in a week
+
+
+@lru_cache(maxsize=None)
+def get_zone(timezone) -> zoneinfo.ZoneInfo:
+    # one ZoneInfo per name for the life of the process, so local times of the
+    # same store share a tzinfo and compare and subtract as wall clock times
+    return zoneinfo.ZoneInfo(timezone)
+
+
+def epoch_seconds(timestamp_utc: datetime):
+    return (timestamp_utc - EPOCH) // timedelta(seconds=1)
+
+
+@lru_cache(maxsize=4096)
+def zone_offsets(timezone, start, end):
+    """Transition instants (epoch seconds) and UTC offsets covering [start, end].
+
+    Returned as two tuples where `offsets[i]` is in force from `points[i]`
+    until `points[i + 1]`.
+    """
+    zone = get_zone(timezone)
+
+    def offset(epoch):
+        moment = datetime.fromtimestamp(epoch, tz=dt_timezone.utc).astimezone(zone)
+        return int(moment.utcoffset().total_seconds())
+
+    points, offsets = [start], [offset(start)]
+    probe_start = start
+    while probe_start < end:
+        probe_end = min(probe_start + OFFSET_PROBE, end)
+        low, high = probe_start, probe_end
+        if offset(low) != offset(high):
+            while high - low > 1:
+                middle = (low + high) // 2
+                if offset(middle) == offset(low):
+                    low = middle
+                else:
+                    high = middle
+            points.append(high)
+            offsets.append(offset(high))
+        probe_start = probe_end
+    return tuple(points), tuple(offsets)
+
+
+@dataclass(frozen=True, slots=True)
+class ZoneTable:
+    """UTC to local shifts of one zone over a window, keyed by naive UTC datetimes.
+
+    `shifts[i]` applies from `points[i]`. Local times come out naive: the wall
+    clock `astimezone(zone)` shows, without the cost of attaching a tzinfo.
+    Aware datetimes sharing one `ZoneInfo` compare and subtract as wall clock
+    times anyway, so the report functions give the same results on these.
+    """
+
+    points: tuple
+    shifts: tuple
+
+    def to_local(self, timestamp_utc: datetime):
+        return timestamp_utc + self.shifts[bisect_right(self.points, timestamp_utc) - 1]
+
+    def localize(self, timestamps):
+        shifts = self.shifts
+        if len(shifts) == 1:
+            shift = shifts[0]
+            return [timestamp + shift for timestamp in timestamps]
+        points = self.points
+        return [
+            timestamp + shifts[bisect_right(points, timestamp) - 1]
+            for timestamp in timestamps
+        ]
+
+
+@lru_cache(maxsize=4096)
+def zone_table(timezone, start, end) -> ZoneTable:
+    """`ZoneTable` for epoch seconds [start, end], best called with day bounds."""
+    points, offsets = zone_offsets(timezone, start, end)
+    return ZoneTable(
+        # the window start is stretched back so earlier instants keep shifts[0]
+        points=(datetime.min,)
+        + tuple(EPOCH + timedelta(seconds=point) for point in points[1:]),
+        shifts=tuple(timedelta(seconds=offset) for offset in offsets),
+    )
+
+
+def window_table(timezone, first: datetime, last: datetime) -> ZoneTable:
+    start, end = epoch_seconds(first) - 1, epoch_seconds(last) + 1
+    # day aligned bounds so stores and chunks of a report share cached tables
+    start, end = start - start % DAY_SECONDS, end - end % DAY_SECONDS + DAY_SECONDS
+    return zone_table(timezone, start, end)
+
+
+def localize(timestamps: list[datetime], timezone) -> list[datetime]:
+    """Naive UTC timestamps to naive local wall clock times in `timezone`."""
+    if not timestamps:
+        return []
+    return window_table(timezone, min(timestamps), max(timestamps)).localize(timestamps)
+
+
+def local_time(moment: datetime, timezone) -> datetime:
+    """Naive local wall clock time of `moment`, naive values being UTC."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return window_table(timezone, moment, moment).to_local(moment)
+
+
+def utc_after(local: datetime, timezone, after: datetime) -> datetime:
+    """Earliest naive UTC time from `after` on whose wall clock reads `local` or later.
+
+    The wall clock steps back when DST ends, so a repeated local time maps to
+    its first instant not before `after`; a local time skipped when DST starts
+    maps to the instant the clock jumps past it.
+    """
+    table = window_table(timezone, after, max(after, local + timedelta(days=1)))
+    first = bisect_right(table.points, after) - 1
+    for index in range(first, len(table.points)):
+        moment = max(table.points[index], after, local - table.shifts[index])
+        if index + 1 == len(table.points) or moment < table.points[index + 1]:
+            return moment
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+# monitor.session builds its engines and Redis clients at import, without
+# connecting; the interval engine itself needs neither. Tests that query run
+# on TEST_DATABASE_URL, a MySQL database they drop and create tables in.
+os.environ.setdefault("DATABASE_URL", "mysql+pymysql://monitor@localhost/monitor")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+if os.environ.get("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """The scoped session on empty tables, timings versions kept in fakeredis."""
+    if not os.environ.get("TEST_DATABASE_URL"):
+        pytest.skip("needs TEST_DATABASE_URL")
+    fakeredis = pytest.importorskip("fakeredis")
+    from monitor import schedule
+    from monitor.model import Base
+    from monitor.session import db_session, engine
+
+    monkeypatch.setattr(
+        schedule, "redis_session", fakeredis.FakeRedis(decode_responses=True)
+    )
+    schedule.schedule_cache.clear()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield db_session
+    db_session.remove()
+    Base.metadata.drop_all(engine)
+    schedule.schedule_cache.clear()
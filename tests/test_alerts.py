@@ -0,0 +1,64 @@
+from datetime import datetime, time, timedelta
+
+from monitor.alerts import AlertEvaluator, LogSink
+from monitor.model import Status
+from monitor.schedule import compile_schedule
+from monitor.zones import utc_after
+
+active, inactive = Status.active, Status.inactive
+
+
+def evaluator(timings=(), timezone="America/New_York", **seconds):
+    evaluator = AlertEvaluator(LogSink(), **seconds)
+    evaluator.timezones = {1: timezone}
+    evaluator.schedules = {1: compile_schedule(timings)}
+    return evaluator
+
+
+def fired(evaluator, now):
+    evaluator.sweep(now)
+    events, evaluator.events = evaluator.events, []
+    return [(event["event"], event["at"]) for event in events]
+
+
+def test_silent_across_fall_back():
+    # New York falls back from 02:00 EDT to 01:00 EST at 06:00 UTC
+    alerts = evaluator(silence_seconds=3600)
+    alerts.on_ping(1, active, datetime(2023, 11, 5, 4, 50))  # 00:50 EDT
+    # 01:50 EDT already, an hour of wall clock after the ping
+    assert alerts.stores[1].deadline == datetime(2023, 11, 5, 5, 50)
+    # a late sweep at 01:30 EST sees 40 minutes, the wall clock ran back
+    assert fired(alerts, datetime(2023, 11, 5, 6, 30)) == []
+    assert alerts.stores[1].deadline == datetime(2023, 11, 5, 6, 50)
+    assert fired(alerts, datetime(2023, 11, 5, 6, 50)) == [
+        ("silent", "2023-11-05T06:50:00")
+    ]
+
+
+def test_down_in_business_hours():
+    # open 09:00 to 17:00 every day, inactive since Tuesday 16:50
+    daily = [(day, time(9), time(17)) for day in range(7)]
+    alerts = evaluator(daily, timezone="UTC", down_seconds=900)
+    alerts.on_ping(1, inactive, datetime(2023, 1, 24, 16, 50))
+    # 10 minutes on Tuesday, the other 5 after Wednesday's opening
+    wednesday = datetime(2023, 1, 25, 9, 5)
+    assert alerts.stores[1].deadline == wednesday
+    assert fired(alerts, wednesday - timedelta(seconds=1)) == []
+    assert fired(alerts, wednesday) == [("down", "2023-01-25T09:05:00")]
+    alerts.on_ping(1, active, wednesday + timedelta(minutes=1))
+    assert [event["event"] for event in alerts.events] == ["up"]
+
+
+def test_utc_after():
+    zone = "America/New_York"
+    # 01:30 happens twice on 2023-11-05, first at 05:30 UTC, then at 06:30 UTC
+    repeated = datetime(2023, 11, 5, 1, 30)
+    assert utc_after(repeated, zone, datetime(2023, 11, 5)) == datetime(
+        2023, 11, 5, 5, 30
+    )
+    assert utc_after(repeated, zone, datetime(2023, 11, 5, 6)) == datetime(
+        2023, 11, 5, 6, 30
+    )
+    # 02:30 is skipped on 2023-03-12, the clock jumps to 03:00 at 07:00 UTC
+    skipped = datetime(2023, 3, 12, 2, 30)
+    assert utc_after(skipped, zone, datetime(2023, 3, 12)) == datetime(2023, 3, 12, 7)
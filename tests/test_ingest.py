@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from monitor.ingest import PingBuffer, parse_pings
+
+START = datetime(2023, 1, 25, 12)
+
+
+def pings(count, start=0):
+    return [
+        {
+            "store_id": store_id,
+            "status": "active",
+            "timestamp_utc": START + timedelta(seconds=store_id),
+        }
+        for store_id in range(start + 1, start + count + 1)
+    ]
+
+
+class Database:
+    """A writer failing with `errors[store_id]` for batches holding that store."""
+
+    def __init__(self, **errors):
+        self.errors = errors
+        self.rows = []
+
+    async def __call__(self, batch):
+        for ping in batch:
+            error = self.errors.get(str(ping["store_id"]))
+            if error == "transient":
+                raise OperationalError("INSERT", {}, Exception("gone away"))
+            if error == "rejected":
+                raise IntegrityError("INSERT", {}, Exception("out of range"))
+            if error == "once":
+                del self.errors[str(ping["store_id"])]
+                raise OperationalError("INSERT", {}, Exception("gone away"))
+        self.rows += batch
+
+
+def run(database, *batches, retries=2):
+    async def main():
+        buffer = PingBuffer(
+            max_pings=100,
+            flush_size=8,
+            flush_interval=0.001,
+            retries=retries,
+            writer=database,
+        )
+        await buffer.start()
+        for batch in batches:
+            await buffer.put(batch, timeout=1)
+        await buffer.stop()
+        return buffer
+
+    return asyncio.run(main())
+
+
+def stored(database):
+    return sorted(ping["store_id"] for ping in database.rows)
+
+
+def test_rejected_pings_are_dead_lettered(caplog):
+    database = Database(**{"3": "rejected", "6": "rejected"})
+    with caplog.at_level(logging.ERROR, logger="monitor.ingest.dead_letter"):
+        buffer = run(database, pings(8), pings(8, start=8))
+    assert stored(database) == [1, 2, 4, 5, 7, 8] + list(range(9, 17))
+    assert [
+        record.getMessage()
+        for record in caplog.records
+        if record.name == "monitor.ingest.dead_letter"
+    ] == [
+        '{"store_id": 3, "status": "active", "timestamp_utc": "2023-01-25T12:00:03"}',
+        '{"store_id": 6, "status": "active", "timestamp_utc": "2023-01-25T12:00:06"}',
+    ]
+    assert buffer.stats["dead_letter_pings"] == 2
+    assert buffer.depth == 0
+
+
+def test_failures_are_retried():
+    database = Database(**{"2": "once"})
+    buffer = run(database, pings(8))
+    assert stored(database) == list(range(1, 9))
+    assert buffer.stats["failed_flushes"] == 1
+    assert buffer.stats["dead_letter_pings"] == 0
+
+
+def test_retries_are_capped():
+    database = Database(**{"2": "transient"})
+    buffer = run(database, pings(8), pings(8, start=8), retries=2)
+    # the failing batch stops holding up the next one
+    assert stored(database) == list(range(9, 17))
+    assert buffer.stats["failed_flushes"] == 3
+    assert buffer.stats["dead_letter_pings"] == 8
+    assert buffer.depth == 0
+
+
+@pytest.mark.parametrize(
+    "ping",
+    [
+        {"store_id": 0, "status": "active", "timestamp_utc": "2023-01-22 12:09:39 UTC"},
+        {"store_id": 2**63, "status": "active", "timestamp_utc": "2023-01-22T12:09"},
+        {"store_id": 1, "status": "active", "timestamp_utc": "1969-12-31T23:59:59Z"},
+        {"store_id": 1, "status": "active", "timestamp_utc": "2038-01-19T03:14:08Z"},
+        {"store_id": 1, "status": "paused", "timestamp_utc": "2023-01-22T12:09"},
+    ],
+)
+def test_unstorable_pings_are_refused(ping):
+    with pytest.raises(ValidationError):
+        parse_pings(json.dumps(ping).encode(), "application/json")
+
+
+def test_parses_pings():
+    ping = {
+        "store_id": 7,
+        "status": "inactive",
+        "timestamp_utc": "2023-01-22T17:39:39+05:30",
+    }
+    assert parse_pings(json.dumps(ping).encode(), "application/json") == [
+        {
+            "store_id": 7,
+            "status": "inactive",
+            "timestamp_utc": datetime(2023, 1, 22, 12, 9, 39),
+        }
+    ]
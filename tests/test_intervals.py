@@ -0,0 +1,102 @@
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from monitor.intervals import interval_times, store_interval_report
+from monitor.model import Status
+from monitor.schedule import Schedule, compile_schedule
+from monitor.windows import DEFAULT_WINDOWS
+
+Ping = namedtuple("Ping", "status timestamp_utc")
+active, inactive = Status.active, Status.inactive
+
+
+def report(pings, schedule, current_time, timezone="UTC", span=timedelta(days=7)):
+    """(hour minutes, day hours, week hours) pairs for pings given oldest first."""
+    pings = sorted(pings, key=lambda ping: ping.timestamp_utc, reverse=True)
+    times = store_interval_report(
+        pings,
+        schedule=schedule,
+        timezone=timezone,
+        current_time=current_time,
+        since=current_time - span,
+        windows=DEFAULT_WINDOWS,
+    )
+    return [tuple(times[index : index + 2]) for index in range(0, len(times), 2)]
+
+
+def test_open_all_day_without_timings():
+    now = datetime(2023, 1, 25, 12)  # a Wednesday
+    pings = [
+        Ping(inactive, datetime(2023, 1, 25, 11)),
+        Ping(active, datetime(2023, 1, 25, 11, 30)),
+    ]
+    # the earliest ping's status also holds back to each window's start
+    assert report(pings, compile_schedule([]), now) == [
+        (30, 30),
+        (0.5, 23.5),
+        (0.5, 167.5),
+    ]
+
+
+def test_overnight_shift():
+    # open 22:00 to 02:00 every night, Sunday's shift closing on Monday
+    schedule = compile_schedule([(day, time(22), time(2)) for day in range(7)])
+    now = datetime(2023, 1, 26, 3)  # Thursday, closed since 02:00
+    pings = [
+        Ping(active, datetime(2023, 1, 25, 21)),
+        Ping(inactive, datetime(2023, 1, 26, 1)),
+    ]
+    # up Wednesday 22:00 to Thursday 01:00, down until the 02:00 close; the
+    # week holds seven four hour shifts, six of them before the first ping
+    assert report(pings, schedule, now) == [(0, 0), (3, 1), (27, 1)]
+
+
+def test_dst_fall_back():
+    # New York falls back from 02:00 EDT to 01:00 EST at 06:00 UTC
+    now = datetime(2023, 11, 5, 8)  # 03:00 EST
+    pings = [
+        Ping(active, datetime(2023, 11, 5, 4, 30)),  # 00:30 EDT
+        Ping(inactive, datetime(2023, 11, 5, 6, 30)),  # 01:30 EST
+    ]
+    # windows are wall clock spans, the day one back to 03:00 EDT (25 real
+    # hours) and the week one to 04:00 EDT, seven real days back where the
+    # pings read start; the repeated hour counts once
+    assert report(pings, compile_schedule([]), now, "America/New_York") == [
+        (0, 60),
+        (22.5, 1.5),
+        (165.5, 1.5),
+    ]
+
+
+def test_dst_step_back_between_pings():
+    now = datetime(2023, 11, 5, 8)
+    pings = [
+        Ping(active, datetime(2023, 11, 5, 5, 45)),  # 01:45 EDT
+        Ping(inactive, datetime(2023, 11, 5, 6, 15)),  # 01:15 EST, earlier on the wall
+    ]
+    # no time passes until the wall clock is back at 01:45
+    assert report(pings, compile_schedule([]), now, "America/New_York") == [
+        (0, 60),
+        (22.75, 1.25),
+        (165.75, 1.25),
+    ]
+
+
+def test_store_with_no_hours():
+    now = datetime(2023, 1, 25, 12)
+    pings = [Ping(active, datetime(2023, 1, 25, 11))]
+    assert report(pings, Schedule.from_intervals([]), now) == [(0, 0)] * 3
+
+
+def test_no_pings():
+    assert (
+        interval_times(
+            [],
+            [],
+            compile_schedule([]),
+            current_time=datetime(2023, 1, 25, 12),
+            since=datetime(2023, 1, 18, 12),
+            windows=DEFAULT_WINDOWS,
+        )
+        == [0.0, 0.0] * 3
+    )
@@ -0,0 +1,111 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from monitor import jobs, worker
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis runs the Lua scripts with it
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(jobs, "redis_session", client)
+    for script in (jobs.claim_script, jobs.requeue_script, jobs.complete_script):
+        monkeypatch.setattr(script, "registered_client", client)
+    return client
+
+
+def plan_task(report_id="r1"):
+    return jobs.encode_task({"report_id": report_id, "kind": "plan"})
+
+
+def queued(redis):
+    return redis.lrange(jobs.REDIS_REPORT_TASKS, 0, -1)
+
+
+def leased(redis):
+    return redis.zrange(jobs.REDIS_REPORT_LEASES, 0, -1)
+
+
+def test_claim_leases_the_task(redis):
+    jobs.enqueue_report("r1", mode="python", current_time=datetime(2023, 1, 25))
+    assert jobs.job_state("r1")["status"] == "pending"
+    encoded, task = jobs.claim_task()
+    assert task == {"report_id": "r1", "kind": "plan"}
+    assert queued(redis) == [] and leased(redis) == [encoded]
+    assert redis.exists(jobs.alive_key("r1"))
+    assert jobs.claim_task() is None
+    # a live lease is not requeued, and can be extended and released
+    assert jobs.requeue_expired() == 0
+    assert jobs.extend_lease(encoded)
+    assert jobs.release_task(encoded)
+    assert leased(redis) == [] and not jobs.extend_lease(encoded)
+
+
+def test_expired_leases_are_requeued(redis, monkeypatch):
+    jobs.enqueue_report("r1", mode="python", current_time=datetime(2023, 1, 25))
+    monkeypatch.setattr(jobs, "REPORT_LEASE_SECONDS", -1)
+    encoded, _ = jobs.claim_task()
+    assert jobs.requeue_expired() == 1
+    assert queued(redis) == [encoded] and leased(redis) == []
+    # the worker that lost the lease can neither extend it nor store its rows
+    assert not jobs.extend_lease(encoded)
+    assert jobs.complete_shard(encoded, "r1", 0, [[1, 2.0]]) == -1
+    assert not redis.exists(jobs.results_key("r1"))
+
+
+def test_completed_shards_are_counted(redis):
+    shards = [(1, 10), (11, 20)]
+    jobs.enqueue_shards("r1", shards)
+    claimed = [jobs.claim_task(), jobs.claim_task()]
+    for index, (encoded, task) in enumerate(claimed):
+        assert task["index"] == index
+        assert jobs.complete_shard(encoded, "r1", index, [[task["first"]]]) == index + 1
+    assert list(jobs.shard_results("r1")) == [[[1]], [[11]]]
+    assert leased(redis) == []
+
+
+def test_failing_task_fails_the_report(redis, monkeypatch):
+    outcomes = []
+
+    def plan_report(report_id, job):
+        raise RuntimeError("no database")
+
+    def update_report_status(report_id, status, filename=None, profile=None):
+        outcomes.append((report_id, status))
+
+    monkeypatch.setattr(worker, "plan_report", plan_report)
+    monkeypatch.setattr(worker, "update_report_status", update_report_status)
+    jobs.enqueue_report("r1", mode="python", current_time=datetime(2023, 1, 25))
+    attempts = 0
+    while (claimed := jobs.claim_task()) is not None:
+        attempts += 1
+        worker.run_task(*claimed)
+    assert attempts == worker.REPORT_TASK_RETRIES + 1
+    assert outcomes == [("r1", "failed")]
+    assert jobs.job_state("r1")["status"] == "failed"
+    assert queued(redis) == [] and leased(redis) == []
+    assert not redis.exists(jobs.alive_key("r1"))
+
+
+def test_tasks_of_ended_reports_are_dropped(redis):
+    jobs.enqueue_report("r1", mode="python", current_time=datetime(2023, 1, 25))
+    jobs.finish_job("r1", "failed")
+    encoded, task = jobs.claim_task()
+    worker.run_task(encoded, task)
+    assert queued(redis) == [] and leased(redis) == []
+    assert "attempts:plan:0" not in jobs.job_state("r1")
+
+
+def test_task_encoding_is_stable():
+    task = {"report_id": "r1", "kind": "shard", "index": 2, "first": 1, "last": 9}
+    reordered = dict(reversed(task.items()))
+    assert jobs.encode_task(task) == jobs.encode_task(reordered)
+    assert json.loads(jobs.encode_task(task)) == task
+    assert (
+        jobs.task_name(task) == "shard:2"
+        and jobs.task_name({"kind": "plan"}) == "plan:0"
+    )
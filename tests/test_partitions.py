@@ -0,0 +1,39 @@
+from datetime import date
+
+from monitor.partitions import (
+    days_after,
+    partition_day,
+    partition_name,
+    reorganize_statement,
+)
+
+
+def test_partition_names():
+    assert partition_name(date(2024, 2, 9)) == "p20240209"
+    assert partition_day("p20240209") == date(2024, 2, 9)
+
+
+def test_days_after_cross_months_and_years():
+    assert days_after(date(2023, 12, 30), date(2024, 1, 2)) == [
+        date(2023, 12, 31),
+        date(2024, 1, 1),
+        date(2024, 1, 2),
+    ]
+    assert days_after(date(2024, 2, 28), date(2024, 3, 1)) == [
+        date(2024, 2, 29),
+        date(2024, 3, 1),
+    ]
+    assert days_after(date(2024, 1, 2), date(2024, 1, 2)) == []
+    assert days_after(date(2024, 1, 5), date(2024, 1, 2)) == []
+
+
+def test_reorganize_statement():
+    # each day's partition holds timestamps before the next midnight
+    assert reorganize_statement([date(2023, 12, 31), date(2024, 1, 1)]) == (
+        "ALTER TABLE store_pings REORGANIZE PARTITION pmax INTO ("
+        "PARTITION p20231231 VALUES LESS THAN "
+        "(UNIX_TIMESTAMP('2024-01-01 00:00:00')), "
+        "PARTITION p20240101 VALUES LESS THAN "
+        "(UNIX_TIMESTAMP('2024-01-02 00:00:00')), "
+        "PARTITION pmax VALUES LESS THAN MAXVALUE)"
+    )
@@ -0,0 +1,204 @@
+import asyncio
+
+import pytest
+
+from monitor import jobs, parallel, profiling
+from monitor.profiling import (
+    Profile,
+    current_profile,
+    profiled,
+    record_chunk,
+    record_report,
+    render_metrics,
+    render_pool_metrics,
+    stage,
+    timed,
+)
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def chunk_report(timezones, current_time):
+    """A bulk report doing a stage per store and recording its chunk."""
+    rows = []
+    for store_id in timezones:
+        with stage("compute"):
+            rows.append([store_id, current_time])
+    record_chunk(rows)
+    return rows
+
+
+CHUNKS = [{1: "UTC", 2: "UTC"}, {3: "UTC"}, {4: "UTC", 5: "UTC", 6: "UTC"}]
+
+
+def test_stages_outside_a_run_are_ignored():
+    assert current_profile.get() is None
+    with stage("compute"):
+        pass
+    record_chunk([1, 2])
+    assert list(timed(iter([1, 2]), "fetch")) == [1, 2]
+
+
+def test_profiled_collects_stages_and_chunks():
+    with profiled() as profile:
+        assert list(timed(iter("ab"), "fetch")) == ["a", "b"]
+        for chunk in CHUNKS:
+            chunk_report(chunk, current_time=0)
+    assert current_profile.get() is None
+    summary = profile.as_dict()
+    assert summary["chunk_rows"] == [2, 1, 3]
+    assert summary["stages"]["compute"]["calls"] == 6
+    # one fetch per item and one for the end of the iterator
+    assert summary["stages"]["fetch"]["calls"] == 3
+
+
+def test_threads_add_to_the_run_profile():
+    with profiled() as profile:
+        rows = list(
+            parallel.concurrent_reports(
+                chunk_report, CHUNKS, current_time=0, concurrency=3
+            )
+        )
+    assert [len(chunk) for chunk in rows] == [2, 1, 3]
+    assert sorted(profile.chunk_rows) == [1, 2, 3]
+    assert profile.stages["compute"][0] == 6
+
+
+def test_pool_processes_send_their_profiles_back(monkeypatch):
+    monkeypatch.setattr(parallel, "REPORT_START_METHOD", "fork")
+    with profiled() as profile:
+        rows = list(
+            parallel.parallel_reports(chunk_report, CHUNKS, current_time=0, workers=2)
+        )
+    assert [len(chunk) for chunk in rows] == [2, 1, 3]
+    # merged in submission order
+    assert profile.chunk_rows == [2, 1, 3]
+    assert profile.stages["compute"][0] == 6
+    assert profile.as_dict()["peak_rss_bytes"] > 0
+
+
+def test_queue_task_profiles_merge_into_the_report(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(jobs, "redis_session", client)
+    for index, chunk in enumerate(CHUNKS):
+        with profiled() as profile:
+            chunk_report(chunk, current_time=0)
+            profile.query(0.25)
+            profile.pool_wait(0.5)
+        task = {"report_id": "r1", "kind": "shard", "index": index}
+        jobs.record_profile(task, profile.as_dict())
+    report = Profile()
+    with profiled(profile=report):
+        record_chunk([])  # the merge's own work
+    for task_profile in jobs.job_profiles(jobs.job_state("r1")):
+        report.merge(task_profile)
+    summary = report.as_dict()
+    assert sorted(summary["chunk_rows"]) == [0, 1, 2, 3]
+    assert summary["stages"]["compute"]["calls"] == 6
+    assert summary["db"] == {
+        "queries": 3,
+        "seconds": 0.75,
+        "max_seconds": 0.25,
+        "pool_waits": 3,
+        "pool_wait_seconds": 1.5,
+    }
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(profiling, "redis_session", client)
+    monkeypatch.setattr(
+        profiling,
+        "async_redis",
+        fakeredis.aioredis.FakeRedis(server=server, decode_responses=True),
+    )
+    return client
+
+
+def test_render_metrics(redis):
+    profile = {
+        "stages": {"compute": {"calls": 4, "seconds": 1.5}},
+        "chunk_rows": [2, 3],
+        "db": {
+            "queries": 7,
+            "seconds": 0.5,
+            "max_seconds": 0.25,
+            "pool_waits": 1,
+            "pool_wait_seconds": 0.125,
+        },
+        "peak_rss_bytes": 1024,
+    }
+    record_report(profile, "finished", 2.0)
+    record_report(profile, "failed", 1.0)
+    redis.hset(profiling.REDIS_REPORT_METRICS, "unknown", 1)
+    assert render_metrics(redis.hgetall(profiling.REDIS_REPORT_METRICS)) == (
+        "# HELP report_runs_total Report runs by final status.\n"
+        "# TYPE report_runs_total counter\n"
+        'report_runs_total{status="failed"} 1\n'
+        'report_runs_total{status="finished"} 1\n'
+        "# HELP report_run_seconds_total Seconds spent in report runs.\n"
+        "# TYPE report_run_seconds_total counter\n"
+        "report_run_seconds_total 3\n"
+        "# HELP report_stage_calls_total Times a report stage ran.\n"
+        "# TYPE report_stage_calls_total counter\n"
+        'report_stage_calls_total{stage="compute"} 8\n'
+        "# HELP report_stage_seconds_total Seconds spent per report stage.\n"
+        "# TYPE report_stage_seconds_total counter\n"
+        'report_stage_seconds_total{stage="compute"} 3\n'
+        "# HELP report_chunks_total Report chunks computed.\n"
+        "# TYPE report_chunks_total counter\n"
+        "report_chunks_total 4\n"
+        "# HELP report_rows_total Report rows computed.\n"
+        "# TYPE report_rows_total counter\n"
+        "report_rows_total 10\n"
+        "# HELP report_db_queries_total Database round trips of report runs.\n"
+        "# TYPE report_db_queries_total counter\n"
+        "report_db_queries_total 14\n"
+        "# HELP report_db_seconds_total"
+        " Seconds spent in database round trips of report runs.\n"
+        "# TYPE report_db_seconds_total counter\n"
+        "report_db_seconds_total 1\n"
+        "# HELP report_db_pool_wait_seconds_total"
+        " Seconds report runs waited for a pooled database connection.\n"
+        "# TYPE report_db_pool_wait_seconds_total counter\n"
+        "report_db_pool_wait_seconds_total 0.25\n"
+        "# HELP report_last_run_seconds Duration of the last report run.\n"
+        "# TYPE report_last_run_seconds gauge\n"
+        "report_last_run_seconds 1.0\n"
+        "# HELP report_last_peak_rss_bytes"
+        " Peak resident memory of the last report run's processes.\n"
+        "# TYPE report_last_peak_rss_bytes gauge\n"
+        "report_last_peak_rss_bytes 1024\n"
+    )
+
+
+def test_metrics_endpoint(redis):
+    record_report(
+        {
+            "stages": {},
+            "chunk_rows": [],
+            "db": {"queries": 0, "seconds": 0, "pool_wait_seconds": 0},
+            "peak_rss_bytes": 0,
+        },
+        "finished",
+        1.0,
+    )
+    response = asyncio.run(profiling.metrics())
+    text = response.body.decode()
+    assert response.media_type == "text/plain; version=0.0.4"
+    assert 'report_runs_total{status="finished"} 1\n' in text
+    assert "report_stage_calls_total" not in text  # no samples, no family
+    assert text == render_metrics(redis.hgetall(profiling.REDIS_REPORT_METRICS)) + (
+        render_pool_metrics(
+            {"sync": profiling.engine.pool, "async": profiling.async_engine.pool}
+        )
+    )
+
+
+def test_pool_metrics_skip_unsized_pools():
+    class NullPool:
+        pass
+
+    assert render_pool_metrics({"sync": NullPool()}) == ""
@@ -0,0 +1,80 @@
+import json
+from datetime import datetime, time, timedelta
+
+import pytest
+
+from monitor import rollup
+from monitor.main import bulk_store_report
+from monitor.model import RollupCheckpoints, Status, StorePings, StoreTimings
+
+NOW = datetime(2023, 1, 25, 18)  # on the hour, day and week windows line up
+TIMEZONES = {1: "UTC", 2: "America/New_York", 3: "Asia/Kolkata"}
+TIMINGS = [
+    # store 1 has none and is open all day
+    *[(2, day, time(22), time(2)) for day in range(7)],  # overnight shifts
+    *[(3, day, time(9), time(17, 30)) for day in range(5)],  # weekend open all day
+]
+
+
+def fleet_pings():
+    """Pings of every store over eight days, about every 37 minutes."""
+    pings = []
+    for store_id in TIMEZONES:
+        moment = NOW - timedelta(days=8, seconds=store_id * 101)
+        while moment < NOW:
+            status = Status.inactive if len(pings) % 5 == 0 else Status.active
+            pings.append(
+                {"store_id": store_id, "status": status, "timestamp_utc": moment}
+            )
+            moment += timedelta(minutes=37, seconds=len(pings) % 23)
+    for ping_id, ping in enumerate(pings, start=1):
+        ping["id"] = ping_id
+    return pings
+
+
+@pytest.fixture
+def fleet(database, monkeypatch):
+    monkeypatch.setattr(rollup, "get_timezones", lambda: TIMEZONES)
+    database.add_all(
+        StoreTimings(
+            store_id=store_id, day=day, start_time_local=start, end_time_local=end
+        )
+        for store_id, day, start, end in TIMINGS
+    )
+    database.commit()
+    return database
+
+
+def insert(session, pings):
+    session.bulk_insert_mappings(StorePings, pings)
+    session.commit()
+
+
+def assert_matches_python_mode():
+    rows = rollup.bulk_rollup_report(TIMEZONES, NOW)
+    assert [row[0] for row in rows] == list(TIMEZONES)
+    assert rows == bulk_store_report(TIMEZONES, NOW)
+
+
+def test_matches_python_mode(fleet):
+    pings = fleet_pings()
+    insert(fleet, pings[: len(pings) // 2])
+    rollup.update_rollups(chunk_size=2)
+    insert(fleet, pings[len(pings) // 2 :])
+    rollup.update_rollups(chunk_size=2)
+    assert rollup.update_rollups(chunk_size=2) == 0
+    assert_matches_python_mode()
+
+
+def test_late_commits_are_rolled_up(fleet):
+    pings = fleet_pings()
+    # ids handed out to inserts that commit after a run saw later ones
+    late = pings[100:110]
+    insert(fleet, pings[:100] + pings[110:])
+    rollup.update_rollups()
+    checkpoint = fleet.get(RollupCheckpoints, rollup.CHECKPOINT_NAME)
+    assert [gap[:2] for gap in json.loads(checkpoint.gaps)] == [[101, 110]]
+    insert(fleet, late)
+    assert rollup.update_rollups() == len(late)
+    assert json.loads(checkpoint.gaps) == []
+    assert_matches_python_mode()
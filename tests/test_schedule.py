@@ -0,0 +1,152 @@
+import math
+from collections import namedtuple
+from datetime import datetime, time
+
+import pytest
+
+from monitor import schedule
+from monitor.schedule import (
+    DAY_SECONDS,
+    WEEK_SECONDS,
+    ScheduleCache,
+    compile_schedule,
+)
+
+Timing = namedtuple("Timing", "store_id day start_time_local end_time_local")
+HOUR = 3600
+
+
+def daily(start, end, days=range(7)):
+    return [(day, time(start), time(end)) for day in days]
+
+
+def test_day_shifts():
+    nine_to_five = compile_schedule(daily(9, 17))
+    assert nine_to_five.weekly_seconds == 7 * 8 * HOUR
+    # Tuesday 1970-01-06, both ends inclusive
+    assert nine_to_five.is_open(datetime(1970, 1, 6, 9))
+    assert nine_to_five.is_open(datetime(1970, 1, 6, 17))
+    assert not nine_to_five.is_open(datetime(1970, 1, 6, 17, 1))
+    assert (
+        nine_to_five.open_seconds(datetime(1970, 1, 6, 8), datetime(1970, 1, 7, 10))
+        == 9 * HOUR
+    )
+
+
+def test_overnight_shift_wraps_into_monday():
+    # every day 22:00 to 02:00, Sunday's shift closing on Monday
+    night = compile_schedule(daily(22, 2))
+    assert night.weekly_seconds == 7 * 4 * HOUR
+    assert night.opens[0] == 0 and night.closes[0] == 2 * HOUR
+    sunday = 6 * DAY_SECONDS
+    assert night.is_open_at(sunday + 23 * HOUR)
+    assert night.is_open_at(WEEK_SECONDS + HOUR)  # next Monday 01:00
+    assert not night.is_open_at(WEEK_SECONDS + 3 * HOUR)
+    # Sunday 21:00 to Monday 03:00 spans the week boundary
+    assert night.open_seconds_between(sunday + 21 * HOUR, WEEK_SECONDS + 3 * HOUR) == (
+        4 * HOUR
+    )
+
+
+def test_open_seconds_across_weeks():
+    nine_to_five = compile_schedule(daily(9, 17, days=range(5)))
+    # weekends have no rows and are open all day
+    week = 5 * 8 * HOUR + 2 * 24 * HOUR
+    assert nine_to_five.weekly_seconds == week
+    assert nine_to_five.open_seconds_between(
+        10 * HOUR, 2 * WEEK_SECONDS + 10 * HOUR
+    ) == (2 * week)
+    assert nine_to_five.open_seconds_between(HOUR, HOUR) == 0
+    assert nine_to_five.open_seconds_between(2 * HOUR, HOUR) == 0
+
+
+def test_several_shifts_a_day():
+    split = compile_schedule(
+        [(day, time(8), time(12)) for day in range(7)]
+        + [(day, time(14), time(18)) for day in range(7)]
+    )
+    assert split.weekly_seconds == 7 * 8 * HOUR
+    assert not split.is_open_at(13 * HOUR)
+    assert split.open_seconds_between(0, DAY_SECONDS) == 8 * HOUR
+
+
+def test_open_after():
+    nine_to_five = compile_schedule(daily(9, 17))
+    # an hour of open time from Monday 16:30 ends Tuesday 09:30
+    assert nine_to_five.open_after(16.5 * HOUR, HOUR) == DAY_SECONDS + 9.5 * HOUR
+    # from a closed instant the count starts at the next opening
+    assert nine_to_five.open_after(20 * HOUR, HOUR) == DAY_SECONDS + 10 * HOUR
+    # ending exactly on a close stays on that close
+    assert nine_to_five.open_after(9 * HOUR, 8 * HOUR) == 17 * HOUR
+    # a full week of open time lands a week later
+    assert nine_to_five.open_after(10 * HOUR, 7 * 8 * HOUR) == WEEK_SECONDS + 10 * HOUR
+
+
+def test_open_after_wraps_the_week():
+    night = compile_schedule(daily(22, 2))
+    sunday = 6 * DAY_SECONDS
+    # from Sunday 23:00 the shift runs on until Monday 02:00
+    assert night.open_after(sunday + 23 * HOUR, 2 * HOUR) == WEEK_SECONDS + HOUR
+    assert night.open_after(sunday + 23 * HOUR, 3 * HOUR) == WEEK_SECONDS + 2 * HOUR
+    assert night.open_after(sunday + 23 * HOUR, 4 * HOUR) == WEEK_SECONDS + 23 * HOUR
+    # the amount is always the open time in between
+    for start in range(0, 2 * WEEK_SECONDS, 5 * HOUR):
+        for seconds in (HOUR, 6 * HOUR, 30 * HOUR):
+            end = night.open_after(start, seconds)
+            assert night.open_seconds_between(start, end) == seconds
+
+
+def test_never_open():
+    closed = compile_schedule(daily(0, 0))
+    assert closed.weekly_seconds == 0
+    assert closed.open_seconds_between(0, WEEK_SECONDS) == 0
+    assert closed.open_after(0, HOUR) == math.inf
+
+
+@pytest.fixture
+def timings(monkeypatch):
+    """Timing rows of a fake `query_store_timings` that can run a hook mid-query."""
+    rows = {1: [Timing(1, 0, time(9), time(17))]}
+    hooks = []
+
+    def query_store_timings(store_ids):
+        for hook in hooks:
+            hook()
+        return [row for store_id in store_ids for row in rows.get(store_id, [])]
+
+    class Redis:
+        def get(self, key):
+            return b"1"
+
+    monkeypatch.setattr(schedule, "query_store_timings", query_store_timings)
+    monkeypatch.setattr(schedule, "redis_session", Redis())
+    return rows, hooks
+
+
+def test_cache_serves_loaded_rows(timings):
+    rows, hooks = timings
+    cache = ScheduleCache(ttl=60)
+    assert cache.store_timings([1, 2]) == {1: {0: (time(9), time(17))}}
+    assert cache.store_schedules([2])[2].weekly_seconds == WEEK_SECONDS
+    rows[1] = [Timing(1, 0, time(10), time(11))]
+    # cached until cleared
+    assert cache.store_timings([1]) == {1: {0: (time(9), time(17))}}
+    cache.clear()
+    assert cache.store_timings([1]) == {1: {0: (time(10), time(11))}}
+
+
+def test_clear_during_load_keeps_stale_rows_out(timings):
+    rows, hooks = timings
+    cache = ScheduleCache(ttl=60)
+
+    def edit_and_clear():
+        # the timings change and another thread clears while this query runs
+        rows[1] = [Timing(1, 0, time(10), time(11))]
+        cache.clear()
+
+    hooks.append(edit_and_clear)
+    cache.store_schedules([1])
+    hooks.clear()
+    assert cache.rows == {} and cache.schedules == {}
+    assert cache.store_schedules([1])[1].is_open_at(10.5 * HOUR)
+    assert not cache.store_schedules([1])[1].is_open_at(9.5 * HOUR)
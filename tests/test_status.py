@@ -0,0 +1,109 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+from monitor import status
+from monitor.model import Status
+from monitor.status import CachedPing, PingCache
+
+Row = namedtuple("Row", "store_id status timestamp_utc")
+active, inactive = Status.active, Status.inactive
+NOW = datetime(2023, 1, 25, 12)
+
+
+def timestamp(row):
+    return row.timestamp_utc
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """Rows served by a fake `stream_store_pings`, which counts the loads."""
+    rows = {1: [Row(1, active, NOW - timedelta(hours=2))]}
+    loads = []
+
+    def stream_store_pings(store_ids, since):
+        loads.append(list(store_ids))
+        for store_id in store_ids:
+            if rows.get(store_id):
+                # newest first, like the ping query
+                yield store_id, sorted(rows[store_id], reverse=True, key=timestamp)
+
+    monkeypatch.setattr(status, "stream_store_pings", stream_store_pings)
+    return rows, loads
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(status, "clock", clock)
+    return clock
+
+
+def pings(cache, store_ids=(1,)):
+    return cache.pings(list(store_ids), since=NOW - timedelta(days=7), until=NOW)
+
+
+def test_reloads_after_ttl(database, clock):
+    rows, loads = database
+    cache = PingCache(max_stores=10, ttl=60)
+    assert pings(cache) == {1: [CachedPing(NOW - timedelta(hours=2), active)]}
+    # written by another process, unseen until the entry expires
+    rows[1].append(Row(1, inactive, NOW - timedelta(hours=1)))
+    clock.now = 60
+    assert len(pings(cache)[1]) == 1
+    clock.now = 60.5
+    assert [ping.status for ping in pings(cache)[1]] == [inactive, active]
+    assert loads == [[1], [1]]
+
+
+def test_drops_least_recently_used(database, clock):
+    _, loads = database
+    cache = PingCache(max_stores=2, ttl=60)
+    pings(cache, [1, 2])
+    pings(cache, [1])
+    pings(cache, [3])  # evicts store 2, used before store 1
+    pings(cache, [1, 2])
+    assert loads == [[1, 2], [3], [2]]
+
+
+def test_add_merges_written_pings(database, clock):
+    cache = PingCache(max_stores=10, ttl=60)
+    pings(cache, [1, 2])
+    cache.add(
+        [
+            {"store_id": 1, "status": "inactive", "timestamp_utc": NOW},
+            # older than the cached ping, written late
+            {
+                "store_id": 1,
+                "status": "inactive",
+                "timestamp_utc": NOW - timedelta(hours=3),
+            },
+            # already in the load that raced with the write
+            {
+                "store_id": 1,
+                "status": "active",
+                "timestamp_utc": NOW - timedelta(hours=2),
+            },
+            {"store_id": 2, "status": "active", "timestamp_utc": NOW},
+            {"store_id": 3, "status": "active", "timestamp_utc": NOW},  # not cached
+        ]
+    )
+    found = cache.pings(
+        [1, 2], since=NOW - timedelta(days=7), until=NOW + timedelta(hours=1)
+    )
+    assert found[1] == [
+        CachedPing(NOW, inactive),
+        CachedPing(NOW - timedelta(hours=2), active),
+        CachedPing(NOW - timedelta(hours=3), inactive),
+    ]
+    assert found[2] == [CachedPing(NOW, active)]
+    assert 3 not in cache.stores
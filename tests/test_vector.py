@@ -0,0 +1,90 @@
+import random
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from monitor import main, queries, vectorized
+from monitor.main import bulk_store_report
+from monitor.model import Status
+from monitor.vectorized import bulk_vector_report
+
+Row = namedtuple("Row", "status timestamp_utc store_id")
+NOW = datetime(2023, 11, 6, 12)  # the day after New York falls back
+TIMEZONES = {
+    1: "America/New_York",
+    2: "America/Chicago",
+    3: "Asia/Kolkata",
+}
+TIMINGS = {
+    # daytime hours through the fall back night
+    1: {day: (time(0), time(12, 30)) for day in range(7)},
+    # overnight shifts, which valid_ping never counts, and one day shift
+    2: {
+        **{day: (time(22), time(2)) for day in range(6)},
+        6: (time(9, 15), time(17, 45)),
+    },
+    # 3 has no timings and is open all day
+}
+
+
+def pings(seed=7):
+    """Rows of every store, by store and newest first like `ping_query`."""
+    rows = []
+    generator = random.Random(seed)
+    for store_id in TIMEZONES:
+        moment = NOW - timedelta(days=8)
+        while moment < NOW:
+            moment += timedelta(minutes=generator.randint(5, 70))
+            status = generator.choice([Status.active, Status.active, Status.inactive])
+            rows.append(Row(status, moment, store_id))
+    rows.sort(key=lambda row: (row.store_id, -row.timestamp_utc.timestamp()))
+    return rows
+
+
+@pytest.fixture
+def database(monkeypatch):
+    rows = pings()
+
+    def ping_query(store_ids, since, until=None, **kwargs):
+        return [
+            row
+            for row in rows
+            if row.store_id in store_ids
+            and row.timestamp_utc >= since
+            and (until is None or row.timestamp_utc < until)
+        ]
+
+    def load_store_timings(store_ids):
+        return {
+            store_id: TIMINGS[store_id] for store_id in store_ids if store_id in TIMINGS
+        }
+
+    monkeypatch.setattr(queries, "ping_query", ping_query)
+    monkeypatch.setattr(vectorized, "ping_query", ping_query)
+    monkeypatch.setattr(main, "load_store_timings", load_store_timings)
+    monkeypatch.setattr(vectorized, "load_store_timings", load_store_timings)
+
+
+@pytest.mark.parametrize(
+    "current_time",
+    [
+        NOW,
+        NOW - timedelta(days=1, minutes=17),
+        datetime(2023, 11, 5, 6, 40),  # 01:40 EST, the repeated hour
+        datetime(2023, 11, 5, 7, 30),  # 02:30 EST, pings before 02:00 EDT
+    ],
+)
+def test_vector_matches_python(database, current_time):
+    expected = bulk_store_report(TIMEZONES, current_time)
+    assert [row[0] for row in expected] == [1, 2, 3]
+    assert bulk_vector_report(TIMEZONES, current_time) == expected
+
+
+def test_vector_matches_python_from_start(database):
+    start = NOW - timedelta(days=2, hours=5)
+    assert bulk_vector_report(TIMEZONES, NOW, start) == bulk_store_report(
+        TIMEZONES, NOW, start
+    )
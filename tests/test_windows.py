@@ -0,0 +1,104 @@
+from datetime import datetime, time, timedelta
+
+import pytest
+from pydantic import ValidationError
+
+from monitor.model import Status
+from monitor.report import LocalPing
+from monitor.schedule import compile_schedule
+from monitor.windows import parse_windows, window_header, window_times
+
+active, inactive = Status.active, Status.inactive
+NOW = datetime(2023, 1, 25, 12)  # a Wednesday
+
+
+def times(pings, timings, specs):
+    windows = parse_windows(specs)
+    schedule = compile_schedule(
+        (day, start, end) for day, (start, end) in timings.items()
+    )
+    return window_times(
+        sorted(pings, key=lambda ping: ping.local_time, reverse=True),
+        timings,
+        schedule,
+        current_time=NOW,
+        windows=windows,
+        span=max(window.seconds for window in windows),
+    )
+
+
+def test_default_report_without_windows():
+    assert parse_windows([]) is None
+    assert parse_windows(None) is None
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        {"duration": 0},
+        {"duration": -1, "unit": "hours"},
+        {"duration": 1, "unit": "weeks"},
+        {"duration": 1, "mode": "average"},
+        {"unit": "hours"},
+    ],
+)
+def test_invalid_windows(spec):
+    with pytest.raises(ValidationError):
+        parse_windows([spec])
+
+
+def test_columns_follow_the_requested_unit():
+    windows = parse_windows(
+        [
+            {"duration": 60, "unit": "minutes", "mode": "interpolate"},
+            {"duration": 1, "unit": "hours", "mode": "interpolate"},
+            {"duration": 1.5, "unit": "days"},
+        ]
+    )
+    assert window_header(windows) == [
+        "store_id",
+        "uptime_last_60_minutes(in minutes)",
+        "downtime_last_60_minutes(in minutes)",
+        "uptime_last_1_hours(in hours)",
+        "downtime_last_1_hours(in hours)",
+        "uptime_last_1.5_days(in hours)",
+        "downtime_last_1.5_days(in hours)",
+    ]
+
+
+def test_same_window_in_other_units():
+    pings = [
+        LocalPing(inactive, NOW - timedelta(minutes=90)),
+        LocalPing(active, NOW - timedelta(minutes=20)),
+    ]
+    minutes, _, hours, _ = times(
+        pings,
+        {},
+        [
+            {"duration": 60, "unit": "minutes", "mode": "interpolate"},
+            {"duration": 1, "unit": "hours", "mode": "interpolate"},
+        ],
+    )
+    assert (minutes, hours) == (20, 0.33)
+
+
+def test_count_windows_share_one_business_hours_definition():
+    # weekdays 09:00 to 17:00 with an overnight Friday, weekends open all day
+    timings = {day: (time(9), time(17)) for day in range(4)}
+    timings[4] = (time(20), time(2))
+    pings = [
+        LocalPing(active, NOW - timedelta(hours=hours)) for hours in range(0, 200, 5)
+    ]
+    days = range(1, 10)
+    columns = times(
+        pings, timings, [{"duration": count, "unit": "days"} for count in days]
+    )
+    totals = [
+        round(columns[index] + columns[index + 1], 1)
+        for index in range(0, len(columns), 2)
+    ]
+    # Tuesday 12:00 to Wednesday 12:00 holds 5 + 3 business hours
+    assert totals[0] == 8
+    # a week holds every shift once; Friday's night runs into the open Saturday
+    assert totals[6] == 4 * 8 + 4 + 2 * 24
+    assert totals == sorted(totals)